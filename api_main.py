@@ -9,9 +9,13 @@ import ctypes
 import requests
 from collections import defaultdict
 
-from multiprocessing import Process, Manager, Value, Queue
+from multiprocessing import Process, Value, Queue
 
 from whisper_live.trt_server import TranscriptionServer
+from whisper_live.async_server import AsyncTranscriptionServer
+from whisper_live.channels import TranscriptMailbox, UserChannel
+from whisper_live.session_store import create_session_store
+from whisper_live.response_cache import ResponseCache
 # from llm_service import TensorRTLLMEngine  # No longer needed
 from tts_service import WhisperSpeechTTS
 from api_model import CustomLLMAPI
@@ -22,6 +26,23 @@ def parse_arguments():
                         type=str,
                         default="/root/TensorRT-LLM/examples/whisper/whisper_small_en",
                         help='Whisper TensorRT model path')
+    parser.add_argument('--whisper_backend',
+                        type=str,
+                        default="tensorrt",
+                        choices=["tensorrt", "ctranslate2"],
+                        help='Whisper backend, ctranslate2 runs without a GPU')
+    parser.add_argument('--whisper_model',
+                        type=str,
+                        default=None,
+                        help='CTranslate2 Whisper model size or path, e.g. small.en')
+    parser.add_argument('--whisper_device',
+                        type=str,
+                        default="cpu",
+                        help='Device of the ctranslate2 Whisper backend')
+    parser.add_argument('--whisper_compute_type',
+                        type=str,
+                        default=None,
+                        help='Compute type of the ctranslate2 Whisper backend, int8 on cpu by default')
     parser.add_argument('--phi',
                         action="store_true",
                         help='Phi')
@@ -29,28 +50,115 @@ def parse_arguments():
                         type=str,
                         required=True,
                         help='RAGflow API URL')
+    parser.add_argument('--llm_max_connections',
+                        type=int,
+                        default=4,
+                        help='Persistent connections to the LLM server, the maximum of concurrent LLM requests')
+    parser.add_argument('--llm_speculative_stability',
+                        type=int,
+                        default=0,
+                        help='Request the LLM answer once a partial transcript was unchanged this many times, 0 waits for the final transcript')
+    parser.add_argument('--whisper_pool_size',
+                        type=int,
+                        default=1,
+                        help='Number of Whisper TensorRT engines shared by all clients')
+    parser.add_argument('--whisper_max_batch_size',
+                        type=int,
+                        default=8,
+                        help='Maximum number of client audio windows decoded in one Whisper batch')
+    parser.add_argument('--whisper_max_batch_wait',
+                        type=float,
+                        default=0.005,
+                        help='Seconds to collect client audio windows before decoding a Whisper batch')
+    parser.add_argument('--no_vad_batching',
+                        action="store_true",
+                        help='Run the VAD separately for every client instead of in shared batches')
+    parser.add_argument('--whisper_max_rtf',
+                        type=float,
+                        default=0.8,
+                        help='Admit Whisper clients while the projected real-time factor of the decode workers stays below this')
+    parser.add_argument('--whisper_max_latency',
+                        type=float,
+                        default=1.0,
+                        help='Admit Whisper clients while the average decode latency in seconds stays below this')
+    parser.add_argument('--async_server',
+                        action="store_true",
+                        help='Serve all Whisper clients from one asyncio event loop instead of threads per client')
+    parser.add_argument('--session_ttl',
+                        type=float,
+                        default=1800.0,
+                        help='Seconds of inactivity after which a conversation history is dropped')
+    parser.add_argument('--max_sessions',
+                        type=int,
+                        default=1024,
+                        help='Maximum number of conversation histories kept in memory')
+    parser.add_argument('--session_memory_mb',
+                        type=float,
+                        default=64.0,
+                        help='Maximum memory of the conversation histories kept in memory')
+    parser.add_argument('--session_db',
+                        type=str,
+                        default=None,
+                        help='SQLite database shared by the processes that keeps conversation histories across restarts')
+    parser.add_argument('--response_cache',
+                        action="store_true",
+                        help='Replay answers and TTS audio of prompts asked before in the same context')
+    parser.add_argument('--response_cache_db',
+                        type=str,
+                        default=None,
+                        help='SQLite database of the response cache, shared by the processes and kept across restarts')
+    parser.add_argument('--response_cache_ttl',
+                        type=float,
+                        default=86400.0,
+                        help='Seconds after its last use a cached answer or audio expires')
+    parser.add_argument('--response_cache_mb',
+                        type=float,
+                        default=256.0,
+                        help='Maximum memory of the response cache in each process')
+    parser.add_argument('--single_process',
+                        action="store_true",
+                        help='Run STT, LLM client and TTS as stages of one process passing messages by reference')
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = parse_arguments()
-    if not args.whisper_tensorrt_path:
+    if args.whisper_backend == "tensorrt" and not args.whisper_tensorrt_path:
         raise ValueError("Please provide whisper_tensorrt_path to run the pipeline.")
+    if args.whisper_backend == "ctranslate2" and not args.whisper_model:
+        raise ValueError("Please provide whisper_model to run the pipeline with ctranslate2.")
         import sys
         sys.exit(0)
 
     multiprocessing.set_start_method('spawn', force=True)
+
+    # in single process mode the stages are threads of this process: the STT stage serves its
+    # clients from an asyncio loop, and the channels hand messages over without a pipe
+    Stage = threading.Thread if args.single_process else multiprocessing.Process
         
-    manager = Manager()
-    shared_output = manager.list()
     should_send_server_ready = Value(ctypes.c_bool, False)
-    transcription_queue = Queue()
-    llm_queue = manager.dict()
-    audio_queue = manager.dict()
-    conversation_history = {}
+    transcription_queue = TranscriptMailbox(local=args.single_process)
+    llm_queue = UserChannel(local=args.single_process)
+    audio_queue = UserChannel(local=args.single_process)
+    conversation_history = create_session_store(
+        args.session_db,
+        ttl=args.session_ttl,
+        max_sessions=args.max_sessions,
+        max_bytes=int(args.session_memory_mb * 2**20),
+    )
     events = defaultdict()
+    response_cache = None
+    if args.response_cache or args.response_cache_db:
+        response_cache = ResponseCache(
+            args.response_cache_db,
+            ttl=args.response_cache_ttl,
+            max_bytes=int(args.response_cache_mb * 2**20),
+        )
 
-    whisper_server = TranscriptionServer()
-    whisper_process = multiprocessing.Process(
+    if args.async_server or args.single_process:
+        whisper_server = AsyncTranscriptionServer()
+    else:
+        whisper_server = TranscriptionServer()
+    whisper_process = Stage(
         target=whisper_server.run,
         args=(
             "0.0.0.0",
@@ -61,20 +169,41 @@ if __name__ == "__main__":
             should_send_server_ready,
             conversation_history,
             events
-        )
+        ),
+        kwargs={
+            "transcriber_pool_size": args.whisper_pool_size,
+            "max_batch_size": args.whisper_max_batch_size,
+            "max_batch_wait": args.whisper_max_batch_wait,
+            "vad_batching": not args.no_vad_batching,
+            "backend": args.whisper_backend,
+            "whisper_model": args.whisper_model,
+            "device": args.whisper_device,
+            "compute_type": args.whisper_compute_type,
+            "max_rtf": args.whisper_max_rtf,
+            "max_decode_latency": args.whisper_max_latency,
+        }
     )
     whisper_process.start()
 
-    custom_llm_api = CustomLLMAPI(api_url=args.api_url)    
+    custom_llm_api = CustomLLMAPI(
+        api_url=args.api_url,
+        max_connections=args.llm_max_connections,
+        speculative_stability=args.llm_speculative_stability,
+    )
 
-    llm_process = multiprocessing.Process(
+    llm_process = Stage(
         target=custom_llm_api.start,
-        args=("0.0.0.0", 7123, transcription_queue, audio_queue, llm_queue, conversation_history)
+        args=("0.0.0.0", 7123, transcription_queue, audio_queue, llm_queue, conversation_history),
+        kwargs={"response_cache": response_cache}
     )
     llm_process.start()
 
     tts_runner = WhisperSpeechTTS()
-    tts_process = multiprocessing.Process(target=tts_runner.run, args=("0.0.0.0", 8888, audio_queue, should_send_server_ready))
+    tts_process = Stage(
+        target=tts_runner.run,
+        args=("0.0.0.0", 8888, audio_queue, should_send_server_ready),
+        kwargs={"response_cache": response_cache}
+    )
     tts_process.start()
 
     whisper_process.join()
@@ -6,7 +6,13 @@ import json
 import asyncio
 import threading
 import websocket
+import os
 import ssl
+import queue
+import copy
+import itertools
+from collections import deque
+from contextlib import contextmanager
 from queue import Queue
 from websockets.sync.server import serve
 from typing import List, Dict, Any
@@ -14,52 +20,456 @@ from jinja2 import Template
 
 logging.basicConfig(level=logging.INFO)
 
-punc = "！？｡。＂＃＄％.!?＆＇（）＊＋，－／：；＜＝＞＠［＼］＾＿｀｛｜｝～｟｠｢｣､、〃》「」『』【】〔〕〖〗〘〙〚〛〜〝〞〟〰〾〿–—‘’‛“”„‟…‧﹏."
+class SentenceChunker:
+    """
+    Streaming segmenter that turns LLM tokens into text chunks for TTS.
 
+    Tokens are consumed as they arrive, so punctuation split across tokens is found and
+    every character is looked at once, with set lookups. A period only ends a sentence when
+    it is followed by whitespace and does not end an abbreviation or an initial ("Dr.",
+    "J."), so decimals ("3.5") and abbreviations stay in one chunk.
+
+    The first chunk is emitted as early as possible, at the first clause or sentence end
+    after `first_min_words` words, or at a word boundary after `first_max_words` words, so
+    that TTS can start while the LLM is still streaming. Later chunks are sentences of at
+    least `min_words` words, cut at a clause or word boundary beyond `max_words` words.
+
+    Chinese and Japanese text has no spaces: full-width punctuation ends a chunk without
+    a following space and a CJK character counts as half a word.
+    """
+
+    SENTENCE_END = frozenset(".!?…")
+    CJK_SENTENCE_END = frozenset("。！？｡")
+    CLAUSE_END = frozenset(",;:")
+    CJK_CLAUSE_END = frozenset("，、；：､")
+    CLOSING = frozenset("\"')]}”’」』】》）")
+    ABBREVIATIONS = frozenset({
+        "dr", "mr", "mrs", "ms", "prof", "sr", "jr", "st", "vs", "etc", "e.g", "i.e",
+        "approx", "fig", "mt", "inc", "ltd", "mme", "mlle", "sra", "sres",
+    })
+    SPECIAL_TOKENS = ("<|im_end|>", "<|endoftext|>")
+
+    def __init__(self, language="en", first_min_words=3, first_max_words=10, min_words=8, max_words=40):
+        """
+        Initialize a SentenceChunker.
+
+        Args:
+            language (str, optional): Language code of the response. Defaults to "en".
+            first_min_words (int, optional): Words before a clause may end the first chunk. Defaults to 3.
+            first_max_words (int, optional): Words after which the first chunk is cut at a word boundary. Defaults to 10.
+            min_words (int, optional): Minimum words of a later chunk. Defaults to 8.
+            max_words (int, optional): Words after which a later chunk is cut without a sentence end. Defaults to 40.
+        """
+        self.cjk = language in ("zh", "ja")
+        self.first_min_words = first_min_words
+        self.first_max_words = first_max_words
+        self.min_words = min_words
+        self.max_words = max_words
+        self.first = True
+        self.text = ""
+        self._reset_scan()
+
+    def _reset_scan(self):
+        self.scan = 0
+        self.words = 0.0
+        self.last_clause = 0
+        self.last_space = 0
+
+    @staticmethod
+    def is_cjk(char):
+        return "\u3040" <= char <= "\u30ff" or "\u3400" <= char <= "\u9fff" or "\uf900" <= char <= "\ufaff"
+
+    def is_abbreviation(self, end):
+        start = max(self.text.rfind(" ", 0, end), self.text.rfind("\n", 0, end)) + 1
+        word = self.text[start:end].lstrip("\"'([{“‘").lower()
+        return word in self.ABBREVIATIONS or (len(word) == 1 and word.isalpha() and word != "i")
+
+    def _emit(self, end):
+        chunk = self.text[:end].strip()
+        self.text = self.text[end:]
+        self._reset_scan()
+        self.first = False
+        return chunk
+
+    def push(self, token):
+        """
+        Add a token of the response.
+
+        Args:
+            token (str): The token text.
+
+        Returns:
+            List[str]: Chunks completed by the token, possibly none.
+        """
+        self.text += token
+        if "<|" in self.text:
+            # end markers may arrive split over several tokens
+            for special in self.SPECIAL_TOKENS:
+                self.text = self.text.replace(special, "")
+        chunks = []
+        text = self.text
+        # the last character is only looked at once the next one arrived
+        while self.scan < len(text) - 1:
+            i = self.scan
+            char, following = text[i], text[i + 1]
+            self.scan += 1
+            if char.isspace():
+                if i and not text[i - 1].isspace():
+                    self.last_space = i
+                continue
+            if self.cjk and self.is_cjk(char):
+                self.words += 0.5
+            elif i == 0 or text[i - 1].isspace():
+                self.words += 1
+
+            boundary = None
+            if char in self.CJK_SENTENCE_END:
+                boundary = "sentence"
+            elif char in self.CJK_CLAUSE_END:
+                boundary = "clause"
+            elif following.isspace() or following in self.CLOSING:
+                if char in self.SENTENCE_END and not (char == "." and self.is_abbreviation(i)):
+                    boundary = "sentence"
+                elif char in self.CLAUSE_END:
+                    boundary = "clause"
+            if boundary is not None:
+                end = i + 1
+                while end < len(text) and text[end] in self.CLOSING:
+                    end += 1
+                if self.first:
+                    emit = self.words >= self.first_min_words
+                else:
+                    emit = boundary == "sentence" and self.words >= self.min_words
+                if emit:
+                    chunks.append(self._emit(end))
+                    text = self.text
+                    continue
+                if boundary == "clause":
+                    self.last_clause = end
+
+            limit = self.first_max_words if self.first else self.max_words
+            if self.words >= limit:
+                # no sentence end in sight, cut at the last clause or word boundary
+                end = self.last_clause or self.last_space or (i + 1 if self.cjk else 0)
+                if end:
+                    chunks.append(self._emit(end))
+                    text = self.text
+        return [chunk for chunk in chunks if chunk]
+
+    def flush(self):
+        """
+        Return the rest of the response once it ended.
+
+        Returns:
+            List[str]: The last chunk, if any text is left.
+        """
+        chunk = self._emit(len(self.text))
+        return [chunk] if chunk else []
+
+
+HISTORY_HEADER = "<|im_start|> This is the current conversation history between a user and assistant. Note: The conversation history is provided for context. Do not generate responses that involve both the user and the assistant in a loop. Respond only as the assistant.<|im_end|> \n\n"
+# compiled once, rendering a message or the instruction does not parse the template again
+MESSAGE_TEMPLATE = Template("{{ '<|im_start|>' + speaker + '\n' + message | trim + '<|im_end|>\n' }}")
+INSTRUCTION_TEMPLATE = Template("{{ '<|im_start|> Respond in 50 words or less. Answer in' + language +  '<|im_end|> \n <|im_start|> assistant\n'}}")
+
+
+def estimate_tokens(text):
+    """Estimate the number of LLM tokens of a text, about 4 characters per token or 1 per CJK character."""
+    cjk = sum(1 for char in text if "\u3040" <= char <= "\u9fff")
+    return cjk + (len(text) - cjk + 3) // 4
 
-def split_response_on_punctuation(llm_response, punc):
-    # Iterate through the response to find the first punctuation character
-    for char in llm_response:
-        if char in punc:
-            # Split the response based on the first found punctuation character
-            split = llm_response.split(char)
-            return split, char
 
-    # If no punctuation is found, return the original response and None
-    return [llm_response], None
 class ConversationHistory:
-    def __init__(self):
+    """
+    Conversation history rendered into a prompt whose prefix stays the same between turns.
+
+    Every message is rendered once when it is added, and the per-turn instruction comes
+    after the messages, so the prompt of the next turn starts with the prompt of this one
+    up to the instruction and an LLM server with prefix caching only processes the new
+    messages. The oldest messages are dropped against a token budget: once the history
+    exceeds `max_tokens`, it is trimmed to `trim_to` of the budget in one go, so the prefix
+    only changes every few turns instead of on every turn.
+
+    Attributes:
+        max_tokens (int): Token budget of the rendered messages.
+        trim_to (float): Fraction of the budget kept when the history is trimmed.
+        reprocessed_tokens (int): Tokens of the last prompt that were not a prefix of the one before.
+    """
+
+    def __init__(self, max_tokens=1024, trim_to=0.5):
         self.history = []
         self.languages = {"en": "English", "fr": "French", "zh": "Chinese", "es": "Spanish", "ja": "Japanese"}
+        self.max_tokens = max_tokens
+        self.trim_to = trim_to
+        self.rendered = []
+        self.tokens = 0
+        self.last_prompt = ""
+        self.reprocessed_tokens = 0
 
     def add_to_history(self, speaker, message):
-        if len(self.history) > 10:
-            self.history.pop(0)
         self.history.append({"speaker": speaker, "message": message})
+        rendered = MESSAGE_TEMPLATE.render(speaker=speaker, message=message)
+        self.rendered.append((rendered, estimate_tokens(rendered)))
+        self.tokens += self.rendered[-1][1]
+        if self.tokens > self.max_tokens:
+            # the newest message is always kept
+            while len(self.history) > 1 and self.tokens > self.max_tokens * self.trim_to:
+                self.history.pop(0)
+                self.tokens -= self.rendered.pop(0)[1]
 
     def get_formatted_history(self, language, add_generation_prompt=True):
-        template = """<|im_start|> This is the current conversation history between a user and assistant. Note: The conversation history is provided for context. Do not generate responses that involve both the user and the assistant in a loop. Respond only as the assistant.<|im_end|> \n
-        {% for message in messages %}
-        {{ '<|im_start|>' + message['speaker'] + '\n' + message['message'] | trim + '<|im_end|>\n' }}
-        {% endfor %}
-        {{ '<|im_start|> Respond in 50 words or less. Answer in' + language +  '<|im_end|> \n <|im_start|> assistant\n'}}"""
-        t = Template(template)
-        return t.render(messages=self.history, add_generation_prompt=add_generation_prompt, language = self.languages[language])
+        prompt = (
+            HISTORY_HEADER
+            + "".join(rendered for rendered, _ in self.rendered)
+            + INSTRUCTION_TEMPLATE.render(language=self.languages[language])
+        )
+        shared = len(os.path.commonprefix([self.last_prompt, prompt]))
+        self.reprocessed_tokens = estimate_tokens(prompt[shared:])
+        self.last_prompt = prompt
+        return prompt
     
     def clear_history(self):
         self.history = []
+        self.rendered = []
+        self.tokens = 0
+
+
+class LLMConnection:
+    """A persistent websocket to the LLM server, answering framed requests one at a time."""
+
+    def __init__(self, url, timeout=10.0, sslopt=None):
+        self.ws = websocket.WebSocket(sslopt=sslopt)
+        self.ws.connect(url, timeout=timeout)
+        self.ws.settimeout(None)
+        self.request_ids = itertools.count()
+        self.last_used = time.time()
+
+    def request(self, query, conversation=None):
+        """Send a framed request and return its id, the server keeps the KV cache of a conversation's prompt."""
+        request_id = next(self.request_ids)
+        self.ws.send(json.dumps({"id": request_id, "query": query, "conversation": conversation}))
+        return request_id
+
+    def recv(self):
+        """Return the next token of the current request, None once it ended."""
+        message = json.loads(self.ws.recv())
+        if message.get("end"):
+            return None
+        return message["token"]
+
+    def cancel(self, request_id):
+        """Stop a request and read its remaining tokens, so the connection can be reused."""
+        self.ws.send(json.dumps({"id": request_id, "cancel": True}))
+        while self.recv() is not None:
+            pass
+
+    def close(self):
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+
+class LLMConnectionPool:
+    """
+    Pool of persistent websocket connections to one LLM server.
+
+    Opening a connection per utterance put a TCP and websocket handshake (and TLS) on the
+    path to the first token. Connections are kept open between requests instead: an idle
+    connection is health-checked with a ping before reuse once it has been idle for
+    `ping_interval` seconds and closed after `idle_timeout` seconds. At most `max_connections`
+    requests run on the backend at once, further callers wait for a connection.
+
+    Attributes:
+        url (str): The LLM server websocket URL.
+        max_connections (int): Maximum concurrent requests to the backend.
+        num_connects (int): Connections opened so far.
+        num_reused (int): Requests served on an already open connection.
+    """
+
+    def __init__(self, url, max_connections=4, idle_timeout=300.0, ping_interval=15.0, ping_timeout=2.0, connect_timeout=10.0, sslopt=None):
+        self.url = url
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.connect_timeout = connect_timeout
+        self.sslopt = sslopt
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.lock = threading.Lock()
+        self.idle = deque()
+        self.num_connects = 0
+        self.num_reused = 0
+
+    def connect(self):
+        connection = LLMConnection(self.url, timeout=self.connect_timeout, sslopt=self.sslopt)
+        self.num_connects += 1
+        return connection
+
+    def is_healthy(self, connection):
+        """Ping an idle connection and wait for the pong, answering pings of the server."""
+        if not connection.ws.connected:
+            return False
+        idle = time.time() - connection.last_used
+        if idle > self.idle_timeout:
+            return False
+        if idle < self.ping_interval:
+            return True
+        try:
+            connection.ws.ping()
+            connection.ws.settimeout(self.ping_timeout)
+            while True:
+                opcode, _ = connection.ws.recv_data(control_frame=True)
+                if opcode == websocket.ABNF.OPCODE_PONG:
+                    return True
+                if opcode != websocket.ABNF.OPCODE_PING:
+                    # data of an earlier request, the connection is out of sync
+                    return False
+        except Exception:
+            return False
+        finally:
+            if connection.ws.connected:
+                connection.ws.settimeout(None)
+
+    def warm(self, count=1):
+        """Open connections ahead of the first request."""
+        for _ in range(count):
+            try:
+                connection = self.connect()
+            except Exception as e:
+                logging.warning(f"[LLM Client]: Could not open a connection to {self.url}: {e}")
+                return
+            with self.lock:
+                self.idle.append(connection)
+
+    def acquire(self, timeout=None):
+        """
+        Take a healthy connection, opening one if none is idle.
+
+        Raises:
+            TimeoutError: If `max_connections` requests are running for longer than `timeout`.
+        """
+        if not self.slots.acquire(timeout=timeout):
+            raise TimeoutError(f"No free connection to {self.url} within {timeout}s.")
+        try:
+            while True:
+                with self.lock:
+                    connection = self.idle.pop() if self.idle else None
+                if connection is None:
+                    return self.connect()
+                if self.is_healthy(connection):
+                    self.num_reused += 1
+                    return connection
+                connection.close()
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, connection, healthy=True):
+        """Return a connection to the pool, or close it if it failed."""
+        if healthy and connection.ws.connected:
+            connection.last_used = time.time()
+            with self.lock:
+                self.idle.append(connection)
+        else:
+            connection.close()
+        self.slots.release()
+
+    @contextmanager
+    def lease(self, timeout=None):
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        except Exception:
+            self.release(connection, healthy=False)
+            raise
+        self.release(connection)
+
+    def close(self):
+        with self.lock:
+            while self.idle:
+                self.idle.pop().close()
+
+
+class SpeculativeRequest:
+    """
+    An LLM request started on a stable partial transcript, before the final one arrived.
+
+    Its output is held back until the final transcript matches the prompt and `commit` is
+    called, so a wrong guess is cancelled without the user hearing or seeing any of it.
+    """
+
+    def __init__(self, prompt, language, query, message_id):
+        self.prompt = prompt
+        self.language = language
+        self.query = query
+        self.message_id = message_id
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.pending = []
+        self.committed = False
+        self.cancelled = False
+        self.start_time = time.time()
+        self.first_token_time = None
+
+    def run_or_defer(self, action):
+        """Run an output action of the request, or keep it until the request is committed."""
+        with self.lock:
+            if self.cancelled:
+                return
+            if not self.committed:
+                self.pending.append(action)
+                return
+        action()
+
+    def commit(self):
+        """
+        Release the held back output and let the request stream from now on.
+
+        Returns:
+            float: Seconds by which the first token reaches the user earlier than if the request
+                had been sent now.
+        """
+        with self.lock:
+            commit_time = time.time()
+            saved = commit_time - self.start_time
+            if self.first_token_time is not None:
+                saved = min(saved, self.first_token_time - self.start_time)
+            # flushed under the lock, so actions of the running request stay in order
+            for action in self.pending:
+                action()
+            self.pending = []
+            self.committed = True
+        return saved
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            self.pending = []
+        self.event.set()
+
 
 class CustomLLMAPI:
-    def __init__(self, api_url):
+    def __init__(self, api_url, max_connections=4, speculative_stability=0):
         self.api_url = api_url
-        self.last_prompt = ""
+        self.max_connections = max_connections
+        # number of identical partial transcripts after which the answer is requested ahead of
+        # the final transcript, 0 disables speculation
+        self.speculative_stability = speculative_stability
+        self.speculation_stats = {"started": 0, "hits": 0, "misses": 0, "saved": 0.0}
 
-    def start(self, host, port, transcription_queue, audio_queue, llm_queue, conversation_history):
+    def start(self, host, port, transcription_queue, audio_queue, llm_queue, conversation_history, response_cache=None):
         self.transcription_queue = transcription_queue
         self.audio_queue = audio_queue
         self.llm_queue = llm_queue
         self.conversation_history = conversation_history
+        self.response_cache = response_cache
         self.events = {}
+        # this process consumes the transcripts, read them before any user connected
+        self.transcription_queue.start_reader()
+        # connections are opened in this process and kept open between utterances
+        self.pool = LLMConnectionPool(self.api_url, max_connections=self.max_connections)
+        self.pool.warm()
         logging.info(f"STARTING LLM WEBSOCKET")
         with serve(
             functools.partial(self.run, ), 
@@ -67,142 +477,275 @@ class CustomLLMAPI:
             ) as server:
             server.serve_forever()
 
-    def query(self, query, user, message_id, client_socket, language):
+    def query(self, query, user, message_id, client_socket, language, event=None, speculation=None, cache_key=None):
         start = time.time()
-        event = self.events[user]
-        total_response = ""
-        current_response = ""
+        event = event or self.events[user]
+        # a speculative request holds back its output until the final transcript commits it
+        emit = speculation.run_or_defer if speculation else (lambda action: action())
+        chunker = SentenceChunker(language)
+        chunks = []
         llm_queue_feed = ""
         llm_response = ""
+        eos = False
+        infer_time = 0.0
 
         try:
-            ws = websocket.WebSocket()
-                                    
-            ws.connect(self.api_url)
-            ws.send(json.dumps(query))
+            # a pooled connection skips the handshake, the request is framed so that the
+            # connection can be reused once its end message was read
+            with self.pool.lease() as connection:
+                request_id = connection.request(query, conversation=user)
             
-            logging.info(f"[LLM Server]: Successfully Sent: {query}")
+                logging.info(f"[LLM Server]: Successfully Sent: {query}")
             
-            while not event.is_set():
-                try:
-                    client_socket.ping()
-                    client_socket.send("")
-                except Exception as e:
-                    logging.exception(e)
-                    event.set()
+                ended = False
+                while not event.is_set():
+                    try:
+                        client_socket.ping()
+                        client_socket.send("")
+                    except Exception as e:
+                        logging.exception(e)
+                        event.set()
             
-                llm_response =  ws.recv()
-                if not llm_response:
-                    continue
-                self.infer_time = time.time() - start
-                llm_queue_feed += llm_response
-                # if "<|user|>" in llm_queue_feed:
-                #     llm_queue_feed = llm_queue_feed[:-8]
-                if "<|im_end|>" in llm_queue_feed:
-                    self.eos = True
-                    # flag = False
-                    event.set()
-                    llm_queue_feed = llm_queue_feed[:-10]
-                if "<|endoftext|>" in llm_queue_feed:
-                    self.eos = True
-                    event.set()
-                    llm_queue_feed = llm_queue_feed[:-13]
-                if user not in self.llm_queue:
-                    self.llm_queue[user] = []
-                self.llm_queue[user] += [{
-                    "uid": user,
-                    "llm_output": llm_queue_feed,
-                    "eos": self.eos,
-                    "latency": self.infer_time
-                }]
-                
-               
-                split, currPunc = split_response_on_punctuation(llm_response, punc)
+                    llm_response = connection.recv()
+                    if llm_response is None:
+                        ended = True
+                        break
+                    if not llm_response:
+                        continue
+                    infer_time = time.time() - start
+                    if speculation and speculation.first_token_time is None:
+                        speculation.first_token_time = time.time()
+                    llm_queue_feed += llm_response
+                    # if "<|user|>" in llm_queue_feed:
+                    #     llm_queue_feed = llm_queue_feed[:-8]
+                    if "<|im_end|>" in llm_queue_feed:
+                        eos = True
+                        # flag = False
+                        event.set()
+                        llm_queue_feed = llm_queue_feed[:-10]
+                    if "<|endoftext|>" in llm_queue_feed:
+                        eos = True
+                        event.set()
+                        llm_queue_feed = llm_queue_feed[:-13]
+                    emit(functools.partial(self.llm_queue.put, user, {
+                        "uid": user,
+                        "llm_output": llm_queue_feed,
+                        "eos": eos,
+                        "latency": infer_time
+                    }))
                 
-                if currPunc:
-                    current_response += split[0] + currPunc
-                    if not user in self.audio_queue:
-                        self.audio_queue[user] = []
-                    self.audio_queue[user] += [{"message_id": message_id, "llm_output": current_response, "language": language}]
-                    total_response += current_response
-
-                    current_response = ""
-                else:
-                    current_response += llm_response
-                                    
-            ws.close()
-            if self.eos == False:
-                self.eos = True
-                self.llm_queue[user] += [{
-                    "uid": user,
-                    "llm_output": llm_queue_feed,
-                    "eos": self.eos,
-                    "latency": self.infer_time
-                }]
+
+                    # chunks go to TTS as soon as they are complete, the first one early
+                    for chunk in chunker.push(llm_response):
+                        chunks.append(chunk)
+                        emit(functools.partial(self.audio_queue.put, user, {"message_id": message_id, "llm_output": chunk, "language": language}))
+
+                if ended or eos:
+                    # the answer is complete, speak its last words too
+                    for chunk in chunker.flush():
+                        chunks.append(chunk)
+                        emit(functools.partial(self.audio_queue.put, user, {"message_id": message_id, "llm_output": chunk, "language": language}))
+                    if cache_key is not None:
+                        emit(functools.partial(self.response_cache.put_response, cache_key, chunks, llm_queue_feed))
+                if not ended:
+                    # stopped by the end token or by the user speaking, drop the rest of the answer
+                    connection.cancel(request_id)
+                if eos == False:
+                    eos = True
+                    emit(functools.partial(self.llm_queue.put, user, {
+                        "uid": user,
+                        "llm_output": llm_queue_feed,
+                        "eos": eos,
+                        "latency": infer_time
+                    }))
                     
         except Exception as e:
             logging.info(f"Exception: {e}")
             pass
                 
-        self.conversation_history[user].add_to_history("assistant", llm_queue_feed)
-        self.last_prompt = ""  # Reset last prompt after processing
-        self.eos = False  # Reset eos after processing
+        emit(functools.partial(self.finish_response, user, llm_queue_feed))
+
+    def finish_response(self, user, llm_output):
+        history = self.conversation_history.get(user) or ConversationHistory()
+        history.add_to_history("assistant", llm_output)
+        # stored again so that the session store measures and persists the new message
+        self.conversation_history[user] = history
+
+    def replay_response(self, user, message_id, language, response):
+        """Send a cached answer to TTS and the client without querying the LLM."""
+        for chunk in response["chunks"]:
+            self.audio_queue.put(user, {"message_id": message_id, "llm_output": chunk, "language": language})
+        self.llm_queue.put(user, {
+            "uid": user,
+            "llm_output": response["llm_output"],
+            "eos": True,
+            "latency": 0.0
+        })
+        self.finish_response(user, response["llm_output"])
+        self.response_cache.log_stats("[LLM Client]:")
+
+    def cache_key(self, history, prompt, language):
+        if self.response_cache is None:
+            return None
+        # the history already ends with the prompt
+        return self.response_cache.response_key(prompt, language, history.history[:-1])
+
+    def build_query(self, user, prompt, language):
+        """Return a copy of the user's conversation history with the prompt added, and the LLM query for it."""
+        history = copy.deepcopy(self.conversation_history.get(user) or ConversationHistory())
+        history.add_to_history("user", prompt)
+        history_prompt = history.get_formatted_history(language)
+        return history, [{"role": "user", "content": history_prompt}]
 
     def run(self, websocket):
-        options = None
-        message_id = 0
-        while True:
+        options = websocket.recv()
+        options = json.loads(options)
+        user = options["uid"]
+        try:
+            self.serve_user(websocket, user)
+        finally:
+            self.transcription_queue.discard(user)
+            # drops the user's audio in the TTS process, also if no TTS client ever connected
+            self.audio_queue.close(user)
 
-            transcription_output = self.transcription_queue.get()
-            if self.transcription_queue.qsize() != 0:
-                continue
-            
-            prompt = transcription_output['prompt'].strip()
-            user = transcription_output['uid']
+    def speculate(self, websocket, user, prompt, language, message_id):
+        """Request the answer to a stable partial transcript, holding back its output."""
+        history, query = self.build_query(user, prompt, language)
+        speculation = SpeculativeRequest(prompt, language, query, message_id)
+        self.speculation_stats["started"] += 1
+        thread = threading.Thread(
+            target=self.query,
+            args=(query, user, message_id, websocket, language),
+            kwargs={
+                "event": speculation.event,
+                "speculation": speculation,
+                "cache_key": self.cache_key(history, prompt, language),
+            },
+        )
+        thread.start()
+        return speculation
 
-            if not options:
-                options = websocket.recv()
-                options = json.loads(options)
+    def log_speculation(self, hit, saved=0.0):
+        stats = self.speculation_stats
+        stats["hits" if hit else "misses"] += 1
+        stats["saved"] += saved
+        finished = stats["hits"] + stats["misses"]
+        logging.info(
+            f"[LLM Client]: Speculation {'hit' if hit else 'miss'}, hit rate {stats['hits'] / finished:.0%} "
+            f"({stats['hits']}/{finished}), mean latency saved "
+            f"{stats['saved'] / max(stats['hits'], 1):.3f}s"
+        )
 
-            if transcription_output and user in self.events:
-                self.events[user].set()
-            
-            websocket.ping()
-            
-            if user not in self.conversation_history:
-                self.conversation_history[user] = ConversationHistory()
-                
-            if self.last_prompt == prompt and transcription_output["eos"]:
-                self.eos = False
-                if prompt == "Stop." or prompt == "Stop":
-                    message_id += 1
+    def serve_user(self, websocket, user):
+        message_id = 0
+        # the previous transcript of this user, a final equal to it is a stable utterance
+        last_prompt = ""
+        stable_prompt = ""
+        stable_count = 0
+        speculation = None
+        try:
+            while True:
+                # the mailbox only keeps the newest partial transcript and every final one
+                try:
+                    transcription_output = self.transcription_queue.get(user, timeout=1.0)
+                except queue.Empty:
+                    websocket.ping()
                     continue
-                self.conversation_history[user].add_to_history("user", prompt)
-                
-                messages = [{"speaker": "user", "message": prompt}]
-                formatted_prompt = messages[-1]['message']
-                history_prompt = self.conversation_history[user].get_formatted_history(transcription_output["language"], formatted_prompt)
+
+                prompt = transcription_output['prompt'].strip()
+
+                if transcription_output and user in self.events:
+                    self.events[user].set()
+            
+                websocket.ping()
+
+                if prompt == stable_prompt:
+                    stable_count += 1
+                else:
+                    stable_prompt = prompt
+                    stable_count = 1
+                if speculation is not None and (speculation.prompt != prompt or transcription_output["eos"]):
+                    if transcription_output["eos"] and prompt == speculation.prompt:
+                        # the context may have changed since, e.g. an interrupted answer was stored
+                        history, query = self.build_query(user, prompt, speculation.language)
+                        if query == speculation.query and prompt not in ("Stop.", "Stop"):
+                            self.conversation_history[user] = history
+                            self.events[user] = speculation.event
+                            self.log_speculation(True, speculation.commit())
+                            speculation = None
+                            message_id += 1
+                            last_prompt = prompt
+                            continue
+                    # the user kept talking or said something else, the guess is discarded unheard
+                    speculation.cancel()
+                    self.log_speculation(False)
+                    speculation = None
+                if (
+                    self.speculative_stability
+                    and speculation is None
+                    and not transcription_output["eos"]
+                    and stable_count == self.speculative_stability
+                    and prompt
+                    and prompt not in ("Stop.", "Stop")
+                ):
+                    speculation = self.speculate(websocket, user, prompt, transcription_output["language"], message_id)
                 
-                query = [{"role": "user", "content": history_prompt}]
-                logging.info(f"[LLM Client]: Sending request to {self.api_url}")
+                if last_prompt == prompt and transcription_output["eos"]:
+                    if prompt == "Stop." or prompt == "Stop":
+                        message_id += 1
+                        continue
+                    history, query = self.build_query(user, prompt, transcription_output["language"])
+                    self.conversation_history[user] = history
+                    cache_key = self.cache_key(history, prompt, transcription_output["language"])
+                    if cache_key is not None:
+                        response = self.response_cache.get_response(cache_key)
+                        if response is not None:
+                            self.replay_response(user, message_id, transcription_output["language"], response)
+                            message_id += 1
+                            last_prompt = prompt
+                            continue
+                    logging.info(
+                        f"[LLM Client]: Sending request to {self.api_url}, {history.reprocessed_tokens} "
+                        f"prompt tokens not in the previous prompt"
+                    )
                 
-                if user in self.events:
-                    self.events[user].set()
-                self.events[user] = threading.Event()
+                    if user in self.events:
+                        self.events[user].set()
+                    self.events[user] = threading.Event()
                 
-                try:
-                    websocket.ping()
-                except Exception as e:
-                    logging.error(f"[LLM Client]: Websocket is closed: {e}")
+                    try:
+                        websocket.ping()
+                    except Exception as e:
+                        logging.error(f"[LLM Client]: Websocket is closed: {e}")
 
                 
-                try:
-                    thread = threading.Thread(target=self.query, args=(query, user, message_id, websocket, transcription_output["language"]))
-                    thread.start()
-                except Exception as e:
-                    logging.error("[LLM Client]: Thread failed to start {e}")
+                    try:
+                        thread = threading.Thread(
+                            target=self.query,
+                            args=(query, user, message_id, websocket, transcription_output["language"]),
+                            kwargs={"cache_key": cache_key},
+                        )
+                        thread.start()
+                    except Exception as e:
+                        logging.error("[LLM Client]: Thread failed to start {e}")
 
-                message_id += 1
+                    message_id += 1
             
-            self.last_prompt = prompt
-            
\ No newline at end of file
+                last_prompt = prompt
+        finally:
+            if speculation is not None:
+                speculation.cancel()
+
+
+if __name__ == "__main__":
+    # prompt tokens an LLM server with prefix caching re-processes per turn
+    history = ConversationHistory()
+    turns = 100
+    reprocessed = total = 0
+    for turn in range(turns):
+        history.add_to_history("user", f"Question number {turn}, tell me something about the weather today?")
+        prompt = history.get_formatted_history("en")
+        reprocessed += history.reprocessed_tokens
+        total += estimate_tokens(prompt)
+        history.add_to_history("assistant", f"Answer number {turn}. " + "It is sunny with a light breeze. " * 6)
+    print(f"{turns} turns: {total / turns:.0f} prompt tokens per turn, {reprocessed / turns:.0f} re-processed")
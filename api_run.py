@@ -4,77 +4,662 @@ from transformers import AutoModelForCausalLM, AutoTokenizer
 import logging
 import torch
 import os
-from queue import Queue, Empty
-from transformers import TextStreamer
+from transformers import TextStreamer, DynamicCache
 import threading
+import time
+import concurrent.futures
+from collections import deque, OrderedDict
 
 
 device = "cuda:1"
 
+# Optional draft model for speculative decoding and the number of tokens it proposes per step
+DRAFT_MODEL_NAME = os.environ.get("LLM_DRAFT_MODEL")
+NUM_DRAFT_TOKENS = int(os.environ.get("LLM_NUM_DRAFT_TOKENS", 4))
+
 class StopSignal:
     """A unique class to signal stopping the streamer."""
     pass
 
+class IncrementalDetokenizer:
+    """
+    Turns token ids into text one token at a time, emitting only complete characters.
+
+    Decoding a token on its own breaks byte-level BPE and SentencePiece vocabularies: a
+    Chinese or Japanese character may be split over several tokens, and the leading space
+    of a word depends on the token before it. Each new token is decoded together with the
+    few tokens before it instead, and only the text beyond what they decoded to is
+    emitted. While a character is incomplete the text ends with U+FFFD and is held back
+    until the bytes that complete it arrive. The work per token is bounded by the tokens
+    since the last emitted text, not by the length of the answer.
+    """
+
+    def __init__(self, tokenizer, **decode_kwargs):
+        self.tokenizer = tokenizer
+        self.decode_kwargs = decode_kwargs
+        self.token_ids = []
+        self.prefix_offset = 0  # start of the tokens decoded for context
+        self.read_offset = 0  # end of the tokens whose text was emitted
+
+    def add(self, token_ids):
+        """
+        Add generated tokens.
+
+        Args:
+            token_ids (List[int]): The new token ids.
+
+        Returns:
+            str: The text completed by them, possibly empty.
+        """
+        self.token_ids.extend(token_ids)
+        prefix_text = self.tokenizer.decode(self.token_ids[self.prefix_offset:self.read_offset], **self.decode_kwargs)
+        text = self.tokenizer.decode(self.token_ids[self.prefix_offset:], **self.decode_kwargs)
+        if len(text) <= len(prefix_text) or text.endswith("\ufffd"):
+            return ""
+        self.prefix_offset = self.read_offset
+        self.read_offset = len(self.token_ids)
+        return text[len(prefix_text):]
+
+    def flush(self):
+        """Return the text of the tokens that are still held back, complete or not."""
+        prefix_text = self.tokenizer.decode(self.token_ids[self.prefix_offset:self.read_offset], **self.decode_kwargs)
+        text = self.tokenizer.decode(self.token_ids[self.prefix_offset:], **self.decode_kwargs)
+        self.prefix_offset = self.read_offset = len(self.token_ids)
+        return text[len(prefix_text):]
+
 class CustomStreamer(TextStreamer):
-    def __init__(self, tokenizer, skip_prompt=False, **decode_kwargs):
+    """
+    Streamer that hands the generated text to the event loop as it is decoded.
+
+    `put` and `end` are called by the generation thread. The text is pushed into an
+    asyncio queue with `call_soon_threadsafe`, so the sender wakes up as soon as a token is
+    decoded instead of polling. The end of the stream, whether the generation finished or
+    was cancelled with `set_stop`, is delivered exactly once.
+    """
+
+    def __init__(self, tokenizer, skip_prompt=False, loop=None, **decode_kwargs):
         super().__init__(tokenizer, skip_prompt, **decode_kwargs)
-        self.queue = Queue()
-        self.last_token_pos = 0  # Track the last token position
+        self.loop = loop or asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.detokenizer = IncrementalDetokenizer(tokenizer, **self.decode_kwargs)
         self.stop_event = threading.Event()  # Event to signal stop
         self.first = False
+        self.lock = threading.Lock()
+        self.closed = False  # the end of the stream was pushed
+        self.ended = False  # the end of the stream was received
+
+    def push(self, item):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        except RuntimeError:
+            # the event loop is closed, nobody is listening anymore
+            pass
 
     def put(self, value):
         if self.stop_event.is_set():
             raise StopIteration("Stop signal received, stopping streamer.")
-        
-        super().put(value)
-        
-        # Process new tokens from the last processed position
-        new_tokens = self.token_cache[self.last_token_pos:]
-        new_text = self.tokenizer.decode(new_tokens, **self.decode_kwargs)
-        
-        # Update the last token position
-        self.last_token_pos = len(self.token_cache)
-        
-        # Add new text to the queue
+
+        # The first call is the prompt
+        if not self.first:
+            self.first = True
+            return
+
+        new_text = self.detokenizer.add(value.reshape(-1).tolist())
         if new_text:
-            if not self.first:
-                self.first = True
-            else:
-                self.queue.put(new_text)
+            self.push(new_text)
+
+    def close(self, final_text=""):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            if final_text:
+                self.push(final_text)
+        self.push(StopSignal())
 
     def end(self):
-        super().end()
-        # Spam the queue with stop signals to ensure it is processed
-        for _ in range(10):
-            self.queue.put(StopSignal())  # End of stream signal
+        # the text of an incomplete last character is sent as it is
+        self.close(self.detokenizer.flush())
 
-    def get_from_queue(self):
-        try:
+    def set_stop(self):
+        self.stop_event.set()
+        self.close()
+
+    async def next_text(self):
+        """Wait for the next text, None once the stream ended."""
+        if self.ended:
+            return None
+        item = await self.queue.get()
+        if isinstance(item, StopSignal):
+            self.ended = True
+            return None
+        return item
+
+    def pending_text(self):
+        """Return the text that already arrived without waiting, noting the end of the stream."""
+        text = ""
+        while not self.ended and not self.queue.empty():
             item = self.queue.get_nowait()
             if isinstance(item, StopSignal):
-                raise StopIteration("Stop signal received, stopping streamer.")
-            return item
-        except Empty:
-            return None
+                self.ended = True
+            else:
+                text += item
+        return text
 
-    def set_stop(self):
-        self.stop_event.set()
-        self.queue.put(StopSignal())  # Ensure the queue processes the stop signal
+
+def cache_layers(past_key_values):
+    """Return the key and value tensors of every layer of a KV cache, whatever its transformers class."""
+    if hasattr(past_key_values, "layers"):
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    if hasattr(past_key_values, "key_cache"):
+        return list(zip(past_key_values.key_cache, past_key_values.value_cache))
+    return [(key, value) for key, value, *_ in past_key_values]
+
+def make_cache(layers):
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(tuple(layers))
+    return DynamicCache(layers)
+
+def left_pad(tensor, length, dim):
+    """Pad a tensor with zeros at the start of `dim` to `length`."""
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = missing
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+def sample_token(logits, request):
+    """Pick the next token from the logits of one sequence with the sampling parameters of its request."""
+    if not request.do_sample or request.top_k == 1 or request.temperature <= 0:
+        return int(logits.argmax())
+    logits = logits.float() / request.temperature
+    if request.top_k > 0:
+        kth = torch.topk(logits, min(request.top_k, logits.numel())).values[-1]
+        logits[logits < kth] = -float("inf")
+    if request.top_p < 1.0:
+        sorted_logits, indices = torch.sort(logits, descending=True)
+        probs = torch.softmax(sorted_logits, dim=-1)
+        # keep the smallest set of tokens whose probability reaches top_p
+        sorted_logits[torch.cumsum(probs, dim=-1) - probs > request.top_p] = -float("inf")
+        logits = torch.full_like(logits, -float("inf")).scatter(0, indices, sorted_logits)
+    return int(torch.multinomial(torch.softmax(logits, dim=-1), 1))
+
+class PrefixCache:
+    """
+    KV caches of the last request of every conversation, to prefill only what is new.
+
+    The prompt of a turn starts with the prompt of the turn before, so the cache of a
+    conversation's last request is matched against the new prompt token by token and the
+    longest common prefix is reused: only the new suffix, the last answer and the new user
+    turn, is prefilled. Caches are evicted least recently used first to stay within
+    `max_bytes`.
+
+    Attributes:
+        max_bytes (int): Memory budget of the cached keys and values.
+        total_bytes (int): Memory of the cached keys and values.
+        hits (int): Prompts that reused a cached prefix.
+        reused_tokens (int): Prompt tokens that did not have to be prefilled.
+    """
+
+    def __init__(self, max_bytes=2 * 2**30):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.reused_tokens = 0
+
+    def lookup(self, conversation_id, input_ids):
+        """
+        Find the cached prefix of a prompt.
+
+        Args:
+            conversation_id (str): The conversation of the prompt.
+            input_ids (torch.Tensor): The prompt's token ids.
+
+        Returns:
+            Tuple[int, list]: The length of the reusable prefix, and its key and value tensors for
+                every layer, or (0, None).
+        """
+        entry = self.entries.get(conversation_id)
+        if entry is None:
+            return 0, None
+        self.entries.move_to_end(conversation_id)
+        token_ids, layers, _ = entry
+        length = min(len(token_ids), len(input_ids) - 1)  # the last prompt token is always run
+        matches = (token_ids[:length] == input_ids[:length]).long()
+        # the prefix ends at the first token that differs
+        prefix = int(matches.cumprod(0).sum()) if length > 0 else 0
+        if prefix == 0:
+            return 0, None
+        self.hits += 1
+        self.reused_tokens += prefix
+        return prefix, [(key[:, :, :prefix], value[:, :, :prefix]) for key, value in layers]
+
+    def store(self, conversation_id, token_ids, layers):
+        """Keep the cache of a finished request, replacing the conversation's previous one."""
+        size = sum(key.nbytes + value.nbytes for key, value in layers)
+        self.remove(conversation_id)
+        if size > self.max_bytes:
+            return
+        self.entries[conversation_id] = (token_ids, layers, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, conversation_id):
+        entry = self.entries.pop(conversation_id, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+class GenerationRequest:
+    """
+    One prompt to complete, with its sampling parameters and stop conditions.
+
+    Generation stops at a stop token (the model's end of sequence tokens by default), when
+    the decoded tail of the answer contains one of `stop_strings`, after `max_new_tokens`
+    tokens, or when `stop_event` is set or the streamer raises StopIteration.
+    """
+
+    def __init__(
+        self,
+        input_ids,
+        streamer=None,
+        max_new_tokens=2048,
+        temperature=1.0,
+        top_p=1.0,
+        top_k=0,
+        do_sample=False,
+        stop_token_ids=None,
+        stop_strings=(),
+        stop_event=None,
+        conversation_id=None,
+        ):
+        self.input_ids = input_ids.reshape(-1)
+        self.streamer = streamer
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.do_sample = do_sample
+        self.stop_token_ids = stop_token_ids
+        # a single stop string, not its characters
+        self.stop_strings = [stop_strings] if isinstance(stop_strings, str) else list(stop_strings)
+        self.stop_event = stop_event
+        self.conversation_id = conversation_id
+        self.future = concurrent.futures.Future()
+        self.submit_time = None
+        self.first_token_time = None
+
+class Sequence:
+    """A request in the decode batch: its last token and how many positions of the cache are its own."""
+
+    def __init__(self, request):
+        self.request = request
+        self.generated = []
+        self.position = 0
+        self.last_token = None
+        # the draft model's cache of the request, filled when the request runs alone
+        self.draft_cache = None
+        self.draft_length = 0
+
+class BatchEngine:
+    """
+    Continuous batching generation for any Hugging Face causal LM.
+
+    Instead of one `model.generate` per request, all running requests share the decode
+    steps of one background thread: every step runs a single forward pass over a batch
+    made of the last token of every request. A new request is prefilled on its own and
+    joins the batch at the next step, a finished or cancelled one leaves it right away,
+    so requests never wait for each other to finish.
+
+    The KV caches of the batch are kept in one left-padded cache with an attention mask,
+    and every row gets its own position ids, so rows with prompts of different lengths
+    decode together. The cache is only re-padded when a request joins and trimmed when
+    the longest one leaves.
+
+    With a draft model, a request that runs alone is decoded speculatively: the draft model
+    proposes `num_draft_tokens` tokens and the main model verifies them in one forward pass.
+
+    Attributes:
+        model (PreTrainedModel): The causal LM.
+        tokenizer (PreTrainedTokenizer): Tokenizer used to check stop strings.
+        max_batch_size (int): Maximum number of requests decoded together.
+        draft_model (PreTrainedModel): Small model with the same vocabulary proposing tokens, None to not speculate.
+        draft_tokens (int): Tokens proposed by the draft model so far.
+        accepted_tokens (int): Proposed tokens the main model accepted.
+        steps (int): Decode steps run so far.
+        tokens (int): Tokens generated so far.
+    """
+
+    def __init__(self, model, tokenizer=None, device="cpu", max_batch_size=16, prefix_cache_bytes=2 * 2**30, draft_model=None, num_draft_tokens=4):
+        self.model = model
+        self.draft_model = draft_model
+        self.num_draft_tokens = num_draft_tokens
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_batch_size = max_batch_size
+        eos_token_id = getattr(model.generation_config, "eos_token_id", None)
+        if eos_token_id is None:
+            eos_token_id = []
+        elif isinstance(eos_token_id, int):
+            eos_token_id = [eos_token_id]
+        self.eos_token_ids = set(eos_token_id)
+        self.condition = threading.Condition()
+        self.waiting = deque()
+        self.rows = []
+        self.cache = None
+        self.mask = None
+        self.steps = 0
+        self.tokens = 0
+        self.thread = None
+        self.running = False
+        self.prefix_cache = PrefixCache(prefix_cache_bytes) if prefix_cache_bytes else None
+        self.draft_tokens = 0
+        self.accepted_tokens = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+
+    def submit(self, request):
+        """
+        Queue a request for generation.
+
+        Args:
+            request (GenerationRequest): The request.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the generated token ids.
+        """
+        request.submit_time = time.time()
+        with self.condition:
+            self.waiting.append(request)
+            self.condition.notify()
+        return request.future
+
+    def run(self):
+        while self.running:
+            with self.condition:
+                while self.running and not self.waiting and not self.rows:
+                    self.condition.wait()
+                request = None
+                if self.waiting and len(self.rows) < self.max_batch_size:
+                    request = self.waiting.popleft()
+            if request is not None:
+                # one prefill per step, so running requests keep streaming while others join
+                try:
+                    with torch.inference_mode():
+                        self.join(request)
+                except Exception as e:
+                    # only the new request failed, the batch it was about to join goes on
+                    logging.error(f"Prefill failed: {e}")
+                    self.finish(Sequence(request), error=e)
+            try:
+                with torch.inference_mode():
+                    if len(self.rows) == 1 and self.draft_model is not None:
+                        # a lone request has the compute to itself, batching makes better use of it otherwise
+                        self.speculative_step()
+                    elif self.rows:
+                        self.step()
+            except Exception as e:
+                logging.error(f"Generation failed: {e}")
+                for sequence in self.rows:
+                    self.finish(sequence, error=e)
+                self.rows, self.cache, self.mask = [], None, None
+
+    def prefill(self, sequence):
+        """Run the prompt of a new request, returning the KV cache layers of the prompt and the logits of its last token."""
+        request = sequence.request
+        input_ids = request.input_ids.to(self.device)
+        prefix, past = 0, None
+        if self.prefix_cache is not None and request.conversation_id is not None:
+            prefix, past = self.prefix_cache.lookup(request.conversation_id, input_ids)
+        outputs = self.model(
+            input_ids=input_ids[prefix:].unsqueeze(0),
+            attention_mask=torch.ones(1, len(input_ids), dtype=torch.long, device=self.device),
+            position_ids=torch.arange(prefix, len(input_ids), device=self.device).unsqueeze(0),
+            past_key_values=make_cache(past) if past is not None else None,
+            use_cache=True,
+        )
+        if request.conversation_id is not None:
+            logging.info(f"Prefilled {len(input_ids) - prefix} of {len(input_ids)} prompt tokens of {request.conversation_id}")
+        sequence.position = len(input_ids)
+        return cache_layers(outputs.past_key_values), outputs.logits[0, -1]
+
+    def store_prefix(self, sequence, layers):
+        """Keep the cache of a finished request for the next turn of its conversation."""
+        request = sequence.request
+        if self.prefix_cache is None or request.conversation_id is None:
+            return
+        # the cache holds the prompt and every generated token but the last one
+        generated = torch.tensor(sequence.generated, dtype=request.input_ids.dtype)
+        token_ids = torch.cat([request.input_ids, generated])[:sequence.position].to(self.device)
+        self.prefix_cache.store(request.conversation_id, token_ids, layers)
+
+    def join(self, request):
+        sequence = Sequence(request)
+        if request.stop_event is not None and request.stop_event.is_set():
+            self.finish(sequence)
+            return
+        if request.streamer is not None:
+            # the prompt goes to the streamer first, as with model.generate
+            request.streamer.put(request.input_ids)
+        layers, logits = self.prefill(sequence)
+        if not self.emit(sequence, sample_token(logits, request)):
+            self.store_prefix(sequence, layers)
+            return
+        length = layers[0][0].shape[2]
+        mask = torch.ones(1, length, dtype=torch.long, device=self.device)
+        if not self.rows:
+            self.cache, self.mask = make_cache(layers), mask
+            self.rows = [sequence]
+            return
+        batch_layers = cache_layers(self.cache)
+        total = max(self.mask.shape[1], length)
+        # built aside, a failing join leaves the batch as it was
+        cache = make_cache([
+            (
+                torch.cat([left_pad(key, total, 2), left_pad(new_key, total, 2)]),
+                torch.cat([left_pad(value, total, 2), left_pad(new_value, total, 2)]),
+            )
+            for (key, value), (new_key, new_value) in zip(batch_layers, layers)
+        ])
+        mask = torch.cat([left_pad(self.mask, total, 1), left_pad(mask, total, 1)])
+        self.cache, self.mask = cache, mask
+        self.rows.append(sequence)
+
+    def step(self):
+        input_ids = torch.tensor([[sequence.last_token] for sequence in self.rows], device=self.device)
+        position_ids = torch.tensor([[sequence.position] for sequence in self.rows], device=self.device)
+        mask = torch.cat([self.mask, self.mask.new_ones(len(self.rows), 1)], dim=1)
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=mask,
+            position_ids=position_ids,
+            past_key_values=self.cache,
+            use_cache=True,
+        )
+        self.cache, self.mask = outputs.past_key_values, mask
+        self.steps += 1
+        keep = []
+        for index, sequence in enumerate(self.rows):
+            sequence.position += 1
+            if self.emit(sequence, sample_token(outputs.logits[index, -1], sequence.request)):
+                keep.append(index)
+        if len(keep) < len(self.rows):
+            self.leave(keep)
+
+    def speculative_step(self):
+        """
+        Let the draft model propose tokens for the only running request and verify them in one pass.
+
+        The main model runs over the last token and the proposed ones at once, and the proposed
+        tokens are accepted as long as they are what the main model picks with the request's
+        sampling parameters, so the answer is the one the main model generates on its own. The
+        token the main model picks after the accepted ones is emitted too, a step emits 1 to
+        `num_draft_tokens` + 1 tokens.
+        """
+        sequence = self.rows[0]
+        request = sequence.request
+        count = min(self.num_draft_tokens, request.max_new_tokens - len(sequence.generated))
+        if count < 1:
+            return self.step()
+        # the draft catches up on the tokens it has not seen, all of them when it is new to the request
+        prompt_length = len(request.input_ids)
+        if sequence.draft_length < prompt_length:
+            new = request.input_ids[sequence.draft_length:].tolist() + sequence.generated
+        else:
+            new = sequence.generated[sequence.draft_length - prompt_length:]
+        drafts = []
+        for _ in range(count):
+            outputs = self.draft_model(
+                input_ids=torch.tensor([new], device=self.device),
+                attention_mask=torch.ones(1, sequence.draft_length + len(new), dtype=torch.long, device=self.device),
+                position_ids=torch.arange(sequence.draft_length, sequence.draft_length + len(new), device=self.device).unsqueeze(0),
+                past_key_values=sequence.draft_cache,
+                use_cache=True,
+            )
+            sequence.draft_cache = outputs.past_key_values
+            sequence.draft_length += len(new)
+            drafts.append(sample_token(outputs.logits[0, -1], request))
+            new = drafts[-1:]
+
+        mask = torch.cat([self.mask, self.mask.new_ones(1, count + 1)], dim=1)
+        outputs = self.model(
+            input_ids=torch.tensor([[sequence.last_token] + drafts], device=self.device),
+            attention_mask=mask,
+            position_ids=torch.arange(sequence.position, sequence.position + count + 1, device=self.device).unsqueeze(0),
+            past_key_values=self.cache,
+            use_cache=True,
+        )
+        self.steps += 1
+        accepted = 0
+        for index, draft in enumerate(drafts):
+            token = sample_token(outputs.logits[0, index], request)
+            if token != draft:
+                break
+            accepted += 1
+        else:
+            token = sample_token(outputs.logits[0, count], request)
+        self.draft_tokens += count
+        self.accepted_tokens += accepted
+
+        # drop the rejected tokens from both caches
+        length = mask.shape[1] - (count - accepted)
+        self.cache = make_cache([(key[:, :, :length], value[:, :, :length]) for key, value in cache_layers(outputs.past_key_values)])
+        self.mask = mask[:, :length]
+        sequence.position += 1 + accepted
+        draft_length = min(sequence.draft_length, sequence.position)
+        sequence.draft_cache = make_cache([
+            (key[:, :, :draft_length], value[:, :, :draft_length]) for key, value in cache_layers(sequence.draft_cache)
+        ])
+        sequence.draft_length = draft_length
+        for token in drafts[:accepted] + [token]:
+            if not self.emit(sequence, token):
+                self.leave([])
+                return
+
+    def acceptance_rate(self):
+        """Return the fraction of the draft model's tokens that the main model accepted."""
+        return self.accepted_tokens / self.draft_tokens if self.draft_tokens else 0.0
+
+    def leave(self, keep):
+        for index, sequence in enumerate(self.rows):
+            if index not in keep and sequence.request.conversation_id is not None:
+                # the row's own positions are its last columns, the rest is padding
+                self.store_prefix(sequence, [
+                    (key[index:index + 1, :, -sequence.position:].clone(),
+                     value[index:index + 1, :, -sequence.position:].clone())
+                    for key, value in cache_layers(self.cache)
+                ])
+        self.rows = [self.rows[index] for index in keep]
+        if not self.rows:
+            self.cache, self.mask = None, None
+            return
+        index = torch.tensor(keep, device=self.device)
+        # drop the columns that are padding in every remaining row
+        start = int(self.mask[index].any(dim=0).nonzero()[0])
+        self.cache = make_cache([
+            (key[index, :, start:], value[index, :, start:]) for key, value in cache_layers(self.cache)
+        ])
+        self.mask = self.mask[index, start:]
+
+    def emit(self, sequence, token):
+        """Stream a generated token and check the stop conditions, returning whether the request goes on."""
+        request = sequence.request
+        if request.stop_event is not None and request.stop_event.is_set():
+            self.finish(sequence)
+            return False
+        stop_token_ids = self.eos_token_ids if request.stop_token_ids is None else request.stop_token_ids
+        if token in stop_token_ids:
+            self.finish(sequence)
+            return False
+        if request.first_token_time is None:
+            request.first_token_time = time.time()
+        sequence.generated.append(token)
+        sequence.last_token = token
+        self.tokens += 1
+        if request.streamer is not None:
+            try:
+                request.streamer.put(torch.tensor([token]))
+            except StopIteration:
+                self.finish(sequence)
+                return False
+        if len(sequence.generated) >= request.max_new_tokens or self.stopped_by_string(sequence):
+            self.finish(sequence)
+            return False
+        return True
+
+    def stopped_by_string(self, sequence):
+        if not sequence.request.stop_strings or self.tokenizer is None:
+            return False
+        tail = self.tokenizer.decode(sequence.generated[-16:])
+        return any(stop in tail for stop in sequence.request.stop_strings)
+
+    def finish(self, sequence, error=None):
+        request = sequence.request
+        if sequence.draft_length:
+            logging.info(f"Speculative decoding accepted {self.acceptance_rate():.0%} of {self.draft_tokens} draft tokens")
+        if request.streamer is not None:
+            request.streamer.end()
+        if request.future.done():
+            return
+        if error is not None:
+            request.future.set_exception(error)
+        else:
+            request.future.set_result(sequence.generated)
 # Initialize FastAPI app
 app = FastAPI()
 
 # Load model and tokenizer
 model = None
 tokenizer = None
+engine = None
 
 async def load_model():
-    global model, tokenizer
+    global model, tokenizer, engine
     model_name = "Qwen/Qwen2-7B"
     tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
     model = AutoModelForCausalLM.from_pretrained(model_name, trust_remote_code=True)
     model.to(device)
     model.eval()
+    draft_model = None
+    if DRAFT_MODEL_NAME:
+        # must share the main model's vocabulary, e.g. Qwen/Qwen2-0.5B for Qwen/Qwen2-7B
+        draft_model = AutoModelForCausalLM.from_pretrained(DRAFT_MODEL_NAME, trust_remote_code=True)
+        draft_model.to(device)
+        draft_model.eval()
+    # all websocket requests share the decode steps of one engine
+    engine = BatchEngine(model, tokenizer, device=device, draft_model=draft_model, num_draft_tokens=NUM_DRAFT_TOKENS)
+    engine.start()
     logging.info("Model loaded successfully")
 
 @app.on_event("startup")
@@ -95,76 +680,376 @@ def format_input(query: str) -> str:
     """
     return chat_template.format(content=content)
 
+# Milliseconds a streamed text that ends inside a word waits for the rest of it
+STREAM_COALESCE_MS = 10
+
 # Set CUDA_LAUNCH_BLOCKING for debugging
 os.environ["CUDA_LAUNCH_BLOCKING"] = "1"
 
-async def generate_text(query: str, streamer: CustomStreamer, stop_event: asyncio.Event):
-    input_ids = tokenizer(format_input(query), return_tensors="pt").input_ids.to(device)
-    attention_mask = torch.ones_like(input_ids).to(device)
-
-    generation_kwargs = {
-        "input_ids": input_ids,
-        "attention_mask": attention_mask,
-        "max_new_tokens": 2048,
-        "temperature": 0.1,
-        "top_p": 0.1,
-        "top_k": 1,
-        "do_sample": True,
-        "streamer": streamer,
-    }
-    
-    def stock_checking_generate():
-        try:
-            for _ in model.generate(**generation_kwargs):
-                if stop_event.is_set():
-                    logging.info("Stop event set, stopping generation.")
-                    break
-        except StopIteration:
-            logging.info("Generation stopped by stop signal.")
-            return
+# Sampling of the original per-request generate call, a framed request may override them
+GENERATION_DEFAULTS = {
+    "max_new_tokens": 2048,
+    "temperature": 0.1,
+    "top_p": 0.1,
+    "top_k": 1,
+    "do_sample": True,
+}
+
+def generation_params(request: dict) -> dict:
+    """Return the sampling parameters and stop strings of a framed request."""
+    params = {key: request[key] for key in GENERATION_DEFAULTS if key in request}
+    if request.get("stop"):
+        stop = request["stop"]
+        params["stop_strings"] = [stop] if isinstance(stop, str) else list(stop)
+    if request.get("conversation") is not None:
+        params["conversation_id"] = str(request["conversation"])
+    return params
 
-    await asyncio.to_thread(stock_checking_generate)
+async def generate_text(query: str, streamer: CustomStreamer, stop_event: asyncio.Event, conversation_id=None, **params):
+    input_ids = tokenizer(format_input(query), return_tensors="pt").input_ids
+    request = GenerationRequest(
+        input_ids,
+        streamer=streamer,
+        stop_event=stop_event,
+        conversation_id=conversation_id,
+        **dict(GENERATION_DEFAULTS, **params),
+    )
+    await asyncio.wrap_future(engine.submit(request))
 
-async def send_text_from_queue(websocket: WebSocket, streamer: CustomStreamer):
-    # Possible here.
+def at_word_boundary(text: str) -> bool:
+    last = text[-1]
+    # every Chinese and Japanese character is a word of its own
+    return not last.isalnum() or "\u3040" <= last <= "\u9fff"
+
+async def send_text_from_queue(websocket: WebSocket, streamer: CustomStreamer, request_id=None, send_lock=None, coalesce_ms=None):
+    """
+    Send the streamer's text as soon as it arrives.
+
+    Text that arrives while a send is in flight goes out with the next send, so a slow
+    client gets fewer, larger messages instead of a growing backlog, and the decode loop
+    shared with the other requests is never held up. A text that ends inside a word waits
+    up to `coalesce_ms` for the rest of the word.
+    """
+    loop = asyncio.get_running_loop()
+    coalesce = (STREAM_COALESCE_MS if coalesce_ms is None else coalesce_ms) / 1000
     while True:
-        try:
-            token = streamer.get_from_queue()
-            if token:
-                await websocket.send_text(token)
-            else:
-                await asyncio.sleep(0.2)
-        except StopIteration:
-            logging.info("Stopping text sending due to stop signal.")
+        text = await streamer.next_text()
+        if text is None:
             break
+        text += streamer.pending_text()
+        deadline = loop.time() + coalesce
+        while not streamer.ended and text and not at_word_boundary(text):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                more = await asyncio.wait_for(streamer.next_text(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if more is None:
+                break
+            text += more + streamer.pending_text()
+        if not text:
+            continue
+        if request_id is None:
+            await websocket.send_text(text)
+        else:
+            async with send_lock:
+                await websocket.send_text(json.dumps({"id": request_id, "token": text}))
+    logging.info("Stopping text sending due to stop signal.")
+
+async def serve_request(websocket: WebSocket, query: str, request_id, requests: dict, send_lock: asyncio.Lock, params=None, coalesce_ms=None):
+    """Generate the answer to one framed request and close it with an end message."""
+    streamer = CustomStreamer(tokenizer)
+    stop_event = asyncio.Event()
+    requests[request_id] = (stop_event, streamer)
+    try:
+        await asyncio.gather(
+            generate_text(query, streamer, stop_event, **(params or {})),
+            send_text_from_queue(websocket, streamer, request_id, send_lock, coalesce_ms)
+        )
+    except Exception as e:
+        logging.error(f"Error in request {request_id}: {e}")
+        stop_event.set()
+        streamer.set_stop()
+    finally:
+        requests.pop(request_id, None)
+        try:
+            async with send_lock:
+                await websocket.send_text(json.dumps({"id": request_id, "end": True}))
+        except Exception:
+            pass
+
+def stop_request(requests: dict, request_id):
+    if request_id in requests:
+        stop_event, streamer = requests[request_id]
+        stop_event.set()
+        streamer.set_stop()
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
+    """
+    Serve any number of requests on one connection.
+
+    A framed request {"id": ..., "query": [...]} is answered with {"id": ..., "token": ...} messages
+    and a final {"id": ..., "end": true}, several may be in flight at once and {"id": ..., "cancel": true}
+    stops one. It may set "max_new_tokens", "temperature", "top_p", "top_k", "do_sample" and
+    "stop" strings, "coalesce_ms" to wait for the rest of a word before sending, and a "conversation" id under which the KV cache of the prompt is kept for
+    the next turn. An unframed request, the bare query list, is answered with raw text tokens and
+    served one at a time, as before.
+    """
     await websocket.accept()
-    stop_event = asyncio.Event()
+    requests = {}
+    send_lock = asyncio.Lock()
+    tasks = set()
     try:
         logging.info("Connection open")
         while True:
             data = await websocket.receive_text()
             logging.info(f"Received query: {data}")
+            request = json.loads(data)
+            if isinstance(request, dict):
+                if request.get("cancel"):
+                    stop_request(requests, request["id"])
+                    continue
+                task = asyncio.create_task(
+                    serve_request(
+                        websocket, json.dumps(request["query"]), request["id"], requests, send_lock,
+                        generation_params(request), request.get("coalesce_ms"),
+                    ))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                continue
+
             streamer = CustomStreamer(tokenizer)
-            
+            stop_event = asyncio.Event()
+            requests[None] = (stop_event, streamer)
             await asyncio.gather(
                 generate_text(data, streamer, stop_event),
                 send_text_from_queue(websocket, streamer)
             )
+            requests.pop(None, None)
     except WebSocketDisconnect:
         logging.info("Client disconnected")
-        stop_event.set()
-        streamer.set_stop()  # Signal to stop the streamer
     except Exception as e:
         logging.error(f"Error: {e}")
-        stop_event.set()
-        streamer.set_stop()  # Signal to stop the streamer
     finally:
+        # Signal all generations of this connection to stop
+        for request_id in list(requests):
+            stop_request(requests, request_id)
         # await websocket.close()  # Ensure the WebSocket is closed
         logging.info("WebSocket connection closed")
 
+class TimingStreamer:
+    """Streamer that records when the first generated token arrived, for the benchmarks."""
+
+    def __init__(self):
+        self.prompt_seen = False
+        self.first_token_time = None
+        self.tokens = 0
+
+    def put(self, value):
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        if self.first_token_time is None:
+            self.first_token_time = time.time()
+        self.tokens += value.numel()
+
+    def end(self):
+        pass
+
+def tiny_model(seed=0, layers=4, hidden_size=256, vocab_size=4096):
+    """A randomly initialized Llama small enough to benchmark on a CPU, without end of sequence token."""
+    from transformers import LlamaConfig
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=vocab_size,
+        hidden_size=hidden_size,
+        intermediate_size=4 * hidden_size,
+        num_hidden_layers=layers,
+        num_attention_heads=8,
+        num_key_value_heads=4,
+        bos_token_id=None,
+        eos_token_id=None,
+        pad_token_id=None,
+    )
+    tiny = AutoModelForCausalLM.from_config(config).eval()
+    tiny.generation_config.eos_token_id = None
+    tiny.generation_config.pad_token_id = 0
+    return tiny
+
+def tiny_draft(main_model, layers=1, residual_scale=0.01):
+    """
+    A draft for `tiny_model`: its first layers, sharing embeddings and head.
+
+    Random weights do not agree with each other the way a small and a large trained model
+    mostly do, so the main model's layers beyond the draft's are scaled down to refine
+    the draft's prediction rather than replace it.
+    """
+    import copy
+    for layer in main_model.model.layers[layers:]:
+        layer.self_attn.o_proj.weight.data *= residual_scale
+        layer.mlp.down_proj.weight.data *= residual_scale
+    config = copy.deepcopy(main_model.config)
+    config.num_hidden_layers = layers
+    draft = AutoModelForCausalLM.from_config(config).eval()
+    draft.load_state_dict(main_model.state_dict(), strict=False)
+    draft.generation_config.eos_token_id = None
+    return draft
+
+def run_benchmark(generate, prompts, interval):
+    """Submit the prompts `interval` seconds apart, returning the wall time, time to first token of each and tokens generated."""
+    streamers = [TimingStreamer() for _ in prompts]
+    submit_times = []
+    threads = []
+    start = time.time()
+    for prompt, streamer in zip(prompts, streamers):
+        submit_times.append(time.time())
+        thread = threading.Thread(target=generate, args=(prompt, streamer))
+        thread.start()
+        threads.append(thread)
+        time.sleep(interval)
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    ttft = [streamer.first_token_time - submitted for streamer, submitted in zip(streamers, submit_times)]
+    return elapsed, ttft, sum(streamer.tokens for streamer in streamers)
+
+def report(name, elapsed, ttft, tokens):
+    ttft = sorted(ttft)
+    p99 = ttft[min(len(ttft) - 1, int(0.99 * len(ttft)))]
+    print(f"{name}: {tokens / elapsed:.0f} tokens/s, time to first token p50 {1000 * ttft[len(ttft) // 2]:.0f}ms, "
+          f"p99 {1000 * p99:.0f}ms")
+
+DETOKENIZER_SAMPLES = [
+    "今天天气很好，我们去公园散步吧！你觉得怎么样？",
+    "こんにちは、世界。明日は晴れるでしょう。東京タワーに行きませんか？",
+    "Sure! The café opens at 9:00, see you there 😊 — 안녕하세요.",
+    "你好，我是你的语音助手。请问有什么可以帮你的吗？Hello, how can I help?",
+]
+
+def check_detokenizer(tokenizer):
+    """Stream the sample texts token by token, returning the samples whose streamed text differs from a full decode."""
+    failures = []
+    for sample in DETOKENIZER_SAMPLES:
+        token_ids = tokenizer(sample, add_special_tokens=False).input_ids
+        detokenizer = IncrementalDetokenizer(tokenizer)
+        pieces = [detokenizer.add([token_id]) for token_id in token_ids] + [detokenizer.flush()]
+        if "".join(pieces) != tokenizer.decode(token_ids) or any("\ufffd" in piece for piece in pieces):
+            failures.append((sample, pieces))
+    return failures
+
+def per_token_decode(tokenizer, token_ids):
+    """The previous streamer: TextStreamer.put decoding its whole cache, then a decode of the new token alone."""
+    streamer = TextStreamer(tokenizer)
+    streamer.on_finalized_text = lambda text, stream_end=False: None
+    pieces = []
+    for token_id in token_ids:
+        streamer.put(torch.tensor([token_id]))
+        pieces.append(tokenizer.decode(streamer.token_cache[-1:]))
+    return pieces
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="12.1.52.176", port=8001)
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmark', action="store_true",
+                        help='Compare continuous batching with a generate call per request on a tiny CPU model')
+    parser.add_argument('--requests', type=int, default=16)
+    parser.add_argument('--max_new_tokens', type=int, default=64)
+    parser.add_argument('--interval', type=float, default=0.05, help='Seconds between request arrivals')
+    parser.add_argument('--prefix_benchmark', action="store_true",
+                        help='Time to first token of growing conversation turns with and without the prefix cache')
+    parser.add_argument('--turns', type=int, default=8)
+    parser.add_argument('--detokenizer_benchmark', action="store_true",
+                        help='Check streamed CJK text against a full decode and time the detokenizer')
+    parser.add_argument('--tokenizer', type=str, default="Qwen/Qwen2-7B", help='Tokenizer name or path')
+    parser.add_argument('--draft_benchmark', action="store_true",
+                        help='Time replies of a tiny CPU model with and without a draft model')
+    parser.add_argument('--num_draft_tokens', type=int, default=4)
+    args = parser.parse_args()
+
+    if args.draft_benchmark:
+        bench_model = tiny_model(layers=8, hidden_size=512)
+        bench_draft = tiny_draft(bench_model)
+        prompts = [torch.randint(0, 4096, (32 + 16 * i,)) for i in range(args.requests)]
+        for name, draft in (("without draft", None), ("with draft", bench_draft)):
+            bench_engine = BatchEngine(bench_model, draft_model=draft, num_draft_tokens=args.num_draft_tokens)
+            bench_engine.start()
+            bench_engine.submit(GenerationRequest(prompts[0], max_new_tokens=8)).result()  # warm up
+            replies = []
+            for prompt in prompts:
+                start = time.time()
+                bench_engine.submit(GenerationRequest(prompt, max_new_tokens=args.max_new_tokens)).result()
+                replies.append(time.time() - start)
+            bench_engine.stop()
+            accepted = f", {bench_engine.acceptance_rate():.0%} of draft tokens accepted" if draft is not None else ""
+            print(f"{name}: {args.max_new_tokens * len(replies) / sum(replies):.0f} tokens/s, "
+                  f"time to full reply {1000 * sum(replies) / len(replies):.0f}ms{accepted}")
+    elif args.detokenizer_benchmark:
+        bench_tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, trust_remote_code=True)
+        failures = check_detokenizer(bench_tokenizer)
+        for sample, pieces in failures:
+            print(f"MISMATCH {sample!r}: {pieces}")
+        print(f"{len(DETOKENIZER_SAMPLES) - len(failures)}/{len(DETOKENIZER_SAMPLES)} samples stream correctly")
+        token_ids = bench_tokenizer(" ".join(DETOKENIZER_SAMPLES) * 40, add_special_tokens=False).input_ids
+        broken = sum("\ufffd" in piece for piece in per_token_decode(bench_tokenizer, token_ids[:200]))
+        print(f"previous streamer: {broken} of 200 tokens sent as U+FFFD")
+        for length in (500, 2000):
+            ids = token_ids[:length]
+            start = time.perf_counter()
+            per_token_decode(bench_tokenizer, ids)
+            previous = time.perf_counter() - start
+            start = time.perf_counter()
+            detokenizer = IncrementalDetokenizer(bench_tokenizer)
+            for token_id in ids:
+                detokenizer.add([token_id])
+            detokenizer.flush()
+            incremental = time.perf_counter() - start
+            print(f"{length} tokens: previous streamer {1e6 * previous / length:.0f}us per token, "
+                  f"incremental detokenizer {1e6 * incremental / length:.0f}us per token")
+    elif args.prefix_benchmark:
+        bench_model = tiny_model()
+        bench_engine = BatchEngine(bench_model)
+        bench_engine.start()
+        header = torch.randint(0, 4096, (64,))
+        for conversation_id in (None, "conversation"):
+            prompt = header
+            ttft = []
+            for turn in range(args.turns):
+                # the next prompt is the last one, the answer and a new user turn
+                prompt = torch.cat([prompt, torch.randint(0, 4096, (48,))])
+                streamer = TimingStreamer()
+                request = GenerationRequest(
+                    prompt, streamer=streamer, max_new_tokens=32, conversation_id=conversation_id)
+                answer = bench_engine.submit(request).result()
+                ttft.append(f"{len(prompt)}:{1000 * (streamer.first_token_time - request.submit_time):.0f}ms")
+                prompt = torch.cat([prompt, torch.tensor(answer)])
+            print(f"{'prefix cache' if conversation_id else 'full prefill'}: prompt tokens:time to first token {' '.join(ttft)}")
+        bench_engine.stop()
+    elif not args.benchmark:
+        import uvicorn
+        uvicorn.run(app, host="12.1.52.176", port=8001)
+    else:
+        bench_model = tiny_model()
+        prompts = [torch.randint(0, 4096, (16 + 24 * (i % 5),)) for i in range(args.requests)]
+
+        def generate_per_request(prompt, streamer):
+            # what every websocket request did before: its own generate call in a thread
+            with torch.inference_mode():
+                bench_model.generate(
+                    prompt[None], attention_mask=torch.ones(1, len(prompt), dtype=torch.long),
+                    max_new_tokens=args.max_new_tokens, do_sample=False, streamer=streamer,
+                )
+
+        bench_engine = BatchEngine(bench_model, max_batch_size=args.requests)
+        bench_engine.start()
+
+        def generate_batched(prompt, streamer):
+            request = GenerationRequest(prompt, streamer=streamer, max_new_tokens=args.max_new_tokens)
+            bench_engine.submit(request).result()
+
+        generate_per_request(prompts[0], TimingStreamer())  # warm up
+        report("model.generate per request", *run_benchmark(generate_per_request, prompts, args.interval))
+        report("continuous batching", *run_benchmark(generate_batched, prompts, args.interval))
+        bench_engine.stop()
\ No newline at end of file
@@ -15,7 +15,13 @@ class AudioStreamProcessor extends AudioWorkletProcessor {
       this.buffer[this.bufferPointer++] = input[0][i];
 
       if (this.bufferPointer >= this.chunkSize) {
-        this.port.postMessage(this.buffer);
+        // send 16-bit PCM, half the bytes of float32, the server is told via audio_format
+        const pcm = new Int16Array(this.chunkSize);
+        for (let j = 0; j < this.chunkSize; j++) {
+          const sample = Math.max(-1, Math.min(1, this.buffer[j]));
+          pcm[j] = sample * 0x7fff;
+        }
+        this.port.postMessage(pcm, [pcm.buffer]);
         this.bufferPointer = 0;
       }
     }
@@ -197,6 +197,9 @@ function stopRecording() {
 
 function initWebSocket() {
 
+    // The three sockets identify the session with the same id, which must be set before any of them opens
+    unique_id = generateUUID();
+
     websocket = new WebSocket(websocket_uri);
     websocket.binaryType = "arraybuffer";
 
@@ -204,13 +207,13 @@ function initWebSocket() {
   
     websocket.onopen = function() {
       console.log("Connected to server.");
-      unique_id = generateUUID()
       websocket.send(JSON.stringify({
         uid: unique_id,
         multilingual: false,
         input_language: input_language,
         output_language: output_language,
-        task: "transcribe"
+        task: "transcribe",
+        audio_format: "int16"
       }));
     }
     
@@ -0,0 +1,38 @@
+import time
+from types import SimpleNamespace
+
+from whisper_live.admission import AdmissionController
+
+
+def make_scheduler(**kwargs):
+    scheduler = dict(busy_time=0.0, workers=[None], latency=0.0, last_decode_time=time.time(),
+                     queue_depth=0, max_batch_size=8)
+    scheduler.update(kwargs)
+    return SimpleNamespace(**scheduler)
+
+
+def test_admits_first_session_without_min_clients():
+    admission = AdmissionController(make_scheduler(), min_clients=0, settle_time=0.0)
+    assert admission.has_capacity()
+
+
+def test_latency_after_burst_decays_while_idle():
+    scheduler = make_scheduler(latency=4.0)
+    admission = AdmissionController(scheduler, min_clients=1, max_latency=1.0, window=10.0, settle_time=0.0)
+    admission.enqueue("first")
+    assert admission.try_admit("first")
+    admission.enqueue("waiting")
+    assert not admission.try_admit("waiting")
+
+    # no window decoded for 30s, the average fell to an eighth
+    scheduler.last_decode_time = time.time() - 30.0
+    assert admission.latency() < 0.6
+    assert admission.try_admit("waiting")
+
+
+def test_release_without_duration_keeps_session_time():
+    admission = AdmissionController(min_clients=1, default_session_time=300.0)
+    admission.enqueue("session")
+    assert admission.try_admit("session")
+    admission.release()
+    assert admission.active == 0 and admission.session_time == 300.0
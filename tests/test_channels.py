@@ -0,0 +1,91 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from whisper_live.channels import TranscriptMailbox, UserChannel, coalesce
+
+
+def test_coalesce_partial_replaces_trailing_partial():
+    pending = []
+    coalesce(pending, "a", False)
+    coalesce(pending, "b", False)
+    assert pending == [("b", False)]
+
+
+def test_coalesce_final_keeps_trailing_partial():
+    pending = []
+    coalesce(pending, "b", False)
+    coalesce(pending, "c", True)
+    coalesce(pending, "d", False)
+    coalesce(pending, "e", False)
+    assert pending == [("b", False), ("c", True), ("e", False)]
+
+
+@pytest.mark.parametrize("local", [True, False])
+def test_mailbox_delivers_last_partial_and_final(local):
+    mailbox = TranscriptMailbox(local=local)
+    assert "user" not in mailbox  # starts the reader of a piped mailbox
+    mailbox.put("user", {"prompt": "hello", "eos": False})
+    mailbox.put("user", {"prompt": "hello world", "eos": False})
+    mailbox.put("user", {"prompt": "hello world", "eos": True}, final=True)
+    if not local:
+        # the sender and reader threads ship the messages through the pipe
+        time.sleep(0.2)
+    assert mailbox.drain("user") == [
+        {"prompt": "hello world", "eos": False},
+        {"prompt": "hello world", "eos": True},
+    ]
+
+
+def test_discard_wakes_blocked_get():
+    channel = UserChannel(local=True)
+    errors = []
+
+    def consume():
+        try:
+            channel.get("user")
+        except queue.Empty as e:
+            errors.append(e)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    time.sleep(0.05)
+    channel.discard("user")
+    consumer.join(timeout=1.0)
+    assert not consumer.is_alive() and len(errors) == 1
+
+
+@pytest.mark.parametrize("channel_type", [UserChannel, TranscriptMailbox])
+@pytest.mark.parametrize("local", [True, False])
+def test_close_drops_queue_in_consumer(channel_type, local):
+    channel = channel_type(local=local)
+    channel.start_reader()
+    channel.put("user", "hello")
+    channel.close("user")
+    channel.put("user", "late")
+    if not local:
+        time.sleep(0.2)
+    assert "user" not in channel and channel.queues == {}
+
+
+@pytest.mark.parametrize("local", [True, False])
+def test_listener_called_on_delivery(local):
+    channel = UserChannel(local=local)
+    channel.start_reader()
+    delivered = threading.Event()
+    users = []
+
+    def listener(user):
+        users.append(user)
+        delivered.set()
+
+    channel.add_listener(listener)
+    channel.put("user", "hello")
+    assert delivered.wait(timeout=1.0)
+    channel.remove_listener(listener)
+    channel.put("user", "again")
+    if not local:
+        time.sleep(0.2)
+    assert users == ["user"] and channel.drain("user") == ["hello", "again"]
@@ -0,0 +1,79 @@
+import pytest
+
+pytest.importorskip("torch")
+tokenizers = pytest.importorskip("tokenizers")
+transformers = pytest.importorskip("transformers")
+api_run = pytest.importorskip("api_run")
+
+from tokenizers import decoders, models, normalizers, pre_tokenizers, trainers
+
+TEXTS = [
+    "Hello world, how are you today?",
+    "Café crème, naïve résumé.",
+    "你好，世界！今天天气很好。",
+    "日本語のテキスト and English mixed 🙂 with emoji 👍🏽.",
+    "  leading spaces and\nnew lines\n",
+]
+
+
+@pytest.fixture(scope="module")
+def byte_level_tokenizer():
+    # small vocabulary so that CJK characters and emoji are split over several byte tokens
+    tokenizer = tokenizers.Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=300, initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tokenizer.train_from_iterator(["Hello world, how are you today? English text"] * 10, trainer)
+    return transformers.PreTrainedTokenizerFast(tokenizer_object=tokenizer)
+
+
+@pytest.fixture(scope="module")
+def byte_fallback_tokenizer():
+    # SentencePiece-style vocabulary: characters missing from it are spelled as <0xXX> pieces
+    vocab = {"<unk>": 0}
+    for byte in range(256):
+        vocab[f"<0x{byte:02X}>"] = len(vocab)
+    for piece in ["▁", "e", "h", "l", "o", "w", "r", "d", "a", "n", "▁h", "ll", "▁w", "or"]:
+        vocab[piece] = len(vocab)
+    merges = [("▁", "h"), ("l", "l"), ("▁", "w"), ("o", "r")]
+    tokenizer = tokenizers.Tokenizer(models.BPE(vocab, merges, unk_token="<unk>", byte_fallback=True))
+    tokenizer.normalizer = normalizers.Sequence([normalizers.Prepend("▁"), normalizers.Replace(" ", "▁")])
+    tokenizer.decoder = decoders.Sequence([
+        decoders.Replace("▁", " "), decoders.ByteFallback(), decoders.Fuse(), decoders.Strip(" ", 1, 0),
+    ])
+    return transformers.PreTrainedTokenizerFast(tokenizer_object=tokenizer)
+
+
+def stream(tokenizer, token_ids, step):
+    detokenizer = api_run.IncrementalDetokenizer(tokenizer, skip_special_tokens=True)
+    chunks = [detokenizer.add(token_ids[i:i + step]) for i in range(0, len(token_ids), step)]
+    return chunks, detokenizer.flush()
+
+
+@pytest.mark.parametrize("tokenizer_name", ["byte_level_tokenizer", "byte_fallback_tokenizer"])
+@pytest.mark.parametrize("text", TEXTS)
+@pytest.mark.parametrize("step", [1, 2, 3])
+def test_streamed_text_matches_full_decode(request, tokenizer_name, text, step):
+    tokenizer = request.getfixturevalue(tokenizer_name)
+    token_ids = tokenizer.encode(text, add_special_tokens=False)
+    chunks, rest = stream(tokenizer, token_ids, step)
+    assert "".join(chunks) + rest == tokenizer.decode(token_ids, skip_special_tokens=True)
+    # characters split over tokens are held back, never emitted half-decoded
+    assert not any("�" in chunk for chunk in chunks)
+    assert rest == ""
+
+
+def test_characters_split_over_tokens_are_held_back(byte_fallback_tokenizer):
+    token_ids = byte_fallback_tokenizer.encode("hé", add_special_tokens=False)
+    pieces = byte_fallback_tokenizer.convert_ids_to_tokens(token_ids)
+    assert pieces[-2:] == ["<0xC3>", "<0xA9>"]
+    detokenizer = api_run.IncrementalDetokenizer(byte_fallback_tokenizer)
+    assert [detokenizer.add([token_id]) for token_id in token_ids] == ["h", "", "é"]
+
+
+def test_flush_returns_incomplete_tail(byte_level_tokenizer):
+    token_ids = byte_level_tokenizer.encode("ok 你", add_special_tokens=False)
+    detokenizer = api_run.IncrementalDetokenizer(byte_level_tokenizer)
+    text = detokenizer.add(token_ids[:-1])
+    assert "�" not in text
+    assert text + detokenizer.flush() == byte_level_tokenizer.decode(token_ids[:-1])
@@ -0,0 +1,11 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+api_run = pytest.importorskip("api_run")
+
+
+@pytest.mark.parametrize("stop, expected", [("\nUser:", ["\nUser:"]), (["a", "b"], ["a", "b"])])
+def test_stop_strings(stop, expected):
+    assert api_run.generation_params({"stop": stop})["stop_strings"] == expected
+    request = api_run.GenerationRequest(torch.tensor([1, 2]), stop_strings=stop)
+    assert request.stop_strings == expected
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+
+from whisper_live.mel_frontend import IncrementalLogMel, N_FRAMES, pad_log_mel
+
+ASSETS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "assets")
+
+
+def short_clip(seconds=0.5):
+    rng = np.random.default_rng(0)
+    return (0.1 * rng.standard_normal(int(16000 * seconds))).astype(np.float32)
+
+
+def test_pad_log_mel_matches_cached_silence():
+    pytest.importorskip("faster_whisper")
+    from faster_whisper.feature_extractor import FeatureExtractor
+
+    filters = torch.from_numpy(FeatureExtractor().mel_filters.astype(np.float32))
+    cached = IncrementalLogMel()(short_clip(), filters).numpy()
+    # 0.5 s of audio only reach the first 52 frames, the rest is silent padding
+    padded = pad_log_mel(cached[:, :60])
+    assert padded.shape == (filters.shape[0], N_FRAMES)
+    np.testing.assert_allclose(padded, cached)
+
+
+def test_features_equal_with_and_without_cache():
+    pytest.importorskip("ctranslate2")
+    pytest.importorskip("faster_whisper")
+    from faster_whisper.feature_extractor import FeatureExtractor
+    from whisper_live.transcriber import WhisperModel
+
+    # only the feature extractor and the filters are needed, not a loaded model
+    model = WhisperModel.__new__(WhisperModel)
+    model.feature_extractor = FeatureExtractor()
+    model.mel_filters = torch.from_numpy(model.feature_extractor.mel_filters.astype(np.float32))
+
+    audio = short_clip()
+    uncached = model.features(audio)
+    cached = model.features(audio, IncrementalLogMel(), offset=0)
+    assert uncached.shape == cached.shape
+    np.testing.assert_allclose(uncached, cached, atol=1e-4)
+
+
+def test_cached_windows_match_full_recompute():
+    pytest.importorskip("kaldialign")
+    pytest.importorskip("soundfile")
+    from whisper_live.whisper_utils import log_mel_spectrogram, mel_filters
+
+    filters = mel_filters("cpu", 80, ASSETS)
+    stream = short_clip(seconds=8.0)
+    mel_cache = IncrementalLogMel()
+    # the window grows by uneven steps, then its start moves forward and it grows again
+    windows = [(0, end) for end in (4000, 4321, 9000, 16000, 48017, 64000)]
+    windows += [(24000, end) for end in (64000, 64160, 100000, 128000)]
+    for start, end in windows:
+        audio = stream[start:end]
+        cached = mel_cache(audio, filters, offset=start)
+        full = log_mel_spectrogram(audio, 80, mel_filters_dir=ASSETS)
+        torch.testing.assert_close(cached, full, atol=1e-4, rtol=1e-4)
+    assert mel_cache.offset == 24000
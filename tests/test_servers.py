@@ -0,0 +1,19 @@
+import pickle
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("scipy")
+pytest.importorskip("websockets")
+
+from whisper_live.async_server import AsyncTranscriptionServer
+from whisper_live.trt_server import TranscriptionServer
+
+
+@pytest.mark.parametrize("server_type", [TranscriptionServer, AsyncTranscriptionServer])
+def test_run_pickles_for_spawned_process(server_type):
+    # api_main passes `run` to a multiprocessing.Process started with the spawn method
+    run = pickle.loads(pickle.dumps(server_type().run))
+    assert isinstance(run.__self__, server_type)
+    with run.__self__.admission_lock:
+        run.__self__.admission_lock.notify_all()
@@ -0,0 +1,60 @@
+import pickle
+import sqlite3
+import time
+
+from whisper_live.session_store import SessionStore, SqliteSessionStore
+
+
+def test_session_store_evicts_least_recently_used():
+    store = SessionStore(max_sessions=2)
+    store["a"] = 1
+    store["b"] = 2
+    store.get("a")
+    store["c"] = 3
+    assert "b" not in store
+    assert store.get("a") == 1 and store.get("c") == 3
+
+
+def test_sqlite_store_sees_pop_from_another_process(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    # two stores on one database stand for two processes with their own memory caches
+    first = SqliteSessionStore(path)
+    second = SqliteSessionStore(path)
+    first["user"] = ["hello"]
+    assert second.get("user") == ["hello"]
+
+    first.pop("user")
+    assert second.get("user") is None
+    assert "user" not in second
+
+    second["other"] = 1
+    first.get("other")
+    second.pop("other")
+    first["user"] = ["again"]
+    assert second.get("user") == ["again"]
+    assert "other" not in first
+
+
+def test_sqlite_store_sees_write_from_another_process(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    first = SqliteSessionStore(path)
+    second = SqliteSessionStore(path)
+    first["user"] = ["hello"]
+    assert second.get("user") == ["hello"]
+    first["user"] = ["hello", "world"]
+    assert second.get("user") == ["hello", "world"]
+    assert second.pop("user") == ["hello", "world"]
+    assert first.get("user") is None
+
+
+def test_sqlite_store_opens_database_without_versions(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE sessions (key TEXT PRIMARY KEY, value BLOB, accessed REAL)")
+    db.execute("INSERT INTO sessions VALUES (?, ?, ?)", ("user", pickle.dumps([1]), time.time()))
+    db.commit()
+    db.close()
+    store = SqliteSessionStore(path)
+    assert store.get("user") == [1]
+    store["user"] = [1, 2]
+    assert SqliteSessionStore(path).get("user") == [1, 2]
@@ -7,6 +7,7 @@ from websockets.sync.server import serve
 from whisperspeech.pipeline import Pipeline
 import json
 import base64
+import queue
 from transformers import pipeline
 from melo.api import TTS
 
@@ -17,7 +18,7 @@ speed = 1.0
 
 class WhisperSpeechTTS:
     def __init__(self):
-        pass
+        self.response_cache = None
 
     def initialize_model(self):
         self.pipe = Pipeline(t2s_ref='collabora/whisperspeech:t2s-v1.1-small-en+pl.model', s2a_ref='collabora/whisperspeech:s2a-v1.1-small-en+pl.model', torch_compile=True, device="cuda:1")
@@ -44,7 +45,25 @@ class WhisperSpeechTTS:
         else:
             return self.models[language].tts_to_file(llm_output, self.models[language].hps.data.spk2id[language.upper()], None, speed=speed)
 
-    def run(self, host, port, audio_queue=None, should_send_server_ready=None):
+    def synthesize(self, language, llm_output):
+        """Return the audio of a chunk, from the response cache if it was spoken before."""
+        if self.response_cache is None:
+            return self.generate_text(language, llm_output)
+        audio = self.response_cache.get_audio(language, llm_output)
+        if audio is not None:
+            logging.info(f"[WhisperSpeech INFO:] Cached audio for SENTENCE: {llm_output.strip()}")
+            self.response_cache.log_stats("[WhisperSpeech INFO:]")
+            return audio
+        audio = self.generate_text(language, llm_output)
+        self.response_cache.put_audio(language, llm_output, audio)
+        return audio
+
+    def run(self, host, port, audio_queue=None, should_send_server_ready=None, response_cache=None):
+        self.response_cache = response_cache
+        # this process consumes the audio queue, read it during the warmup and while no TTS
+        # client is connected, or the LLM client blocks once the pipe is full
+        if audio_queue is not None:
+            audio_queue.start_reader()
         # initialize and warmup model
         self.initialize_model()
         logging.info("\n[WhisperSpeech INFO:] Warming up torch compile model. Please wait ...\n")
@@ -71,16 +90,16 @@ class WhisperSpeechTTS:
                 uid = json.loads(uid)
                 user = uid["id"]
                 continue
-            if not user in audio_queue or len(audio_queue[user]) == 0:
+            try:
+                llm_response = audio_queue.get(user, timeout=1.0)
+            except queue.Empty:
                 continue
-            temp = audio_queue[user]
-            llm_response = temp.pop(0)
-            audio_queue[user] = temp
             try:
                 websocket.ping()
             except Exception as e:
                 del websocket
-                audio_queue[user] += llm_response
+                # the user's queue would otherwise stay in this process for good
+                audio_queue.discard(user)
                 break
             
             llm_output = llm_response["llm_output"]
@@ -97,7 +116,7 @@ class WhisperSpeechTTS:
                     start = time.time()
 
                     help = llm_response["language"]
-                    self.output_audio = self.generate_text(help, llm_output)
+                    self.output_audio = self.synthesize(help, llm_output)
                     inference_time = time.time() - start
                     logging.info(f"[WhisperSpeech INFO:] TTS inference done in {inference_time} ms for  SENTENCE: {llm_output.strip()}.\n\n")
                     self.last_llm_response = llm_output.strip()
@@ -0,0 +1,196 @@
+import collections
+import time
+
+
+class AdmissionController:
+    """
+    Capacity-aware admission of transcription sessions with a FIFO wait queue.
+
+    Instead of a fixed number of clients, sessions are admitted while the measured load of the
+    shared decode scheduler stays within the latency targets:
+
+    * real-time factor: fraction of the wall-clock time the decode workers spent decoding over
+      the last `window` seconds, projected to one more session,
+    * decode latency: moving average of the seconds from submitting a window to its transcript,
+      halved every `window` seconds without a decode so that it recovers after a burst,
+    * decode queue depth: windows waiting for a free worker.
+
+    The first `min_clients` sessions are always admitted. Beyond that admissions are spaced by
+    `settle_time`, so that the load of the previous session shows in the measurements before
+    the next one is let in. Sessions that cannot be admitted wait in FIFO order and only the
+    head of the queue can be promoted.
+
+    The controller is not thread-safe, callers serialize access with their own lock.
+
+    Attributes:
+        decode_scheduler (DecodeScheduler): Scheduler whose load is measured, None admits up to `max_clients`.
+        max_rtf (float): Maximum projected real-time factor of the decode workers.
+        max_latency (float): Maximum average decode latency in seconds.
+        max_queue_depth (int): Maximum number of windows waiting for a worker.
+        min_clients (int): Sessions admitted regardless of the load.
+        max_clients (int): Hard limit of concurrent sessions, None for no limit.
+        active (int): Number of admitted sessions.
+        wait_queue (collections.deque): Keys of the waiting sessions, the head is promoted first.
+        session_time (float): Moving average of the duration of finished sessions.
+    """
+
+    def __init__(
+        self,
+        decode_scheduler=None,
+        max_rtf=0.8,
+        max_latency=1.0,
+        max_queue_depth=None,
+        min_clients=4,
+        max_clients=None,
+        window=10.0,
+        settle_time=1.0,
+        default_session_time=300.0,
+        ):
+        """
+        Initialize an AdmissionController.
+
+        Args:
+            decode_scheduler (DecodeScheduler, optional): Scheduler whose load is measured.
+            max_rtf (float, optional): Maximum projected real-time factor. Defaults to 0.8.
+            max_latency (float, optional): Maximum average decode latency in seconds. Defaults to 1.0.
+            max_queue_depth (int, optional): Maximum queued windows. Defaults to one full batch per worker.
+            min_clients (int, optional): Sessions admitted regardless of the load. Defaults to 4.
+            max_clients (int, optional): Hard limit of concurrent sessions. Defaults to no limit.
+            window (float, optional): Seconds over which the real-time factor is measured. Defaults to 10.
+            settle_time (float, optional): Minimum seconds between load-based admissions. Defaults to 1.
+            default_session_time (float, optional): Session duration assumed for wait estimates until
+                sessions have finished. Defaults to 300.
+        """
+        self.decode_scheduler = decode_scheduler
+        self.max_rtf = max_rtf
+        self.max_latency = max_latency
+        if max_queue_depth is None and decode_scheduler is not None:
+            max_queue_depth = decode_scheduler.max_batch_size * len(decode_scheduler.workers)
+        self.max_queue_depth = max_queue_depth
+        self.min_clients = min_clients
+        self.max_clients = max_clients
+        self.window = window
+        self.settle_time = settle_time
+        self.active = 0
+        self.wait_queue = collections.deque()
+        self.session_time = default_session_time
+        self.last_admit_time = 0.0
+        self.samples = collections.deque()
+
+    def rtf(self):
+        """
+        Measure the real-time factor of the decode workers over the last `window` seconds.
+
+        Returns:
+            float: Decoding seconds per wall-clock second and worker, 0 without measurements.
+        """
+        if self.decode_scheduler is None:
+            return 0.0
+        now = time.time()
+        self.samples.append((now, self.decode_scheduler.busy_time))
+        while len(self.samples) > 2 and now - self.samples[1][0] >= self.window:
+            self.samples.popleft()
+        then, busy_then = self.samples[0]
+        if now - then <= 0:
+            return 0.0
+        busy = self.decode_scheduler.busy_time - busy_then
+        return busy / (now - then) / len(self.decode_scheduler.workers)
+
+    def latency(self):
+        """
+        Return the decode latency of the scheduler, decayed while no window is decoded.
+
+        The moving average is only updated by decodes, after a burst it would stay high and
+        keep the waiting sessions, the only ones that could bring new decodes, out for good.
+
+        Returns:
+            float: The decayed average decode latency in seconds.
+        """
+        idle = max(time.time() - self.decode_scheduler.last_decode_time, 0.0)
+        return self.decode_scheduler.latency * 0.5 ** (idle / self.window)
+
+    def has_capacity(self):
+        """
+        Check whether one more session can be admitted without breaking the latency targets.
+
+        Returns:
+            bool: True if a session can be admitted now.
+        """
+        rtf = self.rtf()
+        if self.active < self.min_clients:
+            return True
+        if self.max_clients is not None and self.active >= self.max_clients:
+            return False
+        if self.decode_scheduler is None:
+            return True
+        if time.time() - self.last_admit_time < self.settle_time:
+            return False
+        if self.decode_scheduler.queue_depth > self.max_queue_depth:
+            return False
+        if self.latency() > self.max_latency:
+            return False
+        # with min_clients=0 the first session is projected from the idle load
+        return rtf * (self.active + 1) / max(self.active, 1) <= self.max_rtf
+
+    def enqueue(self, key):
+        """Append a session to the wait queue."""
+        self.wait_queue.append(key)
+
+    def remove(self, key):
+        """Drop a session that left while waiting."""
+        if key in self.wait_queue:
+            self.wait_queue.remove(key)
+
+    def position(self, key):
+        """Return the 1-based position of a waiting session."""
+        return self.wait_queue.index(key) + 1
+
+    def try_admit(self, key):
+        """
+        Admit a waiting session if it is at the head of the queue and there is capacity.
+
+        Args:
+            key (Hashable): The session, as passed to `enqueue`.
+
+        Returns:
+            bool: True if the session was admitted and removed from the queue.
+        """
+        if not self.wait_queue or self.wait_queue[0] != key or not self.has_capacity():
+            return False
+        self.wait_queue.popleft()
+        self.active += 1
+        self.last_admit_time = time.time()
+        return True
+
+    def release(self, duration=None):
+        """
+        Free the slot of a finished session.
+
+        Args:
+            duration (float, optional): Seconds the session was connected. None for a session that
+                failed to start, it does not count towards `session_time`.
+        """
+        self.active -= 1
+        if duration is not None:
+            self.session_time = 0.8 * self.session_time + 0.2 * duration
+
+    def eta(self, position, elapsed):
+        """
+        Estimate how long a waiting session will wait for its slot.
+
+        Sessions are assumed to last `session_time`, the waiting session gets the slot of the
+        `position`-th active session expected to finish, wrapping around when there are more
+        waiting than active sessions.
+
+        Args:
+            position (int): 1-based position in the wait queue.
+            elapsed (List[float]): Seconds the active sessions have been connected.
+
+        Returns:
+            float: The estimated wait in seconds.
+        """
+        if not elapsed:
+            return 0.0
+        remaining = sorted(max(self.session_time - e, 0.0) for e in elapsed)
+        rounds, index = divmod(position - 1, len(remaining))
+        return remaining[index] + rounds * self.session_time
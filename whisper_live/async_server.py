@@ -0,0 +1,596 @@
+import argparse
+import asyncio
+import json
+import logging
+import resource
+import threading
+import time
+
+import numpy as np
+import torch
+import websockets
+
+from whisper_live.admission import AdmissionController
+from whisper_live.audio_buffer import AudioRingBuffer
+from whisper_live.audio_format import AUDIO_FORMATS, decode_frame, encode_frame, to_float32
+from whisper_live.decode_scheduler import DecodeScheduler
+from whisper_live.mel_frontend import IncrementalLogMel
+from whisper_live.transcriber_pool import TranscriberPool
+from whisper_live.trt_server import TranscriptionServer
+from whisper_live.vad import VadState, VoiceActivityDetection
+
+logging.basicConfig(level=logging.INFO)
+
+
+class AsyncTranscriptionServer(TranscriptionServer):
+    """
+    Transcription server running every connection on a single asyncio event loop.
+
+    `TranscriptionServer` spends one OS thread per connection in `recv_audio` and one more per
+    `ServeClient` for `speech_to_text`, so the thread count and GIL contention grow with the
+    number of connected clients even when most of them are silent. Here socket I/O, VAD and
+    frame ingestion run as coroutines on the event loop. The only other threads, independently
+    of the number of clients, are the decode scheduler workers: one per pooled transcriber,
+    they are the fixed-size executor running the Whisper models.
+
+    The LLM responses of all clients are forwarded by one server-wide task instead of being
+    polled by every client. The `UserChannel` reader wakes the task on the event loop for
+    every response, and draining the channel is local to the process, so it runs on the loop.
+
+    Attributes:
+        admission_changed (asyncio.Condition): Notified when a waiting client may be admitted.
+    """
+
+    def __init__(self, max_clients=None):
+        """
+        Initialize an AsyncTranscriptionServer.
+
+        Args:
+            max_clients (int, optional): Hard limit of connected clients. Defaults to no limit.
+        """
+        super().__init__()
+        self.max_clients = max_clients
+        self.admission_changed = None
+
+    async def recv_audio(self, websocket, transcription_queue=None, llm_queue=None, conversation_history=None, events=None):
+        """
+        Receive audio chunks from a client until it disconnects, see `TranscriptionServer.recv_audio`.
+
+        Unlike the threaded server, a silent client does not sleep the connection: the EOS is
+        flagged and the frame dropped, the event loop stays free for the other clients.
+
+        Args:
+            websocket (websockets.ServerConnection): The WebSocket connection for the client.
+        """
+        vad_state = VadState()
+
+        logging.info("[Whisper INFO:] New client connected")
+        options = json.loads(await websocket.recv())
+
+        audio_format = options.get("audio_format", "float32")
+        if audio_format not in AUDIO_FORMATS:
+            logging.warning(f"[Whisper WARNING:] Unsupported audio format {audio_format}")
+            await websocket.send(json.dumps({
+                "uid": options["uid"],
+                "status": "ERROR",
+                "message": f"Unsupported audio format {audio_format}, expected one of {AUDIO_FORMATS}.",
+            }))
+            await websocket.close()
+            return
+
+        if not await self.wait_for_admission(websocket, options["uid"]):
+            return
+
+        client = None
+        try:
+            client = AsyncServeClient(
+                websocket,
+                multilingual=options["multilingual"],
+                input_language=options["input_language"],
+                output_language=options["output_language"],
+                task=options["task"],
+                client_uid=options["uid"],
+                transcription_queue=transcription_queue,
+                llm_queue=llm_queue,
+                decode_scheduler=self.decode_scheduler,
+            )
+            await client.start()
+        except Exception as e:
+            # the slot was taken in wait_for_admission, release_client only knows registered clients
+            logging.exception(f"[Whisper ERROR:] Could not start client {options['uid']}: {e}")
+            if client is not None:
+                await client.cleanup()
+            self.admission.release()
+            await self.notify_admission()
+            await websocket.close()
+            return
+        self.clients[websocket] = client
+        self.clients_start_time[websocket] = time.time()
+
+        no_voice_activity_chunks = 0
+        try:
+            async for frame_data in websocket:
+                # text frames carry control messages, binary frames carry audio
+                if isinstance(frame_data, str):
+                    dumps = json.loads(frame_data)
+                    client.input_language = dumps["input_language"]
+                    client.output_language = dumps["output_language"]
+                    continue
+
+                frame_np = decode_frame(frame_data, audio_format)
+
+                # VAD, a single frame is cheap enough to run on the event loop
+                speech_prob = self.vad_model(
+                    torch.from_numpy(to_float32(frame_np)), self.RATE, state=vad_state).item()
+                if speech_prob < self.vad_threshold:
+                    no_voice_activity_chunks += 1
+                    if no_voice_activity_chunks > 5:
+                        client.set_eos(True)
+                    continue
+                no_voice_activity_chunks = 0
+                client.set_eos(False)
+                client.add_frames(frame_np)
+
+                elapsed_time = time.time() - self.clients_start_time[websocket]
+                if elapsed_time >= self.max_connection_time:
+                    await client.disconnect()
+                    logging.warning(f"{client} Client disconnected due to overtime.")
+                    break
+        except websockets.ConnectionClosed:
+            pass
+        except Exception as e:
+            logging.exception(e)
+        finally:
+            if conversation_history is not None:
+                conversation_history.pop(client.client_uid, None)
+            if events is not None and client.client_uid in events:
+                events[client.client_uid].set()
+            await client.cleanup()
+            del self.clients[websocket]
+            await self.release_client(websocket)
+            await websocket.close()
+            logging.info("[Whisper INFO:] Connection Closed.")
+
+    async def wait_for_admission(self, websocket, client_uid):
+        """
+        Queue a new client until the admission controller has capacity, see
+        `TranscriptionServer.wait_for_admission`.
+
+        Returns:
+            bool: True once admitted, False if the client disconnected while waiting.
+        """
+        self.admission.enqueue(websocket)
+        try:
+            while not self.admission.try_admit(websocket):
+                position = self.admission.position(websocket)
+                await websocket.send(json.dumps({
+                    "uid": client_uid,
+                    "status": "WAIT",
+                    "message": self.get_wait_time(position),
+                    "position": position,
+                }))
+                async with self.admission_changed:
+                    try:
+                        await asyncio.wait_for(self.admission_changed.wait(), self.wait_update_interval)
+                    except asyncio.TimeoutError:
+                        pass
+        except Exception as e:
+            logging.info(f"[Whisper INFO:] Client {client_uid} left the wait queue: {e}")
+            self.admission.remove(websocket)
+            await self.notify_admission()
+            return False
+        # the next client in the queue may fit as well
+        await self.notify_admission()
+        return True
+
+    async def notify_admission(self):
+        async with self.admission_changed:
+            self.admission_changed.notify_all()
+
+    async def release_client(self, websocket):
+        """Free the admission slot of a disconnected client and promote the next waiting one."""
+        start_time = self.clients_start_time.pop(websocket)
+        self.admission.release(time.time() - start_time)
+        await self.notify_admission()
+
+    async def forward_llm_responses(self, llm_queue):
+        """
+        Forward the LLM responses to the connected clients, for all clients at once.
+
+        Args:
+            llm_queue (UserChannel): Channel of LLM responses keyed by client uid.
+        """
+        loop = asyncio.get_running_loop()
+        pending = set()
+        arrived = asyncio.Event()
+
+        def on_response(user):
+            pending.add(user)
+            arrived.set()
+
+        def notify(user):
+            # called by the channel reader, or by the LLM stage in single process mode
+            try:
+                loop.call_soon_threadsafe(on_response, user)
+            except RuntimeError:
+                # the loop closed while the listener was being removed
+                pass
+
+        llm_queue.add_listener(notify)
+        try:
+            while True:
+                await arrived.wait()
+                arrived.clear()
+                users = set(pending)
+                pending.clear()
+                for client in list(self.clients.values()):
+                    if client.client_uid not in users:
+                        continue
+                    for llm_response in llm_queue.drain(client.client_uid):
+                        await client.send(llm_response)
+        finally:
+            llm_queue.remove_listener(notify)
+
+    async def serve(self, host, port=9090, transcription_queue=None, llm_queue=None, conversation_history=None, events=None, ready=None):
+        """
+        Serve clients on the running event loop until cancelled.
+
+        Args:
+            host (str): The host address to bind the server.
+            port (int): The port number to bind the server.
+            ready (asyncio.Event, optional): Set once the server is listening.
+        """
+        self.admission_changed = asyncio.Condition()
+
+        async def handler(websocket):
+            await self.recv_audio(
+                websocket,
+                transcription_queue=transcription_queue,
+                llm_queue=llm_queue,
+                conversation_history=conversation_history,
+                events=events,
+            )
+
+        forwarder = None
+        if llm_queue is not None:
+            forwarder = asyncio.create_task(self.forward_llm_responses(llm_queue))
+        try:
+            async with websockets.serve(handler, host, port):
+                if ready is not None:
+                    ready.set()
+                await asyncio.Future()
+        finally:
+            if forwarder is not None:
+                forwarder.cancel()
+
+    def run(self, host, port=9090, transcription_queue=None, llm_queue=None, whisper_tensorrt_path=None, should_send_server_ready=None, conversation_history=None, events=None, transcriber_pool_size=1, max_batch_size=8, max_batch_wait=0.005, vad_batching=False, backend="tensorrt", whisper_model=None, device=None, compute_type=None, max_rtf=0.8, max_decode_latency=1.0):
+        """
+        Run the transcription server, takes the same arguments as `TranscriptionServer.run`.
+
+        `vad_batching` is ignored: the batcher blocks the calling thread on its future, the VAD
+        runs on the event loop instead.
+        """
+        if llm_queue is not None:
+            llm_queue.start_reader()
+        self.load_models(
+            whisper_tensorrt_path,
+            transcriber_pool_size=transcriber_pool_size,
+            max_batch_size=max_batch_size,
+            max_batch_wait=max_batch_wait,
+            vad_batching=False,
+            backend=backend,
+            whisper_model=whisper_model,
+            device=device,
+            compute_type=compute_type,
+            max_rtf=max_rtf,
+            max_decode_latency=max_decode_latency,
+        )
+
+        # wait for WhisperSpeech to warmup
+        while should_send_server_ready is not None and not should_send_server_ready.value:
+            time.sleep(0.5)
+
+        asyncio.run(self.serve(host, port, transcription_queue, llm_queue, conversation_history, events))
+
+
+class AsyncServeClient:
+    """
+    Per-connection transcription state of the `AsyncTranscriptionServer`.
+
+    Mirrors `ServeClient`, but `speech_to_text` is a task on the event loop that sleeps on an
+    `asyncio.Event` and awaits the decode scheduler, so an idle client costs no thread.
+
+    Attributes:
+        client_uid (str): A unique identifier for the client.
+        task (str): The task type, e.g., "transcribe."
+        decode_scheduler (DecodeScheduler): Batches decode windows with those of the other clients.
+        audio_buffer (AudioRingBuffer): Ring buffer holding the last 45 seconds of audio.
+        mel_cache (IncrementalLogMel): Log-mel frames of the pending window computed so far.
+        audio_available (asyncio.Event): Set by `add_frames`, `set_eos` and `cleanup`.
+        exit (bool): A flag to exit the transcription task.
+    """
+    RATE = 16000
+    SERVER_READY = "SERVER_READY"
+    DISCONNECT = "DISCONNECT"
+
+    def __init__(
+        self,
+        websocket,
+        task="transcribe",
+        multilingual=False,
+        input_language="en",
+        output_language="en",
+        client_uid=None,
+        transcription_queue=None,
+        llm_queue=None,
+        decode_scheduler=None,
+        buffer_dtype=np.float32,
+        ):
+        """
+        Initialize an AsyncServeClient, `start` must be awaited before frames are added.
+
+        Args:
+            websocket (websockets.ServerConnection): The WebSocket connection for the client.
+            task (str, optional): The task type, e.g., "transcribe." Defaults to "transcribe".
+            multilingual (bool, optional): Whether the client supports multilingual transcription. Defaults to False.
+            input_language (str, optional): The language for transcription. Defaults to "en".
+            output_language (str, optional): The language of the answer. Defaults to "en".
+            client_uid (str, optional): A unique identifier for the client. Defaults to None.
+            transcription_queue (TranscriptMailbox, optional): Mailbox of transcripts for the LLM client.
+            llm_queue (UserChannel, optional): Channel of LLM responses keyed by client uid.
+            decode_scheduler (DecodeScheduler): Scheduler shared with the other clients.
+            buffer_dtype (numpy.dtype, optional): Storage dtype of the audio buffer. Defaults to np.float32.
+        """
+        if decode_scheduler is None:
+            raise ValueError("Decode scheduler is None.")
+        self.decode_scheduler = decode_scheduler
+        self.websocket = websocket
+        self.client_uid = client_uid
+        self.transcription_queue = transcription_queue
+        self.llm_queue = llm_queue
+        self.task = task
+        self.input_language = input_language
+        self.output_language = output_language
+        self.last_prompt = None
+        self.prompt = None
+        self.segment_inference_time = []
+
+        self.audio_buffer = AudioRingBuffer(capacity=45, rate=self.RATE, dtype=buffer_dtype)
+        self.mel_cache = IncrementalLogMel()
+        self.audio_available = asyncio.Event()
+        self.eos = False
+        self.exit = False
+        self.last_decoded_samples = 0
+        self.last_decoded_eos = False
+        self.trans_task = None
+
+    async def start(self):
+        """Start the transcription task and tell the client the server is ready."""
+        self.trans_task = asyncio.create_task(self.speech_to_text())
+        await self.send({"uid": self.client_uid, "message": self.SERVER_READY})
+
+    async def send(self, message):
+        """Send a JSON message, a closed connection is ignored since `recv_audio` cleans up."""
+        try:
+            await self.websocket.send(json.dumps(message))
+        except websockets.ConnectionClosed:
+            pass
+
+    def set_eos(self, eos):
+        if self.eos != eos:
+            self.eos = eos
+            self.audio_available.set()
+
+    def add_frames(self, frame_np):
+        """
+        Add audio frames to the ring buffer and wake the transcription task.
+
+        Args:
+            frame_np (numpy.ndarray): The audio frame data as a NumPy array.
+        """
+        self.audio_buffer.write(frame_np)
+        self.audio_available.set()
+
+    def should_decode(self, min_duration):
+        """
+        Check whether the transcription task has work.
+
+        Args:
+            min_duration (float): Minimum seconds of pending audio worth decoding.
+
+        Returns:
+            bool: True if the client is exiting, or if at least `min_duration` seconds are pending
+                and new audio arrived or the EOS flag changed since the last decode.
+        """
+        if self.exit:
+            return True
+        if self.audio_buffer.pending_duration < min_duration:
+            return False
+        return (self.audio_buffer.total_samples != self.last_decoded_samples
+                or self.eos != self.last_decoded_eos)
+
+    async def wait_for_audio(self, min_duration):
+        """
+        Wait until there is audio worth decoding.
+
+        Args:
+            min_duration (float): Minimum seconds of pending audio worth decoding.
+
+        Returns:
+            bool: True if a decode should run now, False on exit.
+        """
+        while not self.should_decode(min_duration):
+            self.audio_available.clear()
+            await self.audio_available.wait()
+        if self.exit:
+            return False
+        self.last_decoded_samples = self.audio_buffer.total_samples
+        self.last_decoded_eos = self.eos
+        return True
+
+    async def speech_to_text(self):
+        """
+        Transcribe the pending audio whenever enough of it arrived, see `ServeClient.speech_to_text`.
+
+        The decode itself runs on the decode scheduler workers, the task only awaits its future.
+        """
+        while await self.wait_for_audio(0.4):
+            # clip audio if the current chunk exceeds 25 seconds, this basically implies that
+            # no valid segment for the last 25 seconds from whisper
+            self.audio_buffer.clip(25, keep=5)
+
+            offset = self.audio_buffer.cursor_sample
+            input_sample = self.audio_buffer.pending()
+            duration = input_sample.shape[0] / self.RATE
+            eos = self.eos
+
+            try:
+                start = time.time()
+                last_segment = await asyncio.wrap_future(self.decode_scheduler.submit(
+                    input_sample, self.input_language, self.task, mel_cache=self.mel_cache, offset=offset))
+                infer_time = time.time() - start
+                self.segment_inference_time.append(infer_time)
+            except Exception as e:
+                logging.exception(f"[ERROR]: {e}")
+                continue
+
+            if not len(last_segment):
+                continue
+            segments = [{"text": last_segment}]
+            self.prompt = ' '.join(segment['text'] for segment in segments)
+            if self.last_prompt != self.prompt:
+                await self.send({
+                    "uid": self.client_uid,
+                    "segments": segments,
+                    "eos": eos,
+                    "latency": infer_time
+                })
+            if self.transcription_queue is not None:
+                self.transcription_queue.put(
+                    self.client_uid,
+                    {"uid": self.client_uid, "prompt": self.prompt, "eos": eos, "language": self.output_language},
+                    final=eos,
+                )
+            if eos:
+                self.audio_buffer.advance(duration)
+                logging.info(f"[Whisper INFO]: {self.prompt}, eos: {eos}")
+                logging.info(
+                    f"[Whisper INFO]: Average inference time {sum(self.segment_inference_time) / len(self.segment_inference_time)}\n\n")
+                self.segment_inference_time = []
+
+        logging.info("[Whisper INFO:] Exiting speech to text task")
+
+    async def disconnect(self):
+        """Notify the client of disconnection and send a disconnect message."""
+        await self.send({"uid": self.client_uid, "message": self.DISCONNECT})
+
+    async def cleanup(self):
+        """Stop the transcription task and drop the client's pending LLM responses."""
+        logging.info("Cleaning up.")
+        self.exit = True
+        self.audio_available.set()
+        if self.trans_task is not None:
+            await self.trans_task
+        if self.transcription_queue is not None:
+            self.transcription_queue.discard(self.client_uid)
+        if self.llm_queue is not None:
+            self.llm_queue.discard(self.client_uid)
+
+
+class SoakTranscriber:
+    """Stand-in transcriber for the soak test, sleeps like a batched decode would."""
+
+    def __init__(self, batch_latency=0.05):
+        self.batch_latency = batch_latency
+
+    def transcribe_batch(self, audios, languages, tasks=None, mel_caches=None, offsets=None):
+        time.sleep(self.batch_latency)
+        return [f"{audio.shape[0]} samples" for audio in audios]
+
+
+async def soak(port, num_idle, num_active, duration, audio_format):
+    """
+    Open `num_idle` connections that only send the options and keep them open, while
+    `num_active` clients stream 16 kHz noise in real time. Reports the thread count, the
+    resident memory and the latency of the active clients' transcripts.
+    """
+    options = {
+        "uid": None, "multilingual": False, "input_language": "en",
+        "output_language": "en", "task": "transcribe", "audio_format": audio_format,
+    }
+
+    async def open_client(uid):
+        websocket = await websockets.connect(f"ws://127.0.0.1:{port}", open_timeout=60)
+        await websocket.send(json.dumps(dict(options, uid=uid)))
+        assert json.loads(await websocket.recv())["message"] == "SERVER_READY"
+        return websocket
+
+    async def stream(websocket, latencies):
+        chunk = 4096
+        rng = np.random.default_rng(0)
+
+        async def read():
+            async for message in websocket:
+                message = json.loads(message)
+                if "segments" in message:
+                    latencies.append(message["latency"])
+
+        reader = asyncio.create_task(read())
+        end = time.time() + duration
+        while time.time() < end:
+            frame = (rng.standard_normal(chunk) * 0.3).astype(np.float32)
+            await websocket.send(encode_frame(frame, audio_format))
+            await asyncio.sleep(chunk / 16000)
+        reader.cancel()
+
+    start = time.time()
+    idle = await asyncio.gather(*(open_client(f"idle-{i}") for i in range(num_idle)))
+    connect_time = time.time() - start
+    active = await asyncio.gather(*(open_client(f"active-{i}") for i in range(num_active)))
+
+    latencies = []
+    await asyncio.gather(*(stream(websocket, latencies) for websocket in active))
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{num_idle} idle + {num_active} active connections, opened idle in {connect_time:.2f}s")
+    print(f"threads: {threading.active_count()}, max RSS: {rss:.0f} MiB (server and clients)")
+    if latencies:
+        print(f"transcripts: {len(latencies)}, mean decode latency {1000 * np.mean(latencies):.1f}ms, "
+              f"p99 {1000 * np.percentile(latencies, 99):.1f}ms")
+
+    await asyncio.gather(*(websocket.close() for websocket in idle + active))
+
+
+async def run_soak(args):
+    server = AsyncTranscriptionServer()
+    # the real VAD, only the whisper engine is replaced so the test runs without a GPU
+    server.vad_model = VoiceActivityDetection()
+    server.transcriber_pool = TranscriberPool(lambda: SoakTranscriber(args.batch_latency), size=1)
+    server.decode_scheduler = DecodeScheduler(server.transcriber_pool)
+    # the soak test measures connection scaling, every client is admitted right away
+    server.admission = AdmissionController(server.decode_scheduler, min_clients=args.idle + args.active)
+    server.vad_threshold = 0.0  # noise counts as speech
+
+    ready = asyncio.Event()
+    serving = asyncio.create_task(server.serve("127.0.0.1", args.port, ready=ready))
+    await ready.wait()
+    try:
+        await soak(args.port, args.idle, args.active, args.duration, args.audio_format)
+        print(f"decoded {server.decode_scheduler.num_decoded} windows in "
+              f"{server.decode_scheduler.num_batches} batches")
+    finally:
+        serving.cancel()
+        server.decode_scheduler.stop()
+
+
+if __name__ == "__main__":
+    # soak test: hundreds of mostly idle connections served by one process
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--idle', type=int, default=500, help='Connections that never send audio')
+    parser.add_argument('--active', type=int, default=8, help='Connections streaming audio in real time')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds the active clients stream')
+    parser.add_argument('--batch_latency', type=float, default=0.05, help='Seconds a fake decode batch takes')
+    parser.add_argument('--audio_format', type=str, default="int16", choices=AUDIO_FORMATS)
+    parser.add_argument('--port', type=int, default=9191)
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run_soak(parser.parse_args()))
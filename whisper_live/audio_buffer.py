@@ -0,0 +1,202 @@
+import time
+
+import numpy as np
+
+
+class AudioRingBuffer:
+    """
+    Fixed-capacity ring buffer holding the most recent audio of a client stream.
+
+    Samples are addressed by their timestamp (in seconds) since the start of the stream,
+    so callers never have to track how much audio has been discarded. The buffer is
+    mirrored (every sample is stored at `i` and `i + capacity`), which makes any window of
+    at most `capacity` samples a contiguous slice of the backing array: reading the decode
+    window is a zero-copy view and appending a frame costs O(len(frame)) regardless of how
+    long the utterance has been running.
+
+    Attributes:
+        rate (int): The audio sampling rate.
+        capacity (int): Maximum number of samples retained.
+        dtype (numpy.dtype): Storage dtype, float32 or int16 (halves memory, reads are copies).
+        total_samples (int): Number of samples written since the stream started.
+        cursor (float): Timestamp in seconds where the not yet finalized audio starts.
+    """
+
+    def __init__(self, capacity=45.0, rate=16000, dtype=np.float32):
+        """
+        Initialize an AudioRingBuffer instance.
+
+        Args:
+            capacity (float, optional): Seconds of audio to retain. Defaults to 45.
+            rate (int, optional): The audio sampling rate. Defaults to 16000.
+            dtype (numpy.dtype, optional): Storage dtype, np.float32 or np.int16. Defaults to np.float32.
+
+        Raises:
+            ValueError: If dtype is not float32 or int16.
+        """
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.dtype(np.float32), np.dtype(np.int16)):
+            raise ValueError(f"Unsupported buffer dtype: {self.dtype}")
+        self.rate = rate
+        self.capacity = int(capacity * rate)
+        self._data = np.zeros(2 * self.capacity, dtype=self.dtype)
+        self.total_samples = 0
+        self.cursor = 0.0
+
+    def __len__(self):
+        return min(self.total_samples, self.capacity)
+
+    @property
+    def start_time(self):
+        """float: Timestamp of the oldest sample still held in the buffer."""
+        return max(0, self.total_samples - self.capacity) / self.rate
+
+    @property
+    def end_time(self):
+        """float: Timestamp right after the newest sample, i.e. the stream duration."""
+        return self.total_samples / self.rate
+
+    @property
+    def cursor_sample(self):
+        """int: Stream index of the first sample returned by `pending`."""
+        return max(int(self.cursor * self.rate), self.total_samples - self.capacity, 0)
+
+    @property
+    def pending_duration(self):
+        """float: Seconds of audio between the cursor and the end of the stream."""
+        return self.end_time - max(self.cursor, self.start_time)
+
+    def write(self, frame):
+        """
+        Append an audio frame to the buffer, overwriting the oldest samples once full.
+
+        Args:
+            frame (numpy.ndarray): 1-D float32 samples in [-1, 1] or int16 samples.
+        """
+        frame = np.asarray(frame).reshape(-1)
+        if self.dtype == np.int16 and frame.dtype != np.int16:
+            frame = (np.clip(frame, -1.0, 1.0) * 32767).astype(np.int16)
+        elif self.dtype == np.float32 and frame.dtype == np.int16:
+            frame = frame.astype(np.float32) / 32768.0
+
+        n = frame.shape[0]
+        if n > self.capacity:
+            self.total_samples += n - self.capacity
+            frame = frame[-self.capacity:]
+            n = self.capacity
+
+        start = self.total_samples % self.capacity
+        first = min(n, self.capacity - start)
+        self._data[start:start + first] = frame[:first]
+        self._data[start + self.capacity:start + self.capacity + first] = frame[:first]
+        if first < n:
+            rest = n - first
+            self._data[:rest] = frame[first:]
+            self._data[self.capacity:self.capacity + rest] = frame[first:]
+        self.total_samples += n
+
+    def get(self, start_time, end_time=None):
+        """
+        Return the samples between two stream timestamps.
+
+        The start is clamped to the oldest retained sample and the end to the newest one.
+        For float32 storage the result is a read-only view into the buffer and stays valid
+        until `capacity` minus the window length of new audio has been written.
+
+        Args:
+            start_time (float): Timestamp of the first sample in seconds.
+            end_time (float, optional): Timestamp after the last sample. Defaults to the end of the stream.
+
+        Returns:
+            numpy.ndarray: float32 samples in [-1, 1].
+        """
+        start = max(int(start_time * self.rate), self.total_samples - self.capacity, 0)
+        end = self.total_samples if end_time is None else min(int(end_time * self.rate), self.total_samples)
+        if end <= start:
+            return np.zeros(0, dtype=np.float32)
+
+        offset = start % self.capacity
+        window = self._data[offset:offset + end - start]
+        if self.dtype == np.int16:
+            return window.astype(np.float32) / 32768.0
+        window = window.view()
+        window.flags.writeable = False
+        return window
+
+    def pending(self):
+        """
+        Return the audio from the cursor to the end of the stream.
+
+        Returns:
+            numpy.ndarray: float32 samples in [-1, 1].
+        """
+        return self.get(self.cursor)
+
+    def advance(self, duration):
+        """
+        Move the cursor forward, marking `duration` seconds of pending audio as finalized.
+
+        Args:
+            duration (float): Seconds to advance the cursor by.
+        """
+        self.cursor += duration
+
+    def clip(self, max_duration, keep):
+        """
+        Drop pending audio that has gone unfinalized for too long.
+
+        If more than `max_duration` seconds are pending, the cursor jumps forward so that only
+        the last `keep` seconds remain, which implies whisper found no valid segment in them.
+
+        Args:
+            max_duration (float): Maximum pending seconds tolerated.
+            keep (float): Seconds of the most recent audio to keep pending after clipping.
+        """
+        if self.pending_duration > max_duration:
+            self.cursor = self.end_time - keep
+
+    def reset(self):
+        """Forget all buffered audio and rewind the stream clock."""
+        self.total_samples = 0
+        self.cursor = 0.0
+
+
+if __name__ == "__main__":
+    # microbenchmark: per-frame cost of appending a 4096 sample frame and taking the
+    # decode window, np.concatenate (previous ServeClient.add_frames) vs. ring buffer
+    RATE = 16000
+    FRAME = 4096
+    frame = np.random.uniform(-1, 1, FRAME).astype(np.float32)
+
+    def concat_stream(n_frames):
+        frames_np, frames_offset, timestamp_offset = None, 0.0, 0.0
+        for _ in range(n_frames):
+            if frames_np is not None and frames_np.shape[0] > 45 * RATE:
+                frames_offset += 30.0
+                frames_np = frames_np[int(30 * RATE):]
+            frames_np = frame.copy() if frames_np is None else np.concatenate((frames_np, frame), axis=0)
+            if frames_np[int((timestamp_offset - frames_offset) * RATE):].shape[0] > 25 * RATE:
+                timestamp_offset = frames_offset + frames_np.shape[0] / RATE - 5
+            samples_take = max(0, (timestamp_offset - frames_offset) * RATE)
+            frames_np[int(samples_take):].copy().copy()
+
+    def ring_stream(n_frames, dtype):
+        buffer = AudioRingBuffer(45, RATE, dtype)
+        for _ in range(n_frames):
+            buffer.write(frame)
+            buffer.clip(25, 5)
+            buffer.pending()
+
+    for seconds in (5, 15, 30, 60):
+        n_frames = int(seconds * RATE / FRAME)
+        results = []
+        for name, fn in (
+            ("concatenate", concat_stream),
+            ("ring float32", lambda n: ring_stream(n, np.float32)),
+            ("ring int16", lambda n: ring_stream(n, np.int16)),
+        ):
+            start = time.perf_counter()
+            fn(n_frames)
+            per_frame = (time.perf_counter() - start) / n_frames * 1e6
+            results.append(f"{name}: {per_frame:8.1f} us/frame")
+        print(f"{seconds:3d}s stream | " + " | ".join(results))
@@ -0,0 +1,91 @@
+import numpy as np
+
+# wire formats a client can announce with "audio_format" in its options message
+AUDIO_FORMATS = ("float32", "int16", "mulaw")
+
+MULAW_BIAS = 0x84
+MULAW_CLIP = 32635
+
+
+def _mulaw_decode_table():
+    codes = ~np.arange(256, dtype=np.uint8)
+    exponent = (codes >> 4) & 0x07
+    mantissa = (codes & 0x0F).astype(np.int32)
+    magnitude = (((mantissa << 3) + MULAW_BIAS) << exponent) - MULAW_BIAS
+    return np.where(codes & 0x80, -magnitude, magnitude).astype(np.int16)
+
+
+MULAW_TABLE = _mulaw_decode_table()
+
+
+def decode_frame(data, audio_format="float32"):
+    """
+    Decode a binary audio frame received from a client.
+
+    Decoding is a zero-copy view for float32 and int16 and a single table lookup for µ-law.
+    Integer samples are kept as int16 so that they can be written into an int16 ring buffer
+    without converting them twice.
+
+    Args:
+        data (bytes): The binary websocket payload.
+        audio_format (str, optional): One of AUDIO_FORMATS. Defaults to "float32".
+
+    Returns:
+        numpy.ndarray: float32 samples in [-1, 1] or int16 samples.
+
+    Raises:
+        ValueError: If the audio format is unknown.
+    """
+    if audio_format == "float32":
+        return np.frombuffer(data, dtype=np.float32)
+    if audio_format == "int16":
+        return np.frombuffer(data, dtype=np.int16)
+    if audio_format == "mulaw":
+        return MULAW_TABLE[np.frombuffer(data, dtype=np.uint8)]
+    raise ValueError(f"Unsupported audio format {audio_format}, expected one of {AUDIO_FORMATS}.")
+
+
+def encode_frame(audio, audio_format="int16"):
+    """
+    Encode audio samples for sending to the server.
+
+    Args:
+        audio (numpy.ndarray): float32 samples in [-1, 1] or int16 samples.
+        audio_format (str, optional): One of AUDIO_FORMATS. Defaults to "int16".
+
+    Returns:
+        bytes: The binary websocket payload.
+
+    Raises:
+        ValueError: If the audio format is unknown.
+    """
+    if audio_format == "float32":
+        return to_float32(audio).tobytes()
+
+    if audio.dtype != np.int16:
+        audio = (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16)
+    if audio_format == "int16":
+        return audio.tobytes()
+    if audio_format == "mulaw":
+        samples = audio.astype(np.int32)
+        sign = (samples < 0).astype(np.int32) << 7
+        samples = np.minimum(np.abs(samples), MULAW_CLIP) + MULAW_BIAS
+        exponent = np.clip(np.floor(np.log2(samples)).astype(np.int32) - 7, 0, 7)
+        mantissa = (samples >> (exponent + 3)) & 0x0F
+        return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8).tobytes()
+    raise ValueError(f"Unsupported audio format {audio_format}, expected one of {AUDIO_FORMATS}.")
+
+
+def to_float32(frame):
+    """
+    Convert decoded samples to a new, writable float32 array in [-1, 1].
+
+    Args:
+        frame (numpy.ndarray): float32 or int16 samples.
+
+    Returns:
+        numpy.ndarray: float32 samples.
+    """
+    if frame.dtype == np.int16:
+        return frame.astype(np.float32) / 32768.0
+    return np.array(frame, dtype=np.float32)
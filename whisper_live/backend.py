@@ -0,0 +1,73 @@
+from typing import List, Optional, Protocol, Tuple
+
+import numpy as np
+
+from whisper_live.mel_frontend import IncrementalLogMel
+
+BACKENDS = ("tensorrt", "ctranslate2")
+
+
+class Transcriber(Protocol):
+    """
+    Interface the transcription server expects from a Whisper backend.
+
+    `WhisperTRTLLM` (TensorRT-LLM engines on GPU) and the CTranslate2 `WhisperModel`
+    (int8 on CPU or float16 on GPU) both implement it, so the server, the transcriber pool
+    and the decode scheduler do not depend on which one is loaded.
+    """
+
+    def features(self, audio: np.ndarray, mel_cache: Optional[IncrementalLogMel] = None, offset: int = 0):
+        """Compute the log-Mel features of a window of at most 30 seconds, shape (n_mels, 3000)."""
+        ...
+
+    def transcribe_batch(
+        self,
+        audios: List[np.ndarray],
+        languages: List[Optional[str]],
+        tasks: Optional[List[str]] = None,
+        mel_caches: Optional[List[IncrementalLogMel]] = None,
+        offsets: Optional[List[int]] = None,
+    ) -> List[str]:
+        """Transcribe several windows in one batch, a None language is detected."""
+        ...
+
+    def detect_language(
+        self, audio: np.ndarray, mel_cache: Optional[IncrementalLogMel] = None, offset: int = 0
+    ) -> Tuple[str, float]:
+        """Return the language code spoken in a window and its probability."""
+        ...
+
+
+def load_transcriber(backend, model, device=None, compute_type=None, assets_dir="assets"):
+    """
+    Load a Whisper transcriber for the given backend.
+
+    The backend modules are imported lazily so that a CPU-only host never imports
+    TensorRT-LLM, and a TensorRT host does not need CTranslate2.
+
+    Args:
+        backend (str): "tensorrt" or "ctranslate2".
+        model (str): TensorRT-LLM engine directory, or a CTranslate2 model size, path or hub id.
+        device (str, optional): "cuda" or "cpu", ignored by TensorRT. Defaults to "cpu".
+        compute_type (str, optional): CTranslate2 compute type. Defaults to "int8" on CPU and
+            "float16" on GPU.
+        assets_dir (str, optional): Directory holding mel_filters.npz for TensorRT. Defaults to "assets".
+
+    Returns:
+        Transcriber: The loaded transcriber.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    if backend == "tensorrt":
+        from whisper_live.trt_transcriber import WhisperTRTLLM
+        return WhisperTRTLLM(model, assets_dir=assets_dir, device="cuda")
+    if backend == "ctranslate2":
+        from whisper_live.transcriber import WhisperModel
+        device = device or "cpu"
+        return WhisperModel(
+            model,
+            device=device,
+            compute_type=compute_type or ("int8" if device == "cpu" else "float16"),
+        )
+    raise ValueError(f"Unknown transcriber backend {backend}, expected one of {BACKENDS}.")
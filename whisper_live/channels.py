@@ -0,0 +1,530 @@
+import argparse
+import collections
+import multiprocessing
+import queue
+import threading
+import time
+
+
+class UserChannel:
+    """
+    One-way channel of per-user FIFO queues between two processes.
+
+    Replaces a `multiprocessing.Manager().dict()` of per-user lists. With the manager every
+    put is a read-modify-write of the user's whole list through the proxy (several IPC round
+    trips and a pickle of the full list per message), and concurrent updates of the same list
+    can be lost. Here each message is pickled once and written to a pipe as a (user, message)
+    pair. The consuming process runs a reader thread that appends it to the user's local
+    deque, so `get`, `drain` and `discard` never leave the process.
+
+    The channel is created in the parent and passed to the producer and consumer processes.
+    Any number of threads in any number of processes may `put`, but only one process may
+    consume, since the pipe is read by the first process that calls a consumer method. The
+    consumer process calls `start_reader` when it starts, before any of its users connected:
+    a pipe nobody reads fills up, and `put` then blocks the producer.
+    A `local` channel has no pipe and hands messages to the consumer by reference, for
+    producers and consumers running in the same process.
+
+    Attributes:
+        max_closed (int): Number of discarded users remembered, whose late messages are dropped.
+    """
+
+    max_closed = 1024
+
+    class Close:
+        """Sent through the pipe by `close`, the reader discards the user's queue."""
+
+    def __init__(self, local=False):
+        """
+        Initialize a UserChannel.
+
+        Args:
+            local (bool, optional): Whether producer and consumer share the process. Defaults to False.
+        """
+        self.pipe = None if local else multiprocessing.SimpleQueue()
+        self._init_local()
+
+    def __getstate__(self):
+        return {"pipe": self.pipe}
+
+    def __setstate__(self, state):
+        self.pipe = state["pipe"]
+        self._init_local()
+
+    def _init_local(self):
+        # consumer-side state, rebuilt in every process the channel is sent to
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.ready = {}
+        self.closed = collections.OrderedDict()
+        self.reader = None
+        self.listeners = []
+
+    def put(self, user, message):
+        """
+        Append a message to a user's queue.
+
+        Args:
+            user (str): The user's uid.
+            message (Any): A picklable message.
+        """
+        if self.pipe is None:
+            self._deliver(user, message)
+        else:
+            self.pipe.put((user, message))
+
+    def close(self, user):
+        """
+        Discard a user's queue in the consumer process, from a producer in any process.
+        Messages put for the user before are dropped with it.
+
+        Args:
+            user (str): The user's uid.
+        """
+        if self.pipe is None:
+            self.discard(user)
+        else:
+            self.pipe.put((user, self.Close()))
+
+    def start_reader(self):
+        """Start reading the pipe in this process, which becomes the consumer of the channel."""
+        if self.pipe is None:
+            return
+        with self.lock:
+            if self.reader is None:
+                self.reader = threading.Thread(target=self._read, daemon=True)
+                self.reader.start()
+
+    def _read(self):
+        while True:
+            user, message = self.pipe.get()
+            if isinstance(message, self.Close):
+                self.discard(user)
+            else:
+                self._deliver(user, message)
+
+    def add_listener(self, callback):
+        """
+        Call `callback(user)` whenever a message for a user arrives in this process.
+
+        The callback runs on the thread delivering the message, the reader thread or a local
+        producer, so it must not block; an asyncio consumer passes `loop.call_soon_threadsafe`.
+
+        Args:
+            callback (Callable[[str], None]): Called with the user's uid after the message was queued.
+        """
+        with self.lock:
+            self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """Stop calling a callback added with `add_listener`."""
+        with self.lock:
+            self.listeners.remove(callback)
+
+    def _deliver(self, user, item):
+        with self.lock:
+            if user in self.closed:
+                return
+            self._append(self._queue(user), item)
+            self.ready[user].notify()
+            listeners = list(self.listeners)
+        for callback in listeners:
+            callback(user)
+
+    def _append(self, messages, item):
+        messages.append(item)
+
+    def _queue(self, user):
+        # must be called with `lock` held
+        if user not in self.queues:
+            self.queues[user] = collections.deque()
+            self.ready[user] = threading.Condition(self.lock)
+        return self.queues[user]
+
+    def get(self, user, timeout=None):
+        """
+        Remove and return the oldest message of a user, blocking until one is available.
+
+        Args:
+            user (str): The user's uid.
+            timeout (float, optional): Maximum seconds to wait. Defaults to waiting forever.
+
+        Returns:
+            Any: The message.
+
+        Raises:
+            queue.Empty: If no message arrived within `timeout` seconds or the user was discarded.
+        """
+        self.start_reader()
+        with self.lock:
+            self.closed.pop(user, None)
+            messages = self._queue(user)
+            # `discard` replaces the user's queue and wakes its waiters
+            self.ready[user].wait_for(lambda: messages or self.queues.get(user) is not messages, timeout)
+            if not messages:
+                raise queue.Empty
+            return messages.popleft()
+
+    def drain(self, user):
+        """
+        Remove and return all messages of a user without blocking.
+
+        Args:
+            user (str): The user's uid.
+
+        Returns:
+            List[Any]: The messages in FIFO order, empty if there are none.
+        """
+        self.start_reader()
+        with self.lock:
+            messages = self.queues.get(user)
+            if not messages:
+                return []
+            drained = list(messages)
+            messages.clear()
+            return drained
+
+    def requeue(self, user, message):
+        """Put a message taken with `get` back at the head of the user's queue."""
+        with self.lock:
+            self._queue(user).appendleft(message)
+            self.ready[user].notify()
+
+    def discard(self, user):
+        """
+        Drop a user's queue once it disconnected, messages still arriving for it are dropped.
+        A consumer blocked in `get` for the user raises queue.Empty.
+
+        Args:
+            user (str): The user's uid.
+        """
+        self.start_reader()
+        with self.lock:
+            self.queues.pop(user, None)
+            ready = self.ready.pop(user, None)
+            if ready is not None:
+                ready.notify_all()
+            self.closed[user] = True
+            if len(self.closed) > self.max_closed:
+                self.closed.popitem(last=False)
+
+    def __contains__(self, user):
+        self.start_reader()
+        with self.lock:
+            return bool(self.queues.get(user))
+
+
+def coalesce(pending, message, final):
+    """Append a message to a pending deque of (message, final) pairs, a partial replaces a trailing partial."""
+    # a final keeps the partial before it, the LLM client compares the two
+    if not final and pending and not pending[-1][1]:
+        pending.pop()
+    pending.append((message, final))
+
+
+class TranscriptMailbox(UserChannel):
+    """
+    Per-user latest-value mailbox for streaming transcripts.
+
+    The transcription server emits a partial transcript after every decode, but the LLM client
+    only needs the newest partial and every final (EOS) transcript. Here a partial replaces a
+    pending partial of the same user, and finals are never replaced and are delivered in order.
+    A partial that was pending when a final arrived is still delivered first, because the LLM
+    client detects a stable final by comparing it with the partial before it.
+
+    Coalescing happens on both sides of the pipe. The producer queues messages in a local
+    outbox that a sender thread ships in batches, so partials produced while the pipe is busy
+    are never pickled. The consumer's reader thread merges the batches into its inbox, so
+    partials that arrive while the consumer is busy are dropped before it wakes up.
+    """
+
+    def _init_local(self):
+        super()._init_local()
+        self.outbox = collections.OrderedDict()
+        self.outbox_ready = threading.Condition(self.lock)
+        self.sender = None
+
+    def put(self, user, message, final=False):
+        """
+        Queue a transcript for a user.
+
+        Args:
+            user (str): The user's uid.
+            message (Any): A picklable message.
+            final (bool, optional): Whether the message is a final transcript. Defaults to False.
+        """
+        if self.pipe is None:
+            self._deliver(user, (message, final))
+            return
+        with self.lock:
+            self._start_sender()
+            coalesce(self.outbox.setdefault(user, collections.deque()), message, final)
+            self.outbox_ready.notify()
+
+    def close(self, user):
+        """Discard a user's pending transcripts in this process and in the consumer process."""
+        if self.pipe is None:
+            self.discard(user)
+            return
+        with self.lock:
+            self._start_sender()
+            # replaces the user's pending transcripts, the sender keeps it in order with the others
+            self.outbox[user] = collections.deque([(self.Close(), True)])
+            self.outbox_ready.notify()
+
+    def _start_sender(self):
+        # must be called with `lock` held
+        if self.sender is None:
+            self.sender = threading.Thread(target=self._send, daemon=True)
+            self.sender.start()
+
+    def _send(self):
+        while True:
+            with self.lock:
+                self.outbox_ready.wait_for(lambda: self.outbox)
+                batch = [
+                    (user, message, final)
+                    for user, pending in self.outbox.items()
+                    for message, final in pending
+                ]
+                self.outbox.clear()
+            self.pipe.put(batch)
+
+    def _read(self):
+        while True:
+            for user, message, final in self.pipe.get():
+                if isinstance(message, self.Close):
+                    self.discard(user)
+                else:
+                    self._deliver(user, (message, final))
+
+    def _append(self, messages, item):
+        coalesce(messages, *item)
+
+    def get(self, user, timeout=None):
+        """
+        Remove and return the oldest pending transcript of a user, blocking until one is available.
+
+        Args:
+            user (str): The user's uid.
+            timeout (float, optional): Maximum seconds to wait. Defaults to waiting forever.
+
+        Returns:
+            Any: The message.
+
+        Raises:
+            queue.Empty: If no message arrived within `timeout` seconds.
+        """
+        return super().get(user, timeout)[0]
+
+    def drain(self, user):
+        """Remove and return all pending transcripts of a user without blocking."""
+        return [message for message, _ in super().drain(user)]
+
+    def requeue(self, user, message, final=False):
+        """Put a message taken with `get` back at the head of the user's queue."""
+        super().requeue(user, (message, final))
+
+    def discard(self, user):
+        """
+        Drop a user's pending transcripts in this process, on the producer side its outbox and
+        on the consumer side its inbox. Does not start reading the pipe.
+
+        Args:
+            user (str): The user's uid.
+        """
+        with self.lock:
+            self.outbox.pop(user, None)
+            if self.reader is None and self.pipe is not None:
+                return
+        super().discard(user)
+
+
+def produce_channel(channel, users, num_messages):
+    for i in range(num_messages):
+        channel.put(users[i % len(users)], {"llm_output": "token " * 8, "eos": False, "latency": 0.1})
+
+
+def produce_manager(shared, users, num_messages):
+    # the read-modify-write pattern of CustomLLMAPI.query on a Manager().dict()
+    for i in range(num_messages):
+        user = users[i % len(users)]
+        if user not in shared:
+            shared[user] = []
+        shared[user] += [{"llm_output": "token " * 8, "eos": False, "latency": 0.1}]
+
+
+def consume_manager(shared, users, num_messages):
+    # the pop-and-write-back pattern of ServeClient.speech_to_text
+    received = 0
+    while received < num_messages:
+        for user in users:
+            if user in shared and len(shared[user]) > 0:
+                temp = shared[user]
+                temp.pop(0)
+                shared[user] = temp
+                received += 1
+    return received
+
+
+def benchmark(num_users, num_messages):
+    users = [f"user-{i}" for i in range(num_users)]
+
+    channel = UserChannel()
+    producer = multiprocessing.Process(target=produce_channel, args=(channel, users, num_messages))
+    start = time.time()
+    producer.start()
+    received = 0
+    while received < num_messages:
+        for user in users:
+            try:
+                channel.get(user, timeout=0.001)
+                received += 1
+            except queue.Empty:
+                pass
+    channel_time = time.time() - start
+    producer.join()
+
+    manager = multiprocessing.Manager()
+    shared = manager.dict()
+    producer = multiprocessing.Process(target=produce_manager, args=(shared, users, num_messages))
+    start = time.time()
+    producer.start()
+    consume_manager(shared, users, num_messages)
+    manager_time = time.time() - start
+    producer.join()
+    manager.shutdown()
+
+    print(f"{num_users} users, {num_messages} messages")
+    print(f"  UserChannel:     {num_messages / channel_time:10.0f} messages/s")
+    print(f"  Manager().dict(): {num_messages / manager_time:9.0f} messages/s")
+
+
+def produce_timestamps(channel, num_messages, interval):
+    for _ in range(num_messages):
+        channel.put("user-0", time.time())
+        time.sleep(interval)
+
+
+def benchmark_transit(num_messages, interval):
+    # latency of one pipeline hop, in-process (--single-process) against between processes
+    for name, local in (("in-process", True), ("between processes", False)):
+        channel = UserChannel(local=local)
+        if local:
+            producer = threading.Thread(target=produce_timestamps, args=(channel, num_messages, interval))
+        else:
+            producer = multiprocessing.Process(target=produce_timestamps, args=(channel, num_messages, interval))
+        producer.start()
+        latencies = []
+        for _ in range(num_messages):
+            sent = channel.get("user-0")
+            latencies.append(time.time() - sent)
+        producer.join()
+        latencies.sort()
+        print(f"  {name:18s} hop latency mean {1e6 * sum(latencies) / num_messages:7.1f}us, "
+              f"p99 {1e6 * latencies[int(0.99 * num_messages)]:7.1f}us")
+
+
+def produce_transcripts(channel, num_speakers, num_utterances, partials, interval):
+    # every speaker emits `partials` growing partial transcripts per utterance, then its final
+    for utterance in range(num_utterances):
+        for step in range(partials + 1):
+            final = step == partials
+            for speaker in range(num_speakers):
+                message = {"prompt": "word " * step, "eos": final, "sent": time.time()}
+                if isinstance(channel, TranscriptMailbox):
+                    channel.put(f"user-{speaker}", message, final=final)
+                else:
+                    channel.put(dict(message, uid=f"user-{speaker}"))
+            time.sleep(interval)
+
+
+def consume_mailbox(mailbox, user, num_utterances, cost, latencies):
+    finals = 0
+    while finals < num_utterances:
+        message = mailbox.get(user)
+        time.sleep(cost)  # prompt rendering and the websocket ping of CustomLLMAPI.run
+        if message["eos"]:
+            latencies.append(time.time() - message["sent"])
+            finals += 1
+
+
+def consume_queue(transcription_queue, cost, latencies, stop):
+    # CustomLLMAPI.run before the mailbox: one thread per LLM websocket on a shared queue
+    while not stop.is_set():
+        try:
+            message = transcription_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if transcription_queue.qsize() != 0:
+            continue
+        time.sleep(cost)
+        if message["eos"]:
+            latencies.append(time.time() - message["sent"])
+
+
+def benchmark_mailbox(num_speakers, num_utterances, partials, interval, cost):
+    args = (num_speakers, num_utterances, partials, interval)
+    expected = num_speakers * num_utterances
+
+    mailbox = TranscriptMailbox()
+    latencies = []
+    consumers = [
+        threading.Thread(target=consume_mailbox, args=(mailbox, f"user-{i}", num_utterances, cost, latencies))
+        for i in range(num_speakers)
+    ]
+    producer = multiprocessing.Process(target=produce_transcripts, args=(mailbox,) + args)
+    producer.start()
+    for consumer in consumers:
+        consumer.start()
+    for consumer in consumers:
+        consumer.join()
+    producer.join()
+    mailbox_latencies = latencies
+
+    transcription_queue = multiprocessing.Queue()
+    latencies = []
+    stop = threading.Event()
+    consumers = [
+        threading.Thread(target=consume_queue, args=(transcription_queue, cost, latencies, stop))
+        for _ in range(num_speakers)
+    ]
+    producer = multiprocessing.Process(target=produce_transcripts, args=(transcription_queue,) + args)
+    producer.start()
+    for consumer in consumers:
+        consumer.start()
+    producer.join()
+    time.sleep(1.0)
+    stop.set()
+    for consumer in consumers:
+        consumer.join()
+    queue_latencies = latencies
+
+    print(f"{num_speakers} speakers, {num_utterances} utterances of {partials} partials each, "
+          f"end of speech to LLM request latency:")
+    for name, latencies in (("TranscriptMailbox", mailbox_latencies), ("multiprocessing.Queue", queue_latencies)):
+        if not latencies:
+            print(f"  {name:22s} no finals delivered")
+            continue
+        print(f"  {name:22s} finals {len(latencies)}/{expected}, mean {1000 * sum(latencies) / len(latencies):7.1f}ms, "
+              f"max {1000 * max(latencies):7.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=4, help='Number of users sharing the channel')
+    parser.add_argument('--messages', type=int, default=5000, help='Number of messages sent')
+    parser.add_argument('--mailbox', action="store_true", help='Benchmark the transcript mailbox instead')
+    parser.add_argument('--transit', action="store_true", help='Benchmark the latency of one hop, local against piped')
+    parser.add_argument('--utterances', type=int, default=5, help='Utterances per speaker')
+    parser.add_argument('--partials', type=int, default=20, help='Partial transcripts per utterance')
+    parser.add_argument('--interval', type=float, default=0.02, help='Seconds between partial transcripts')
+    parser.add_argument('--cost', type=float, default=0.002, help='Seconds the LLM client spends per message')
+    args = parser.parse_args()
+    multiprocessing.set_start_method('spawn', force=True)
+    if args.transit:
+        benchmark_transit(args.messages, args.interval)
+    elif args.mailbox:
+        benchmark_mailbox(args.users, args.utterances, args.partials, args.interval, args.cost)
+    else:
+        benchmark(args.users, args.messages)
@@ -12,6 +12,8 @@ import websocket
 import uuid
 import time
 
+from whisper_live.audio_format import encode_frame
+
 
 def resample(file: str, sr: int = 16000):
     """
@@ -50,7 +52,8 @@ class Client:
     INSTANCES = {}
 
     def __init__(
-        self, host=None, port=None, is_multilingual=False, lang=None, translate=False, model_size="small"
+        self, host=None, port=None, is_multilingual=False, lang=None, translate=False, model_size="small",
+        audio_format="int16"
     ):
         """
         Initializes a Client instance for audio recording and streaming to a server.
@@ -65,6 +68,7 @@ class Client:
             is_multilingual (bool, optional): Specifies if multilingual transcription is enabled. Default is False.
             lang (str, optional): The selected language for transcription when multilingual is disabled. Default is None.
             translate (bool, optional): Specifies if the task is translation. Default is False.
+            audio_format (str, optional): Wire format of the audio frames, "float32", "int16" or "mulaw". Default is "int16".
         """
         self.chunk = 1024 * 3
         self.format = pyaudio.paInt16
@@ -83,6 +87,7 @@ class Client:
         self.language = lang
         self.model_size = model_size
         self.server_error = False
+        self.audio_format = audio_format
         if translate:
             self.task = "translate"
 
@@ -160,9 +165,11 @@ class Client:
 
         if "status" in message.keys():
             if message["status"] == "WAIT":
-                self.waiting = True
+                # servers with a wait queue send a position and keep the connection open
+                self.waiting = "position" not in message
                 print(
-                    f"[INFO]:Server is full. Estimated wait time {round(message['message'])} minutes."
+                    f"[INFO]:Server is full. Position in queue {message.get('position', '-')}, "
+                    f"estimated wait time {round(message['message'])} minutes."
                 )
             elif message["status"] == "ERROR":
                 print(f"Message from Server: {message['message']}")
@@ -244,6 +251,7 @@ class Client:
                     "language": self.language,
                     "task": self.task,
                     "model_size": self.model_size,
+                    "audio_format": self.audio_format,
                 }
             )
         )
@@ -280,6 +288,20 @@ class Client:
         raw_data = np.frombuffer(buffer=audio_bytes, dtype=np.int16)
         return raw_data.astype(np.float32) / 32768.0
 
+    def encode_packet(self, audio_bytes):
+        """
+        Encode 16-bit PCM audio into the wire format announced to the server.
+
+        Args:
+            audio_bytes (bytes): Audio data in 16-bit PCM format.
+
+        Returns:
+            bytes: The audio packet to send, int16 PCM is sent as is.
+        """
+        if self.audio_format == "int16":
+            return audio_bytes
+        return encode_frame(np.frombuffer(audio_bytes, dtype=np.int16), self.audio_format)
+
     def send_packet_to_server(self, message):
         """
         Send an audio packet to the server using WebSocket.
@@ -324,8 +346,7 @@ class Client:
                     if data == b"":
                         break
 
-                    audio_array = self.bytes_to_float_array(data)
-                    self.send_packet_to_server(audio_array.tobytes())
+                    self.send_packet_to_server(self.encode_packet(data))
                     self.stream.write(data)
 
                 wavfile.close()
@@ -414,8 +435,7 @@ class Client:
                 in_bytes = process.stdout.read(self.chunk * 2)  # 2 bytes per sample
                 if not in_bytes:
                     break
-                audio_array = self.bytes_to_float_array(in_bytes)
-                self.send_packet_to_server(audio_array.tobytes())
+                self.send_packet_to_server(self.encode_packet(in_bytes))
 
         except Exception as e:
             print(f"[ERROR]: Failed to connect to HLS stream: {e}")
@@ -453,9 +473,7 @@ class Client:
                 data = self.stream.read(self.chunk)
                 self.frames += data
 
-                audio_array = Client.bytes_to_float_array(data)
-
-                self.send_packet_to_server(audio_array.tobytes())
+                self.send_packet_to_server(self.encode_packet(data))
 
                 # save frames if more than a minute
                 if len(self.frames) > 60 * self.rate:
@@ -543,8 +561,8 @@ class TranscriptionClient:
         transcription_client()
         ```
     """
-    def __init__(self, host, port, is_multilingual=False, lang=None, translate=False, model_size="small"):
-        self.client = Client(host, port, is_multilingual, lang, translate, model_size)
+    def __init__(self, host, port, is_multilingual=False, lang=None, translate=False, model_size="small", audio_format="int16"):
+        self.client = Client(host, port, is_multilingual, lang, translate, model_size, audio_format)
 
     def __call__(self, audio=None, hls_url=None):
         """
@@ -0,0 +1,174 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class DecodeRequest:
+    """A pending audio window waiting to be decoded in the next batch."""
+
+    def __init__(self, audio, language, task, mel_cache=None, offset=0):
+        self.audio = audio
+        self.language = language
+        self.task = task
+        self.mel_cache = mel_cache
+        self.offset = offset
+        self.future = Future()
+        self.submit_time = time.time()
+
+
+class DecodeScheduler:
+    """
+    Central scheduler batching the decode windows of all connected clients.
+
+    Instead of every `ServeClient` thread running its own batch-of-one encoder/decoder pass,
+    clients submit their pending window here. A worker thread per pooled transcriber waits
+    for the first request, keeps collecting for at most `max_wait` seconds or until
+    `max_batch_size` requests are queued, then decodes the whole batch with a single
+    `transcribe_batch` call (per-item language and task) and resolves each client's future.
+
+    Any transcriber exposing `transcribe_batch(audios, languages, tasks, mel_caches, offsets)`
+    works as a backend:
+    `WhisperTRTLLM` on GPU or the CTranslate2 `WhisperModel` on CPU.
+
+    Attributes:
+        transcriber_pool (TranscriberPool): Pool the batches are decoded on.
+        max_batch_size (int): Maximum number of windows decoded together.
+        max_wait (float): Seconds to wait for more windows after the first one arrives.
+        num_batches (int): Number of batches decoded so far.
+        num_decoded (int): Number of windows decoded so far.
+        busy_time (float): Seconds spent in `transcribe_batch`, summed over the workers.
+        latency (float): Moving average of the seconds between `submit` and the result.
+        last_decode_time (float): Time the last batch was decoded, 0 before the first one.
+    """
+
+    def __init__(self, transcriber_pool, max_batch_size=8, max_wait=0.005):
+        """
+        Initialize a DecodeScheduler and start one worker thread per pooled transcriber.
+
+        Args:
+            transcriber_pool (TranscriberPool): Pool of transcribers implementing `transcribe_batch`.
+            max_batch_size (int, optional): Maximum number of windows per batch. Defaults to 8.
+            max_wait (float, optional): Seconds to collect windows before decoding. Defaults to 0.005.
+        """
+        self.transcriber_pool = transcriber_pool
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.exit = False
+        self.num_batches = 0
+        self.num_decoded = 0
+        self.busy_time = 0.0
+        self.latency = 0.0
+        self.last_decode_time = 0.0
+        # the workers update the statistics above concurrently
+        self.stats_lock = threading.Lock()
+        self.workers = [
+            threading.Thread(target=self.run, daemon=True)
+            for _ in range(transcriber_pool.size)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    @property
+    def queue_depth(self):
+        """Number of windows waiting for a worker."""
+        return self.requests.qsize()
+
+    def submit(self, audio, language, task="transcribe", mel_cache=None, offset=0):
+        """
+        Queue an audio window for the next batch.
+
+        Args:
+            audio (numpy.ndarray): float32 audio window sampled at 16 kHz, at most 30 seconds.
+            language (str): Language of the window.
+            task (str, optional): "transcribe" or "translate". Defaults to "transcribe".
+            mel_cache (IncrementalLogMel, optional): The client's incremental mel front end.
+            offset (int, optional): Stream index of the first sample of the window. Defaults to 0.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the transcribed text.
+        """
+        request = DecodeRequest(audio, language, task, mel_cache, offset)
+        self.requests.put(request)
+        return request.future
+
+    def transcribe(self, audio, language, task="transcribe", mel_cache=None, offset=0, timeout=None):
+        """
+        Decode an audio window as part of a batch and wait for its transcription.
+
+        Args:
+            audio (numpy.ndarray): float32 audio window sampled at 16 kHz, at most 30 seconds.
+            language (str): Language of the window.
+            task (str, optional): "transcribe" or "translate". Defaults to "transcribe".
+            mel_cache (IncrementalLogMel, optional): The client's incremental mel front end.
+            offset (int, optional): Stream index of the first sample of the window. Defaults to 0.
+            timeout (float, optional): Maximum seconds to wait. Defaults to waiting forever.
+
+        Returns:
+            str: The transcribed text.
+        """
+        return self.submit(audio, language, task, mel_cache, offset).result(timeout)
+
+    def collect_batch(self):
+        """
+        Block for the first request, then gather more until the batch is full or `max_wait` expires.
+
+        Returns:
+            List[DecodeRequest]: The requests of the next batch, empty on shutdown.
+        """
+        try:
+            batch = [self.requests.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    batch.append(self.requests.get(timeout=remaining))
+                else:
+                    batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        """Worker loop decoding batches until `stop` is called."""
+        while not self.exit:
+            batch = self.collect_batch()
+            if not batch:
+                continue
+            start = time.time()
+            try:
+                with self.transcriber_pool.lease() as transcriber:
+                    texts = transcriber.transcribe_batch(
+                        [request.audio for request in batch],
+                        [request.language for request in batch],
+                        [request.task for request in batch],
+                        mel_caches=[request.mel_cache for request in batch],
+                        offsets=[request.offset for request in batch],
+                    )
+            except Exception as e:
+                logging.exception(f"[Whisper ERROR:] Batched decode failed: {e}")
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            end = time.time()
+            with self.stats_lock:
+                self.busy_time += end - start
+                self.last_decode_time = max(self.last_decode_time, end)
+                self.num_batches += 1
+                self.num_decoded += len(batch)
+                for request in batch:
+                    self.latency = 0.9 * self.latency + 0.1 * (end - request.submit_time)
+            for request, text in zip(batch, texts):
+                request.future.set_result(text)
+
+    def stop(self):
+        """Stop the worker threads once their current batch is done."""
+        self.exit = True
+        for worker in self.workers:
+            worker.join()
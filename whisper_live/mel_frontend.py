@@ -0,0 +1,135 @@
+import numpy as np
+import torch
+
+SAMPLE_RATE = 16000
+N_FFT = 400
+HOP_LENGTH = 160
+CHUNK_LENGTH = 30
+N_SAMPLES = CHUNK_LENGTH * SAMPLE_RATE  # 480000 samples in a 30-second chunk
+N_FRAMES = N_SAMPLES // HOP_LENGTH  # 3000 frames in a mel spectrogram input
+
+
+def pad_log_mel(features, num_frames=N_FRAMES):
+    """
+    Pad normalized log-Mel features to `num_frames` frames with the value of silent frames.
+
+    Frames that only see zero padding are at the 1e-10 floor before normalization, which
+    becomes max(global max - 2, -1.5) after it. `IncrementalLogMel` pads with that value, so
+    features padded here match the ones it computes for the same short window.
+
+    Args:
+        features (numpy.ndarray): Normalized log-Mel features, shape (n_mels, n_frames).
+        num_frames (int, optional): Number of frames to pad to. Defaults to 3000.
+
+    Returns:
+        numpy.ndarray: The features of shape (n_mels, num_frames).
+    """
+    missing = num_frames - features.shape[-1]
+    if missing <= 0:
+        return features
+    floor = max(float(features.max()) - 2.0, -1.5)
+    return np.pad(features, ((0, 0), (0, missing)), constant_values=floor)
+
+
+class IncrementalLogMel:
+    """
+    Incremental log-Mel front end for a streaming decode window.
+
+    Whisper pads every window to 30 seconds and recomputes the STFT and mel projection over the
+    whole window, although between two decodes of the same stream only a few hundred new
+    samples were appended. This front end keeps the log-mel frames that can no longer change
+    (their 400-sample STFT window lies entirely inside the buffered audio) and only computes
+    the frames touched by newly appended samples. Frames that only see the zero padding are
+    constant (log10 of the 1e-10 floor), so the padded 3000-frame tensor is assembled from the
+    cache and the global-max normalization is applied to it exactly as `log_mel_spectrogram`
+    does.
+
+    A cache belongs to one stream: the window is identified by `offset`, the absolute index of
+    its first sample in the stream, and the cache is rebuilt whenever the offset, the mel
+    filters or the device change, or the window shrinks.
+
+    Attributes:
+        offset (int): Stream index of the first sample of the cached window.
+        num_samples (int): Length of the window the cache was last updated with.
+        num_frames (int): Number of leading frames that are final.
+        log_spec (torch.Tensor): Unnormalized log10 mel frames, shape (n_mels, 3000).
+    """
+
+    def __init__(self):
+        self.window = None
+        self.reset()
+
+    def reset(self):
+        self.offset = None
+        self.filters = None
+        self.num_samples = 0
+        self.num_frames = 0
+        self.log_spec = None
+
+    def full(self, audio, filters):
+        """Compute the log10 mel frames of a whole window, as `log_mel_spectrogram` does."""
+        audio = audio[:N_SAMPLES]
+        audio = torch.nn.functional.pad(audio, (0, N_SAMPLES - audio.shape[-1]))
+        stft = torch.stft(audio, N_FFT, HOP_LENGTH, window=self.hann_window(audio.device), return_complex=True)
+        magnitudes = stft[..., :-1].abs()**2
+        return torch.clamp(filters @ magnitudes, min=1e-10).log10()
+
+    def hann_window(self, device):
+        if self.window is None or self.window.device != device:
+            self.window = torch.hann_window(N_FFT).to(device)
+        return self.window
+
+    def __call__(self, audio, filters, offset=0):
+        """
+        Compute the normalized log-Mel spectrogram of a decode window, reusing cached frames.
+
+        Args:
+            audio (Union[numpy.ndarray, torch.Tensor]): The window samples at 16 kHz, at most 30 seconds.
+            filters (torch.Tensor): Mel filterbank of shape (n_mels, 201), on the target device.
+            offset (int, optional): Stream index of the first sample of the window. Defaults to 0.
+
+        Returns:
+            torch.Tensor: The log-Mel spectrogram of shape (n_mels, 3000) on the filters' device.
+        """
+        if not torch.is_tensor(audio):
+            audio = torch.from_numpy(np.asarray(audio, dtype=np.float32))
+        audio = audio.to(filters.device)
+        n = audio.shape[-1]
+
+        if n <= N_FFT or n > N_SAMPLES - N_FFT:
+            # too short for the reflect padding or long enough to reach the end padding
+            self.reset()
+            log_spec = self.full(audio, filters)
+        else:
+            if (offset != self.offset or filters is not self.filters
+                    or n < self.num_samples or self.log_spec.device != filters.device):
+                self.reset()
+                self.offset = offset
+                self.filters = filters
+                self.log_spec = torch.full((filters.shape[0], N_FRAMES), -10.0, device=filters.device)
+
+            # frames whose STFT window is inside the audio are final, frames starting after
+            # the audio only see zero padding and stay at the -10 floor
+            stable = (n - N_FFT // 2) // HOP_LENGTH + 1
+            end = -(-(n + N_FFT // 2) // HOP_LENGTH)
+            first = self.num_frames
+            start, stop = first * HOP_LENGTH - N_FFT // 2, (end - 1) * HOP_LENGTH + N_FFT // 2
+
+            parts = []
+            if start < 0:
+                parts.append(audio[1:1 - start].flip(0))  # reflect padding of the centered STFT
+            parts.append(audio[max(start, 0):min(stop, n)])
+            if stop > n:
+                parts.append(audio.new_zeros(stop - n))
+            segment = torch.cat(parts)
+
+            stft = torch.stft(segment, N_FFT, HOP_LENGTH, window=self.hann_window(audio.device),
+                              center=False, return_complex=True)
+            magnitudes = stft.abs()**2
+            self.log_spec[:, first:end] = torch.clamp(filters @ magnitudes, min=1e-10).log10()
+            self.num_frames = stable
+            self.num_samples = n
+            log_spec = self.log_spec
+
+        log_spec = torch.maximum(log_spec, log_spec.max() - 8.0)
+        return (log_spec + 4.0) / 4.0
@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import unicodedata
+
+from whisper_live.session_store import create_session_store
+
+
+def normalize_text(text):
+    """Normalize a prompt for cache lookups: case, punctuation and whitespace are ignored."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = "".join(" " if unicodedata.category(char).startswith("P") else char for char in text)
+    return " ".join(text.split())
+
+
+class ResponseCache:
+    """
+    Cache of LLM answers and of the TTS audio of their chunks.
+
+    Voice assistants are asked the same things over and over, greetings, opening hours,
+    "Stop.". An answer is stored under its normalized prompt, the output language and a
+    fingerprint of the last `history_turns` messages before the prompt, so a cached answer
+    is only replayed in the same context. The audio of a chunk is stored under its language
+    and text, so the chunks of a replayed answer, and sentences that recur in other answers,
+    are spoken without running TTS.
+
+    Entries are evicted least recently used first and expire `ttl` seconds after their last
+    use, in memory and, if a database is given, in a SQLite tier that the LLM and TTS
+    processes share and that survives restarts.
+
+    Attributes:
+        history_turns (int): Messages before the prompt that an answer depends on.
+        hits (int): Lookups answered from the cache in this process.
+        misses (int): Lookups not in the cache in this process.
+        bytes_served (int): Bytes of text and audio served from the cache in this process.
+    """
+
+    def __init__(self, path=None, ttl=86400.0, max_entries=4096, max_bytes=256 * 2**20, history_turns=2):
+        """
+        Initialize a ResponseCache.
+
+        Args:
+            path (str, optional): Path of the SQLite database of the disk tier. Defaults to memory only.
+            ttl (float, optional): Seconds after its last use an entry expires. Defaults to one day.
+            max_entries (int, optional): Maximum number of entries in memory. Defaults to 4096.
+            max_bytes (int, optional): Maximum size of the entries in memory. Defaults to 256 MiB.
+            history_turns (int, optional): Messages before the prompt that are part of the key. Defaults to 2.
+        """
+        self.store = create_session_store(path, ttl=ttl, max_sessions=max_entries, max_bytes=max_bytes)
+        self.history_turns = history_turns
+        self.hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+
+    def response_key(self, prompt, language, history=()):
+        """
+        Return the cache key of an answer.
+
+        Args:
+            prompt (str): The user's prompt.
+            language (str): Language code of the answer.
+            history (List[dict], optional): The conversation before the prompt, as in `ConversationHistory.history`.
+
+        Returns:
+            str: The key.
+        """
+        recent = history[-self.history_turns:] if self.history_turns else []
+        parts = [language, normalize_text(prompt)]
+        parts += [f"{message['speaker']}:{normalize_text(message['message'])}" for message in recent]
+        return "response:" + hashlib.sha1("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def audio_key(self, language, text):
+        return "audio:" + hashlib.sha1(f"{language}\0{text.strip()}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, key, size):
+        value = self.store.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.bytes_served += size(value)
+        return value
+
+    def get_response(self, key):
+        """
+        Look up an answer.
+
+        Returns:
+            dict: The answer's "chunks" for TTS and its full "llm_output", or None.
+        """
+        return self._lookup(key, lambda response: len(response["llm_output"].encode("utf-8")))
+
+    def put_response(self, key, chunks, llm_output):
+        self.store[key] = {"chunks": list(chunks), "llm_output": llm_output}
+
+    def get_audio(self, language, text):
+        """
+        Look up the audio of a chunk.
+
+        Returns:
+            numpy.ndarray: The synthesized audio, or None.
+        """
+        return self._lookup(self.audio_key(language, text), lambda audio: audio.nbytes)
+
+    def put_audio(self, language, text, audio):
+        self.store[self.audio_key(language, text)] = audio
+
+    def stats(self):
+        """
+        Return the metrics of this process.
+
+        Returns:
+            dict: "hits", "misses", "hit_rate" and "bytes_served".
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "bytes_served": self.bytes_served,
+        }
+
+    def log_stats(self, prefix):
+        stats = self.stats()
+        logging.info(
+            f"{prefix} Response cache hit rate {stats['hit_rate']:.0%} "
+            f"({stats['hits']}/{stats['hits'] + stats['misses']}), {stats['bytes_served']} bytes served"
+        )
@@ -13,6 +13,8 @@ import torch
 import numpy as np
 import time
 from whisper_live.transcriber import WhisperModel
+from whisper_live.audio_buffer import AudioRingBuffer
+from whisper_live.audio_format import AUDIO_FORMATS, decode_frame
 
 
 class TranscriptionServer:
@@ -83,6 +85,17 @@ class TranscriptionServer:
         options = websocket.recv()
         options = json.loads(options)
 
+        audio_format = options.get("audio_format", "float32")
+        if audio_format not in AUDIO_FORMATS:
+            logging.warning(f"Unsupported audio format {audio_format}")
+            websocket.send(json.dumps({
+                "uid": options["uid"],
+                "status": "ERROR",
+                "message": f"Unsupported audio format {audio_format}, expected one of {AUDIO_FORMATS}.",
+            }))
+            websocket.close()
+            return
+
         if len(self.clients) >= self.max_clients:
             logging.warning("Client Queue Full. Asking client to wait ...")
             wait_time = self.get_wait_time()
@@ -112,7 +125,7 @@ class TranscriptionServer:
         while True:
             try:
                 frame_data = websocket.recv()
-                frame_np = np.frombuffer(frame_data, dtype=np.float32)
+                frame_np = decode_frame(frame_data, audio_format)
 
                 self.clients[websocket].add_frames(frame_np)
 
@@ -161,9 +174,8 @@ class ServeClient:
         language (str): The language for transcription.
         task (str): The task type, e.g., "transcribe."
         transcriber (WhisperModel): The Whisper model for speech-to-text.
-        timestamp_offset (float): The offset in audio timestamps.
-        frames_np (numpy.ndarray): NumPy array to store audio frames.
-        frames_offset (float): The offset in audio frames.
+        audio_buffer (AudioRingBuffer): Ring buffer holding the last 45 seconds of audio, its cursor
+            marks where the audio not yet covered by a complete segment starts.
         text (list): List of transcribed text segments.
         current_out (str): The current incomplete transcription.
         prev_out (str): The previous incomplete transcription.
@@ -182,7 +194,7 @@ class ServeClient:
     SERVER_READY = "SERVER_READY"
     DISCONNECT = "DISCONNECT"
 
-    def __init__(self, websocket, task="transcribe", device=None, multilingual=False, language=None, client_uid=None):
+    def __init__(self, websocket, task="transcribe", device=None, multilingual=False, language=None, client_uid=None, buffer_dtype=np.float32):
         """
         Initialize a ServeClient instance.
         The Whisper model is initialized based on the client's language and device availability.
@@ -196,6 +208,8 @@ class ServeClient:
             multilingual (bool, optional): Whether the client supports multilingual transcription. Defaults to False.
             language (str, optional): The language for transcription. Defaults to None.
             client_uid (str, optional): A unique identifier for the client. Defaults to None.
+            buffer_dtype (numpy.dtype, optional): Storage dtype of the audio buffer, np.int16 halves
+                its memory. Defaults to np.float32.
 
         """
         self.client_uid = client_uid
@@ -211,9 +225,7 @@ class ServeClient:
             local_files_only=False,
         )
         
-        self.timestamp_offset = 0.0
-        self.frames_np = None
-        self.frames_offset = 0.0
+        self.audio_buffer = AudioRingBuffer(capacity=45, rate=self.RATE, dtype=buffer_dtype)
         self.text = []
         self.current_out = ''
         self.prev_out = ''
@@ -231,6 +243,9 @@ class ServeClient:
 
         # threading
         self.websocket = websocket
+        self.lock = threading.Lock()
+        self.audio_available = threading.Condition(self.lock)
+        self.last_decoded_samples = 0
         self.trans_thread = threading.Thread(target=self.speech_to_text)
         self.trans_thread.start()
         self.websocket.send(
@@ -275,25 +290,41 @@ class ServeClient:
         """
         Add audio frames to the ongoing audio stream buffer.
 
-        This method is responsible for maintaining the audio stream buffer, allowing the continuous addition
-        of audio frames as they are received. It also ensures that the buffer does not exceed a specified size
-        to prevent excessive memory usage.
-
-        If the buffer size exceeds a threshold (45 seconds of audio data), it discards the oldest 30 seconds
-        of audio data to maintain a reasonable buffer size. If the buffer is empty, it initializes it with the provided
-        audio frame. The audio stream buffer is used for real-time processing of audio data for transcription.
+        The frame is written into a fixed-capacity ring buffer that keeps the last 45 seconds of audio,
+        so the cost of adding a frame does not depend on how much audio has been buffered.
 
         Args:
             frame_np (numpy.ndarray): The audio frame data as a NumPy array.
 
         """
-        if self.frames_np is not None and self.frames_np.shape[0] > 45*self.RATE:
-            self.frames_offset += 30.0
-            self.frames_np = self.frames_np[int(30*self.RATE):]
-        if self.frames_np is None:
-            self.frames_np = frame_np.copy()
-        else:
-            self.frames_np = np.concatenate((self.frames_np, frame_np), axis=0)
+        with self.audio_available:
+            self.audio_buffer.write(frame_np)
+            self.audio_available.notify()
+
+    def wait_for_audio(self, min_duration):
+        """
+        Block until new audio arrived and at least `min_duration` seconds are pending, or the client exits.
+
+        The transcription thread is woken by `add_frames` and `cleanup`, so an idle client costs no CPU.
+
+        Args:
+            min_duration (float): Minimum seconds of pending audio worth decoding.
+
+        Returns:
+            bool: True if a decode should run now, False if the client is exiting.
+        """
+        def should_decode():
+            if self.exit:
+                return True
+            return (self.audio_buffer.pending_duration >= min_duration
+                    and self.audio_buffer.total_samples != self.last_decoded_samples)
+
+        with self.audio_available:
+            self.audio_available.wait_for(should_decode)
+            if self.exit:
+                return False
+            self.last_decoded_samples = self.audio_buffer.total_samples
+            return True
 
     def speech_to_text(self):
         """
@@ -317,23 +348,18 @@ class ServeClient:
                 logging.info("Exiting speech to text thread")
                 break
             
-            if self.frames_np is None: 
+            if not self.wait_for_audio(1.0):
                 continue
 
-            # clip audio if the current chunk exceeds 30 seconds, this basically implies that
-            # no valid segment for the last 30 seconds from whisper
-            if self.frames_np[int((self.timestamp_offset - self.frames_offset)*self.RATE):].shape[0] > 25 * self.RATE:
-                duration = self.frames_np.shape[0] / self.RATE
-                self.timestamp_offset = self.frames_offset + duration - 5
-    
-            samples_take = max(0, (self.timestamp_offset - self.frames_offset)*self.RATE)
-            input_bytes = self.frames_np[int(samples_take):].copy()
-            duration = input_bytes.shape[0] / self.RATE
-            if duration<1.0:
-                continue
+            with self.audio_available:
+                # clip audio if the current chunk exceeds 25 seconds, this basically implies that
+                # no valid segment for the last 25 seconds from whisper
+                self.audio_buffer.clip(25, keep=5)
+
+                # zero-copy view of the pending window, the transcriber only reads from it
+                input_sample = self.audio_buffer.pending()
+            duration = input_sample.shape[0] / self.RATE
             try:
-                input_sample = input_bytes.copy()
-                
                 # whisper transcribe with prompt
                 result, info = self.transcriber.transcribe(
                     input_sample, 
@@ -421,7 +447,7 @@ class ServeClient:
             for i, s in enumerate(segments[:-1]):
                 text_ = s.text
                 self.text.append(text_)
-                start, end = self.timestamp_offset + s.start, self.timestamp_offset + min(duration, s.end)
+                start, end = self.audio_buffer.cursor + s.start, self.audio_buffer.cursor + min(duration, s.end)
                 self.transcript.append(
                     {
                         'start': start,
@@ -434,8 +460,8 @@ class ServeClient:
 
         self.current_out += segments[-1].text
         last_segment = {
-            'start': self.timestamp_offset + segments[-1].start,
-            'end': self.timestamp_offset + min(duration, segments[-1].end),
+            'start': self.audio_buffer.cursor + segments[-1].start,
+            'end': self.audio_buffer.cursor + min(duration, segments[-1].end),
             'text': self.current_out
         }
         
@@ -451,8 +477,8 @@ class ServeClient:
                 self.text.append(self.current_out)
                 self.transcript.append(
                     {
-                        'start': self.timestamp_offset,
-                        'end': self.timestamp_offset + duration,
+                        'start': self.audio_buffer.cursor,
+                        'end': self.audio_buffer.cursor + duration,
                         'text': self.current_out
                     }
                 )
@@ -465,7 +491,8 @@ class ServeClient:
         
         # update offset
         if offset is not None:
-            self.timestamp_offset += offset
+            with self.audio_available:
+                self.audio_buffer.advance(offset)
 
         return last_segment
     
@@ -496,5 +523,7 @@ class ServeClient:
 
         """
         logging.info("Cleaning up.")
-        self.exit = True
+        with self.audio_available:
+            self.exit = True
+            self.audio_available.notify()
         self.transcriber.destroy()
@@ -0,0 +1,374 @@
+import argparse
+import collections
+import logging
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+
+_MISSING = object()
+
+
+class SessionStore:
+    """
+    Dict-like store of per-user session state with TTL and LRU eviction and a memory cap.
+
+    Replaces the plain `conversation_history` dict, which grew by one entry for every user
+    that ever connected. A session expires `ttl` seconds after it was last read or written,
+    and when there are more than `max_sessions` sessions or their pickled size exceeds
+    `max_bytes`, the least recently used ones are evicted.
+
+    Values mutated in place must be stored again (`store[key] = value`), so that their size is
+    measured and a persistent store writes them through.
+
+    A store passed to another process arrives empty with the same limits, since in-memory
+    sessions are not shared between processes. Use `SqliteSessionStore` to share them or to
+    keep them across restarts.
+
+    Attributes:
+        ttl (float): Seconds of inactivity after which a session expires.
+        max_sessions (int): Maximum number of sessions kept in memory.
+        max_bytes (int): Maximum pickled size of the sessions kept in memory.
+        total_bytes (int): Pickled size of the sessions in memory.
+    """
+
+    def __init__(self, ttl=1800.0, max_sessions=1024, max_bytes=64 * 2**20):
+        """
+        Initialize a SessionStore.
+
+        Args:
+            ttl (float, optional): Seconds of inactivity after which a session expires. Defaults to 1800.
+            max_sessions (int, optional): Maximum number of sessions in memory. Defaults to 1024.
+            max_bytes (int, optional): Maximum pickled size of the sessions in memory. Defaults to 64 MiB.
+        """
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._init_local()
+
+    def __getstate__(self):
+        return {"ttl": self.ttl, "max_sessions": self.max_sessions, "max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_local()
+
+    def _init_local(self):
+        self.lock = threading.RLock()
+        # key -> [value, size, last access], least recently used first
+        self.sessions = collections.OrderedDict()
+        self.total_bytes = 0
+
+    def sizeof(self, value):
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def _put(self, key, value, accessed):
+        self._drop(key)
+        size = self.sizeof(value)
+        self.sessions[key] = [value, size, accessed]
+        self.total_bytes += size
+
+    def _drop(self, key):
+        entry = self.sessions.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+
+    def expire(self):
+        """Remove the sessions that were not used for `ttl` seconds."""
+        with self.lock:
+            deadline = time.time() - self.ttl
+            while self.sessions:
+                key, (_, _, accessed) = next(iter(self.sessions.items()))
+                if accessed >= deadline:
+                    break
+                self._drop(key)
+                self._remove(key)
+
+    def evict(self):
+        """Evict the least recently used sessions until the store is within its limits."""
+        with self.lock:
+            while self.sessions and (len(self.sessions) > self.max_sessions
+                                     or self.total_bytes > self.max_bytes):
+                key = next(iter(self.sessions))
+                self._drop(key)
+                logging.info(f"[Session INFO:] Evicted session {key}")
+
+    def get(self, key, default=None):
+        """
+        Return a session and mark it as recently used.
+
+        Args:
+            key (str): The user's uid.
+            default (Any, optional): Returned if there is no such session. Defaults to None.
+
+        Returns:
+            Any: The session value or `default`.
+        """
+        with self.lock:
+            self.expire()
+            now = time.time()
+            entry = self.sessions.get(key)
+            if entry is not None:
+                entry[2] = now
+                self.sessions.move_to_end(key)
+                return entry[0]
+            value = self._load(key)
+            if value is _MISSING:
+                return default
+            self._put(key, value, now)
+            self.evict()
+            return value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.expire()
+            self._put(key, value, time.time())
+            self._save(key, value)
+            self.evict()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def pop(self, key, default=None):
+        """
+        Remove a session and return its value.
+
+        Args:
+            key (str): The user's uid.
+            default (Any, optional): Returned if there is no such session. Defaults to None.
+
+        Returns:
+            Any: The session value or `default`.
+        """
+        with self.lock:
+            value = self.get(key, default)
+            self._drop(key)
+            self._remove(key)
+            return value
+
+    def __delitem__(self, key):
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def __len__(self):
+        with self.lock:
+            self.expire()
+            return len(self.sessions)
+
+    def _load(self, key):
+        return _MISSING
+
+    def _save(self, key, value):
+        pass
+
+    def _remove(self, key):
+        pass
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Session store persisted to SQLite, shared by processes and kept across restarts.
+
+    The in-memory LRU of `SessionStore` is a cache in front of the database: writes go through
+    to the database, a session evicted from memory is loaded again on its next use, and
+    sessions idle for `ttl` seconds are deleted from both.
+
+    Every write stores a new random version with the row. A cached session is only returned
+    while its row still holds the version this process last read or wrote, so a session that
+    another process replaced or removed is reloaded or dropped instead of served stale.
+
+    Attributes:
+        path (str): Path of the SQLite database.
+    """
+
+    def __init__(self, path, ttl=1800.0, max_sessions=1024, max_bytes=64 * 2**20):
+        """
+        Initialize a SqliteSessionStore.
+
+        Args:
+            path (str): Path of the SQLite database, created if missing.
+            ttl (float, optional): Seconds of inactivity after which a session expires. Defaults to 1800.
+            max_sessions (int, optional): Maximum number of sessions in memory. Defaults to 1024.
+            max_bytes (int, optional): Maximum pickled size of the sessions in memory. Defaults to 64 MiB.
+        """
+        self.path = path
+        super().__init__(ttl=ttl, max_sessions=max_sessions, max_bytes=max_bytes)
+
+    def __getstate__(self):
+        return dict(super().__getstate__(), path=self.path)
+
+    def _init_local(self):
+        super()._init_local()
+        # the connection is opened lazily, in the process that uses the store
+        self.db = None
+        self.last_prune = 0.0
+        # key -> version of the row the cached session was read from or written to
+        self.versions = {}
+
+    def connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, timeout=10.0, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(key TEXT PRIMARY KEY, value BLOB, accessed REAL, version INTEGER NOT NULL DEFAULT 0)")
+            columns = [row[1] for row in self.db.execute("PRAGMA table_info(sessions)")]
+            if "version" not in columns:
+                # database written before rows were versioned
+                self.db.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            self.db.commit()
+        return self.db
+
+    def _drop(self, key):
+        if key in self.sessions:
+            self.versions.pop(key, None)
+        super()._drop(key)
+
+    def _touch(self, key, accessed, now):
+        # reads in memory keep the row from expiring, written at most every ttl / 2
+        if accessed < now - self.ttl / 2:
+            db = self.connect()
+            db.execute("UPDATE sessions SET accessed = ? WHERE key = ?", (now, key))
+            db.commit()
+
+    def _is_current(self, key):
+        """Return whether the cached session of a key is still the one in the database."""
+        now = time.time()
+        row = self.connect().execute(
+            "SELECT version, accessed FROM sessions WHERE key = ? AND accessed >= ?", (key, now - self.ttl)
+        ).fetchone()
+        if row is None or row[0] != self.versions.get(key):
+            return False
+        self._touch(key, row[1], now)
+        return True
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.sessions and not self._is_current(key):
+                self._drop(key)
+            return super().get(key, default)
+
+    def expire(self):
+        with self.lock:
+            super().expire()
+            now = time.time()
+            if now - self.last_prune < min(60.0, self.ttl):
+                return
+            self.last_prune = now
+            db = self.connect()
+            db.execute("DELETE FROM sessions WHERE accessed < ?", (now - self.ttl,))
+            db.commit()
+
+    def _load(self, key):
+        now = time.time()
+        row = self.connect().execute(
+            "SELECT value, version, accessed FROM sessions WHERE key = ? AND accessed >= ?", (key, now - self.ttl)
+        ).fetchone()
+        if row is None:
+            return _MISSING
+        self.versions[key] = row[1]
+        self._touch(key, row[2], now)
+        return pickle.loads(row[0])
+
+    def _save(self, key, value):
+        version = random.getrandbits(63)
+        db = self.connect()
+        db.execute(
+            "INSERT OR REPLACE INTO sessions (key, value, accessed, version) VALUES (?, ?, ?, ?)",
+            (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), time.time(), version),
+        )
+        db.commit()
+        self.versions[key] = version
+
+    def _remove(self, key):
+        db = self.connect()
+        deleted = db.execute("DELETE FROM sessions WHERE key = ?", (key,)).rowcount
+        db.commit()
+        return deleted > 0
+
+    def __contains__(self, key):
+        with self.lock:
+            if key in self.sessions:
+                # get drops a stale cached session
+                return super().__contains__(key)
+            # checked without unpickling, the caller may not be able to import the value's class
+            row = self.connect().execute(
+                "SELECT 1 FROM sessions WHERE key = ? AND accessed >= ?", (key, time.time() - self.ttl)
+            ).fetchone()
+            return row is not None
+
+    def pop(self, key, default=None):
+        # a session only in the database is deleted without being unpickled
+        with self.lock:
+            entry = self.sessions.get(key)
+            value = default
+            if entry is not None:
+                row = self.connect().execute(
+                    "SELECT value, version FROM sessions WHERE key = ? AND accessed >= ?",
+                    (key, time.time() - self.ttl),
+                ).fetchone()
+                if row is not None:
+                    # another process may have replaced the session since it was cached here
+                    value = entry[0] if row[1] == self.versions.get(key) else pickle.loads(row[0])
+            self._drop(key)
+            self._remove(key)
+            return value
+
+    def __delitem__(self, key):
+        with self.lock:
+            entry = self.sessions.get(key)
+            self._drop(key)
+            if not self._remove(key) and entry is None:
+                raise KeyError(key)
+
+
+def create_session_store(path=None, ttl=1800.0, max_sessions=1024, max_bytes=64 * 2**20):
+    """
+    Create an in-memory session store, or a SQLite-backed one if a database path is given.
+
+    Args:
+        path (str, optional): Path of the SQLite database. Defaults to in-memory only.
+        ttl (float, optional): Seconds of inactivity after which a session expires. Defaults to 1800.
+        max_sessions (int, optional): Maximum number of sessions in memory. Defaults to 1024.
+        max_bytes (int, optional): Maximum pickled size of the sessions in memory. Defaults to 64 MiB.
+
+    Returns:
+        SessionStore: The store.
+    """
+    if path:
+        return SqliteSessionStore(path, ttl=ttl, max_sessions=max_sessions, max_bytes=max_bytes)
+    return SessionStore(ttl=ttl, max_sessions=max_sessions, max_bytes=max_bytes)
+
+
+if __name__ == "__main__":
+    # soak: many short sessions on a long-running server, memory stays bounded
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=100000, help='Number of short sessions')
+    parser.add_argument('--turns', type=int, default=6, help='Messages per session')
+    parser.add_argument('--max_sessions', type=int, default=1024)
+    parser.add_argument('--max_mb', type=float, default=4.0)
+    parser.add_argument('--db', type=str, default=None, help='SQLite database, in-memory only if omitted')
+    args = parser.parse_args()
+
+    store = create_session_store(
+        args.db, ttl=60.0, max_sessions=args.max_sessions, max_bytes=int(args.max_mb * 2**20))
+    start = time.time()
+    for i in range(args.sessions):
+        history = store.get(f"user-{i}") or []
+        for turn in range(args.turns):
+            history.append({"speaker": "user", "message": f"message {turn} of session {i} " * 4})
+            store[f"user-{i}"] = history
+    elapsed = time.time() - start
+    print(f"{args.sessions} sessions of {args.turns} turns in {elapsed:.2f}s "
+          f"({1e6 * elapsed / (args.sessions * args.turns):.1f}us per update)")
+    print(f"in memory: {len(store)} sessions, {store.total_bytes / 2**20:.2f} MiB")
+    if args.db:
+        print(f"database: {os.path.getsize(args.db) / 2**20:.2f} MiB")
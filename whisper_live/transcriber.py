@@ -10,6 +10,7 @@ from typing import BinaryIO, Iterable, List, NamedTuple, Optional, Tuple, Union
 import ctranslate2
 import numpy as np
 import tokenizers
+import torch
 
 from faster_whisper.audio import decode_audio
 from faster_whisper.feature_extractor import FeatureExtractor
@@ -22,6 +23,8 @@ from faster_whisper.vad import (
     get_speech_timestamps,
 )
 
+from whisper_live.mel_frontend import IncrementalLogMel, pad_log_mel
+
 
 class Word(NamedTuple):
     start: float
@@ -145,6 +148,9 @@ class WhisperModel:
             )
 
         self.feature_extractor = FeatureExtractor()
+        self.mel_filters = torch.from_numpy(
+            self.feature_extractor.mel_filters.astype(np.float32)
+        )
         self.num_samples_per_token = self.feature_extractor.hop_length * 2
         self.frames_per_second = (
             self.feature_extractor.sampling_rate // self.feature_extractor.hop_length
@@ -381,6 +387,132 @@ class WhisperModel:
 
         return segments, info
 
+    def features(
+        self,
+        audio: np.ndarray,
+        mel_cache: Optional[IncrementalLogMel] = None,
+        offset: int = 0,
+    ) -> np.ndarray:
+        """Computes the log-Mel features of an audio window of at most 30 seconds.
+
+        Arguments:
+          audio: Audio waveform sampled at 16 kHz.
+          mel_cache: Incremental mel front end of the stream, None to compute from scratch.
+          offset: Stream index of the first sample of the window, used with mel_cache.
+
+        Returns:
+          The features padded to 30 seconds, shape (n_mels, 3000).
+        """
+        if mel_cache is not None:
+            return mel_cache(audio, self.mel_filters, offset).numpy()
+
+        nb_max_frames = self.feature_extractor.nb_max_frames
+        segment = self.feature_extractor(audio)[:, :nb_max_frames]
+        # silence pads to the same value with and without the cache
+        return pad_log_mel(segment, nb_max_frames)
+
+    def detect_language(
+        self,
+        audio: np.ndarray,
+        mel_cache: Optional[IncrementalLogMel] = None,
+        offset: int = 0,
+    ) -> Tuple[str, float]:
+        """Detects the language spoken in the first 30 seconds of an audio window.
+
+        Arguments:
+          audio: Audio waveform sampled at 16 kHz.
+          mel_cache: Incremental mel front end of the stream, None to compute from scratch.
+          offset: Stream index of the first sample of the window, used with mel_cache.
+
+        Returns:
+          The language code and its probability.
+        """
+        if not self.model.is_multilingual:
+            return "en", 1.0
+        encoder_output = self.encode(self.features(audio, mel_cache, offset))
+        token, probability = self.model.detect_language(encoder_output)[0][0]
+        return token[2:-2], probability
+
+    def transcribe_batch(
+        self,
+        audios: List[np.ndarray],
+        languages: List[Optional[str]],
+        tasks: Optional[List[str]] = None,
+        mel_caches: Optional[List[IncrementalLogMel]] = None,
+        offsets: Optional[List[int]] = None,
+        beam_size: int = 1,
+    ) -> List[str]:
+        """Transcribes several audio windows of at most 30 seconds in a single batch.
+
+        All windows go through one encoder call and one decoder call with a separate
+        prompt per window, without timestamps and without temperature fallback.
+
+        Arguments:
+          audios: Audio waveforms sampled at 16 kHz.
+          languages: Language of each window, None to detect it.
+          tasks: Task of each window ("transcribe" or "translate"), "transcribe" by default.
+          mel_caches: Per-stream incremental mel front end of each window, None to compute
+            the features from scratch.
+          offsets: Stream index of the first sample of each window, used with mel_caches.
+          beam_size: Beam size to use for decoding.
+
+        Returns:
+          The transcribed text of each window.
+        """
+        if tasks is None:
+            tasks = ["transcribe"] * len(audios)
+        if mel_caches is None:
+            mel_caches = [None] * len(audios)
+        if offsets is None:
+            offsets = [0] * len(audios)
+
+        features = [
+            self.features(audio, mel_cache, offset)
+            for audio, mel_cache, offset in zip(audios, mel_caches, offsets)
+        ]
+
+        to_cpu = self.model.device == "cuda" and len(self.model.device_index) > 1
+        encoder_output = self.model.encode(
+            get_ctranslate2_storage(np.stack(features)), to_cpu=to_cpu
+        )
+
+        if any(language is None for language in languages):
+            if self.model.is_multilingual:
+                detected = self.model.detect_language(encoder_output)
+                languages = [
+                    language if language is not None else results[0][0][2:-2]
+                    for language, results in zip(languages, detected)
+                ]
+            else:
+                languages = ["en" if language is None else language for language in languages]
+
+        tokenizers_ = [
+            Tokenizer(
+                self.hf_tokenizer,
+                self.model.is_multilingual,
+                task=task,
+                language=language if self.model.is_multilingual else "en",
+            )
+            for language, task in zip(languages, tasks)
+        ]
+        prompts = [
+            list(tokenizer.sot_sequence) + [tokenizer.no_timestamps]
+            for tokenizer in tokenizers_
+        ]
+
+        results = self.model.generate(
+            encoder_output,
+            prompts,
+            beam_size=beam_size,
+            max_length=self.max_length,
+            suppress_blank=True,
+            suppress_tokens=[-1],
+        )
+        return [
+            tokenizer.decode(result.sequences_ids[0]).strip()
+            for tokenizer, result in zip(tokenizers_, results)
+        ]
+
     def generate_segments(
         self,
         features: np.ndarray,
@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class TranscriberPool:
+    """
+    Process-wide pool of transcriber instances shared by all connected clients.
+
+    Loading a whisper model (engine deserialization, tokenizer, mel filters) is expensive, so
+    the pool creates a fixed number of instances once and clients lease one per decode call.
+    When all instances are busy, callers queue up and are served strictly first come, first
+    served, so a client decoding in a tight loop cannot starve the others.
+
+    The backend is pluggable: `factory` is any zero-argument callable returning a transcriber,
+    e.g. `functools.partial(WhisperTRTLLM, engine_dir, assets_dir="assets", device="cuda")`
+    on GPU or `functools.partial(WhisperModel, "small.en", device="cpu", compute_type="int8")`
+    on CPU.
+
+    Attributes:
+        size (int): Number of transcriber instances in the pool.
+        instances (list): All transcriber instances owned by the pool.
+    """
+
+    def __init__(self, factory, size=1):
+        """
+        Initialize a TranscriberPool instance and load all of its transcribers.
+
+        Args:
+            factory (callable): Zero-argument callable that creates a transcriber instance.
+            size (int, optional): Number of instances to create. Defaults to 1.
+
+        Raises:
+            ValueError: If size is smaller than 1.
+        """
+        if size < 1:
+            raise ValueError(f"Transcriber pool size must be at least 1, got {size}.")
+        self.size = size
+        self.lock = threading.Lock()
+        self.instances = []
+        for i in range(size):
+            start = time.time()
+            self.instances.append(factory())
+            logging.info(f"[Whisper INFO:] Loaded transcriber {i + 1}/{size} in {time.time() - start:.2f}s")
+        self._idle = deque(self.instances)
+        self._waiters = deque()
+
+    @property
+    def available(self):
+        """int: Number of idle transcriber instances."""
+        with self.lock:
+            return len(self._idle)
+
+    @property
+    def waiting(self):
+        """int: Number of callers queued for a transcriber."""
+        with self.lock:
+            return len(self._waiters)
+
+    def acquire(self, timeout=None):
+        """
+        Lease a transcriber, blocking until one is free.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to waiting forever.
+
+        Returns:
+            The leased transcriber, or None if the timeout expired.
+        """
+        with self.lock:
+            if self._idle and not self._waiters:
+                return self._idle.popleft()
+            waiter = [threading.Event(), None]
+            self._waiters.append(waiter)
+
+        if waiter[0].wait(timeout):
+            return waiter[1]
+
+        with self.lock:
+            if waiter[1] is None:
+                self._waiters.remove(waiter)
+                return None
+        # handed over between the timeout and taking the lock
+        return waiter[1]
+
+    def release(self, transcriber):
+        """
+        Return a leased transcriber, handing it directly to the longest waiting caller.
+
+        Args:
+            transcriber: A transcriber previously returned by `acquire`.
+        """
+        with self.lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter[1] = transcriber
+                waiter[0].set()
+            else:
+                self._idle.append(transcriber)
+
+    @contextmanager
+    def lease(self, timeout=None):
+        """
+        Context manager leasing a transcriber for the duration of one decode call.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to waiting forever.
+
+        Raises:
+            TimeoutError: If no transcriber became free within the timeout.
+        """
+        transcriber = self.acquire(timeout)
+        if transcriber is None:
+            raise TimeoutError(f"No transcriber available after {timeout}s.")
+        try:
+            yield transcriber
+        finally:
+            self.release(transcriber)
+
+    def destroy(self):
+        """Release the resources held by every transcriber in the pool."""
+        for transcriber in self.instances:
+            if hasattr(transcriber, "destroy"):
+                transcriber.destroy()
+        self.instances = []
+        self._idle.clear()
@@ -15,8 +15,14 @@ import torch
 import numpy as np
 import queue
 
-from whisper_live.vad import VoiceActivityDetection
-from whisper_live.trt_transcriber import WhisperTRTLLM
+from whisper_live.vad import VoiceActivityDetection, VadState, VadBatcher
+from whisper_live.backend import load_transcriber
+from whisper_live.audio_buffer import AudioRingBuffer
+from whisper_live.audio_format import AUDIO_FORMATS, decode_frame, to_float32
+from whisper_live.transcriber_pool import TranscriberPool
+from whisper_live.admission import AdmissionController
+from whisper_live.decode_scheduler import DecodeScheduler
+from whisper_live.mel_frontend import IncrementalLogMel
 
 
 from scipy.io.wavfile import write
@@ -37,13 +43,18 @@ class TranscriptionServer:
 
     Attributes:
         RATE (int): The audio sampling rate (constant) set to 16000.
-        vad_model (torch.Module): The voice activity detection model.
+        vad_model (VoiceActivityDetection or VadBatcher): The voice activity detection model, shared by all clients.
         vad_threshold (float): The voice activity detection threshold.
         clients (dict): A dictionary to store connected clients.
         websockets (dict): A dictionary to store WebSocket connections.
         clients_start_time (dict): A dictionary to track client start times.
-        max_clients (int): Maximum allowed connected clients.
+        max_clients (int): Hard limit of connected clients, None to only limit by measured load.
         max_connection_time (int): Maximum allowed connection time in seconds.
+        transcriber_pool (TranscriberPool): Whisper models shared by all clients.
+        decode_scheduler (DecodeScheduler): Batches the decode windows of all clients.
+        admission (AdmissionController): Admits clients while the decode latency targets hold.
+        admission_lock (threading.Condition): Guards `admission`, notified when a slot may have freed.
+        wait_update_interval (float): Seconds between two position updates sent to a waiting client.
     """
 
     RATE = 16000
@@ -54,33 +65,93 @@ class TranscriptionServer:
         self.clients = {}
         self.websockets = {}
         self.clients_start_time = {}
-        self.max_clients = 4
+        self.max_clients = None
         self.max_connection_time = 6000
+        self.transcriber_pool = None
+        self.decode_scheduler = None
+        self.admission = None
+        self.admission_lock = threading.Condition()
+        self.wait_update_interval = 1.0
+        self.vad_model = None
+        self.vad_threshold = 0.65
+
+    def __getstate__(self):
+        # `run` is sent to a spawned process, the lock is re-created there
+        state = dict(self.__dict__)
+        del state["admission_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.admission_lock = threading.Condition()
 
-    def get_wait_time(self):
+    def get_wait_time(self, position=1):
         """
         Calculate and return the estimated wait time for clients.
 
+        Args:
+            position (int, optional): 1-based position of the client in the wait queue. Defaults to 1.
+
         Returns:
             float: The estimated wait time in minutes.
         """
-        wait_time = None
+        now = time.time()
+        elapsed = [now - start_time for start_time in list(self.clients_start_time.values())]
+        return self.admission.eta(position, elapsed) / 60
 
-        for k, v in self.clients_start_time.items():
-            current_client_time_remaining = self.max_connection_time - (time.time() - v)
+    def wait_for_admission(self, websocket, client_uid):
+        """
+        Queue a new client until the admission controller has capacity for it.
 
-            if wait_time is None or current_client_time_remaining < wait_time:
-                wait_time = current_client_time_remaining
+        While waiting, the client is sent a "WAIT" status every `wait_update_interval` seconds with
+        its position in the queue and the estimated wait in minutes. It is promoted as soon as it
+        is at the head of the queue and a slot frees up or the measured load drops.
 
-        return wait_time / 60
-    
-    def isJson(self, str):
+        Args:
+            websocket (WebSocket): The WebSocket connection for the client.
+            client_uid (str): A unique identifier for the client.
+
+        Returns:
+            bool: True once admitted, False if the client disconnected while waiting.
+        """
+        with self.admission_lock:
+            self.admission.enqueue(websocket)
         try:
-            json.loads(str)
-        except Exception:
-            return False 
-        
-        return True
+            while True:
+                with self.admission_lock:
+                    if self.admission.try_admit(websocket):
+                        # the next client in the queue may fit as well
+                        self.admission_lock.notify_all()
+                        return True
+                    position = self.admission.position(websocket)
+                wait_time = self.get_wait_time(position)
+                logging.info(f"[Whisper INFO:] Client {client_uid} waiting at position {position}")
+                websocket.send(json.dumps({
+                    "uid": client_uid,
+                    "status": "WAIT",
+                    "message": wait_time,
+                    "position": position,
+                }))
+                with self.admission_lock:
+                    self.admission_lock.wait(self.wait_update_interval)
+        except Exception as e:
+            logging.info(f"[Whisper INFO:] Client {client_uid} left the wait queue: {e}")
+            with self.admission_lock:
+                self.admission.remove(websocket)
+                self.admission_lock.notify_all()
+            return False
+
+    def release_client(self, websocket):
+        """
+        Free the admission slot of a disconnected client and promote the next waiting one.
+
+        Args:
+            websocket (WebSocket): The WebSocket connection for the client.
+        """
+        start_time = self.clients_start_time.pop(websocket)
+        with self.admission_lock:
+            self.admission.release(time.time() - start_time)
+            self.admission_lock.notify_all()
 
     def recv_audio(self, websocket, transcription_queue=None, llm_queue=None, whisper_tensorrt_path=None, should_send_server_ready=None, conversation_history=None, events=None):
         """
@@ -91,51 +162,63 @@ class TranscriptionServer:
         voice activity detection (VAD) model to determine if they contain speech
         or not. If the audio frame contains speech, it is added to the client's
         audio data for ASR.
-        If the maximum number of clients is reached, the method sends a
-        "WAIT" status to the client, indicating that they should wait
+        If the admission controller has no capacity, the client is queued and
+        sent "WAIT" status updates with its position and estimated wait time
         until a slot is available.
         If a client's connection exceeds the maximum allowed time, it will
         be disconnected, and the client's resources will be cleaned up.
 
+        The initial options message may announce the encoding of the binary audio frames with
+        "audio_format" ("float32", the default, "int16" or "mulaw"). Text frames are control
+        messages and binary frames are audio, so they are told apart by the websocket opcode.
+
         Args:
             websocket (WebSocket): The WebSocket connection for the client.
         
         Raises:
             Exception: If there is an error during the audio frame processing.
         """
-        self.vad_model = VoiceActivityDetection()
-        self.vad_threshold = 0.65
+        # the VAD session is shared, only the recurrent state belongs to this connection
+        vad_state = VadState()
 
         logging.info("[Whisper INFO:] New client connected")
         options = websocket.recv()
         options = json.loads(options)
 
-        if len(self.clients) >= self.max_clients:
-            logging.warning("Client Queue Full. Asking client to wait ...")
-            wait_time = self.get_wait_time()
-            response = {
+        audio_format = options.get("audio_format", "float32")
+        if audio_format not in AUDIO_FORMATS:
+            logging.warning(f"[Whisper WARNING:] Unsupported audio format {audio_format}")
+            websocket.send(json.dumps({
                 "uid": options["uid"],
-                "status": "WAIT",
-                "message": wait_time,
-            }
-            websocket.send(json.dumps(response))
+                "status": "ERROR",
+                "message": f"Unsupported audio format {audio_format}, expected one of {AUDIO_FORMATS}.",
+            }))
+            websocket.close()
+            return
+
+        if not self.wait_for_admission(websocket, options["uid"]):
+            return
+
+        try:
+            client = ServeClient(
+                websocket,
+                multilingual=options["multilingual"],
+                input_language=options["input_language"],
+                output_language=options["output_language"],
+                task=options["task"],
+                client_uid=options["uid"],
+                transcription_queue=transcription_queue,
+                llm_queue=llm_queue,
+                decode_scheduler=self.decode_scheduler,
+            )
+        except Exception as e:
+            # the slot was taken in wait_for_admission, release_client only knows registered clients
+            logging.exception(f"[Whisper ERROR:] Could not start client {options['uid']}: {e}")
+            with self.admission_lock:
+                self.admission.release()
+                self.admission_lock.notify_all()
             websocket.close()
-            del websocket
             return
-        
-        transcriber = WhisperTRTLLM(whisper_tensorrt_path, assets_dir="assets", device="cuda")
-
-        client = ServeClient(
-            websocket,
-            multilingual=options["multilingual"],
-            input_language=options["input_language"],
-            output_language=options["output_language"],
-            task=options["task"],
-            client_uid=options["uid"],
-            transcription_queue=transcription_queue,
-            llm_queue=llm_queue,
-            transcriber=transcriber,
-        )
 
         self.clients[websocket] = client
         self.clients_start_time[websocket] = time.time()
@@ -145,17 +228,18 @@ class TranscriptionServer:
             # spinlock
             try:
                 frame_data = websocket.recv()
-                if self.isJson(frame_data):
+                # text frames carry control messages, binary frames carry audio
+                if isinstance(frame_data, str):
                     dumps = json.loads(frame_data)
                     self.clients[websocket].input_language = dumps["input_language"]
                     self.clients[websocket].output_language = dumps["output_language"]
                     continue
                 
-                frame_np = np.frombuffer(frame_data, dtype=np.float32)
+                frame_np = decode_frame(frame_data, audio_format)
 
                 # VAD
                 try:
-                    speech_prob = self.vad_model(torch.from_numpy(frame_np.copy()), self.RATE).item()
+                    speech_prob = self.vad_model(torch.from_numpy(to_float32(frame_np)), self.RATE, state=vad_state).item()
                     if speech_prob < self.vad_threshold:
                         no_voice_activity_chunks += 1
                         if no_voice_activity_chunks > 5:
@@ -170,44 +254,114 @@ class TranscriptionServer:
 
                 except Exception as e:
                     logging.error(e)
-                    return
+                    raise
                 self.clients[websocket].add_frames(frame_np)
 
                 elapsed_time = time.time() - self.clients_start_time[websocket]
                 if elapsed_time >= self.max_connection_time:
-                    if self.clients[websocket].client_uid in conversation_history:
-                        del conversation_history[self.clients[websocket].client_uid]
+                    conversation_history.pop(self.clients[websocket].client_uid, None)
                     self.clients[websocket].disconnect()
                     logging.warning(f"{self.clients[websocket]} Client disconnected due to overtime.")
                     self.clients[websocket].cleanup()
                     del self.clients[websocket]
-                    self.clients_start_time.pop(websocket)
+                    self.release_client(websocket)
                     websocket.close()
                     del websocket
                     break
 
             except Exception as e:
                 logging.exception(e)
-                if self.clients[websocket].client_uid in conversation_history:
-                        del conversation_history[self.clients[websocket].client_uid]
+                conversation_history.pop(self.clients[websocket].client_uid, None)
                 uid = self.clients[websocket].client_uid
                 if self.clients[websocket].client_uid in events:
                     events[self.clients[websocket].client_uid].set()
                 self.clients[websocket].cleanup()
                 del self.clients[websocket]
-                self.clients_start_time.pop(websocket)
+                self.release_client(websocket)
                 logging.info("[Whisper INFO:] Connection Closed.")
                 del websocket
                 break
 
-    def run(self, host, port=9090, transcription_queue=None, llm_queue=None, whisper_tensorrt_path=None, should_send_server_ready=None, conversation_history=None, events=None):
+    def load_models(self, whisper_tensorrt_path=None, transcriber_pool_size=1, max_batch_size=8, max_batch_wait=0.005, vad_batching=True, backend="tensorrt", whisper_model=None, device=None, compute_type=None, max_rtf=0.8, max_decode_latency=1.0):
+        """
+        Load the VAD session and the whisper engines once per process and start the decode scheduler.
+
+        Args:
+            whisper_tensorrt_path (str): TensorRT-LLM engine directory.
+            transcriber_pool_size (int): Number of Whisper engines shared by all clients.
+            max_batch_size (int): Maximum number of client windows decoded in one batch.
+            max_batch_wait (float): Seconds to collect client windows before decoding a batch.
+            vad_batching (bool): Run the VAD of all clients in shared batches.
+            backend (str): Whisper backend, "tensorrt" or "ctranslate2" (runs on CPU).
+            whisper_model (str): CTranslate2 model size or path, defaults to whisper_tensorrt_path.
+            device (str): Device of the CTranslate2 backend, "cpu" or "cuda".
+            compute_type (str): Compute type of the CTranslate2 backend, e.g. "int8".
+            max_rtf (float): Maximum projected real-time factor of the decode workers for admitting clients.
+            max_decode_latency (float): Maximum average decode latency in seconds for admitting clients.
+        """
+        # load the VAD session and the whisper engines once per process
+        self.vad_model = VoiceActivityDetection()
+        if vad_batching:
+            self.vad_model = VadBatcher(self.vad_model)
+
+        # clients lease the whisper engines per decode call
+        self.transcriber_pool = TranscriberPool(
+            functools.partial(
+                load_transcriber,
+                backend,
+                whisper_model or whisper_tensorrt_path,
+                device=device,
+                compute_type=compute_type,
+            ),
+            size=transcriber_pool_size,
+        )
+        self.decode_scheduler = DecodeScheduler(
+            self.transcriber_pool,
+            max_batch_size=max_batch_size,
+            max_wait=max_batch_wait,
+        )
+        self.admission = AdmissionController(
+            self.decode_scheduler,
+            max_rtf=max_rtf,
+            max_latency=max_decode_latency,
+            max_clients=self.max_clients,
+        )
+
+    def run(self, host, port=9090, transcription_queue=None, llm_queue=None, whisper_tensorrt_path=None, should_send_server_ready=None, conversation_history=None, events=None, transcriber_pool_size=1, max_batch_size=8, max_batch_wait=0.005, vad_batching=True, backend="tensorrt", whisper_model=None, device=None, compute_type=None, max_rtf=0.8, max_decode_latency=1.0):
         """
         Run the transcription server.
 
         Args:
             host (str): The host address to bind the server.
             port (int): The port number to bind the server.
+            transcriber_pool_size (int): Number of Whisper engines shared by all clients.
+            max_batch_size (int): Maximum number of client windows decoded in one batch.
+            max_batch_wait (float): Seconds to collect client windows before decoding a batch.
+            vad_batching (bool): Run the VAD of all clients in shared batches.
+            backend (str): Whisper backend, "tensorrt" or "ctranslate2" (runs on CPU).
+            whisper_model (str): CTranslate2 model size or path, defaults to whisper_tensorrt_path.
+            device (str): Device of the CTranslate2 backend, "cpu" or "cuda".
+            compute_type (str): Compute type of the CTranslate2 backend, e.g. "int8".
+            max_rtf (float): Maximum projected real-time factor of the decode workers for admitting clients.
+            max_decode_latency (float): Maximum average decode latency in seconds for admitting clients.
         """
+        # this process consumes the LLM responses, read them while the models load
+        if llm_queue is not None:
+            llm_queue.start_reader()
+        self.load_models(
+            whisper_tensorrt_path,
+            transcriber_pool_size=transcriber_pool_size,
+            max_batch_size=max_batch_size,
+            max_batch_wait=max_batch_wait,
+            vad_batching=vad_batching,
+            backend=backend,
+            whisper_model=whisper_model,
+            device=device,
+            compute_type=compute_type,
+            max_rtf=max_rtf,
+            max_decode_latency=max_decode_latency,
+        )
+
         # wait for WhisperSpeech to warmup
         while not should_send_server_ready.value:
             time.sleep(0.5)
@@ -239,10 +393,10 @@ class ServeClient:
         frames (bytes): Accumulated audio frames.
         language (str): The language for transcription.
         task (str): The task type, e.g., "transcribe."
-        transcriber (WhisperModel): The Whisper model for speech-to-text.
-        timestamp_offset (float): The offset in audio timestamps.
-        frames_np (numpy.ndarray): NumPy array to store audio frames.
-        frames_offset (float): The offset in audio frames.
+        decode_scheduler (DecodeScheduler): Batches decode windows with those of the other clients.
+        audio_buffer (AudioRingBuffer): Ring buffer holding the last 45 seconds of audio, its cursor
+            marks where the audio not yet sent as an EOS prompt starts.
+        mel_cache (IncrementalLogMel): Log-mel frames of the pending window computed so far.
         exit (bool): A flag to exit the transcription thread.
         transcript (list): List of transcribed segments.
         websocket: The WebSocket connection for the client.
@@ -262,7 +416,8 @@ class ServeClient:
         client_uid=None,
         transcription_queue=None,
         llm_queue=None,
-        transcriber=None,
+        decode_scheduler=None,
+        buffer_dtype=np.float32,
         ):
         """
         Initialize a ServeClient instance.
@@ -277,11 +432,16 @@ class ServeClient:
             multilingual (bool, optional): Whether the client supports multilingual transcription. Defaults to False.
             language (str, optional): The language for transcription. Defaults to None.
             client_uid (str, optional): A unique identifier for the client. Defaults to None.
+            transcription_queue (TranscriptMailbox, optional): Mailbox of transcripts for the LLM client.
+            llm_queue (UserChannel, optional): Channel of LLM responses keyed by client uid.
+            decode_scheduler (DecodeScheduler): Scheduler shared with the other clients.
+            buffer_dtype (numpy.dtype, optional): Storage dtype of the audio buffer, np.int16 halves
+                its memory. Defaults to np.float32.
 
         """
-        if transcriber is None:
-            raise ValueError("Transcriber is None.")
-        self.transcriber = transcriber
+        if decode_scheduler is None:
+            raise ValueError("Decode scheduler is None.")
+        self.decode_scheduler = decode_scheduler
         self.client_uid = client_uid
         self.transcription_queue = transcription_queue
         self.llm_queue = llm_queue
@@ -294,9 +454,8 @@ class ServeClient:
         self.output_language = output_language
         logging.info(f"Intialized with languages: {self.input_language} {self.output_language}")
 
-        self.timestamp_offset = 0.0
-        self.frames_np = None
-        self.frames_offset = 0.0
+        self.audio_buffer = AudioRingBuffer(capacity=45, rate=self.RATE, dtype=buffer_dtype)
+        self.mel_cache = IncrementalLogMel()
         self.exit = False
         self.transcript = []
         self.prompt = None
@@ -305,49 +464,86 @@ class ServeClient:
         # threading
         self.websocket = websocket
         self.lock = threading.Lock()
+        self.audio_available = threading.Condition(self.lock)
         self.eos = False
+        self.last_decoded_samples = 0
+        self.last_decoded_eos = False
         self.trans_thread = threading.Thread(target=self.speech_to_text)
         self.trans_thread.start()
+        self.llm_thread = threading.Thread(target=self.forward_llm_responses)
+        self.llm_thread.start()
         
-        self.websocket.send(
-            json.dumps(
-                {
-                    "uid": self.client_uid,
-                    "message": self.SERVER_READY
-                }
+        try:
+            self.websocket.send(
+                json.dumps(
+                    {
+                        "uid": self.client_uid,
+                        "message": self.SERVER_READY
+                    }
+                )
             )
-        )
+        except Exception:
+            # the caller never gets this client to clean up, stop the transcription thread here
+            self.cleanup()
+            raise
     
     def set_eos(self, eos):
-        self.lock.acquire()
-        self.eos = eos
-        self.lock.release()
+        with self.audio_available:
+            if self.eos != eos:
+                self.eos = eos
+                self.audio_available.notify()
     
     def add_frames(self, frame_np):
         """
         Add audio frames to the ongoing audio stream buffer.
 
-        This method is responsible for maintaining the audio stream buffer, allowing the continuous addition
-        of audio frames as they are received. It also ensures that the buffer does not exceed a specified size
-        to prevent excessive memory usage.
-
-        If the buffer size exceeds a threshold (45 seconds of audio data), it discards the oldest 30 seconds
-        of audio data to maintain a reasonable buffer size. If the buffer is empty, it initializes it with the provided
-        audio frame. The audio stream buffer is used for real-time processing of audio data for transcription.
+        The frame is written into a fixed-capacity ring buffer that keeps the last 45 seconds of audio,
+        so the cost of adding a frame does not depend on how much audio has been buffered.
 
         Args:
             frame_np (numpy.ndarray): The audio frame data as a NumPy array.
 
         """
-        self.lock.acquire()
-        if self.frames_np is not None and self.frames_np.shape[0] > 45*self.RATE:
-            self.frames_offset += 30.0
-            self.frames_np = self.frames_np[int(30*self.RATE):]
-        if self.frames_np is None:
-            self.frames_np = frame_np.copy()
-        else:
-            self.frames_np = np.concatenate((self.frames_np, frame_np), axis=0)
-        self.lock.release()
+        with self.audio_available:
+            self.audio_buffer.write(frame_np)
+            self.audio_available.notify()
+
+    def should_decode(self, min_duration):
+        """
+        Check whether the transcription thread has work, must be called with `lock` held.
+
+        Args:
+            min_duration (float): Minimum seconds of pending audio worth decoding.
+
+        Returns:
+            bool: True if the client is exiting, or if at least `min_duration` seconds are pending
+                and new audio arrived or the EOS flag changed since the last decode.
+        """
+        if self.exit:
+            return True
+        if self.audio_buffer.pending_duration < min_duration:
+            return False
+        return (self.audio_buffer.total_samples != self.last_decoded_samples
+                or self.eos != self.last_decoded_eos)
+
+    def wait_for_audio(self, min_duration, timeout=None):
+        """
+        Block until there is audio worth decoding, signalled by `add_frames`, `set_eos` or `cleanup`.
+
+        Args:
+            min_duration (float): Minimum seconds of pending audio worth decoding.
+            timeout (float, optional): Maximum seconds to wait. Defaults to waiting forever.
+
+        Returns:
+            bool: True if a decode should run now, False on timeout or exit.
+        """
+        with self.audio_available:
+            ready = self.audio_available.wait_for(lambda: self.should_decode(min_duration), timeout)
+            if not ready or self.exit:
+                return False
+            self.last_decoded_samples = self.audio_buffer.total_samples
+            self.last_decoded_eos = self.eos
+            return True
 
     def speech_to_text(self):
         """
@@ -367,44 +563,29 @@ class ServeClient:
 
         """
         while True:
-            # send the LLM outputs
-            try:
-                llm_response = None
-                if self.client_uid in self.llm_queue:
-                    if len(self.llm_queue[self.client_uid]) > 0:
-                        temp_queue = self.llm_queue[self.client_uid]
-                        llm_response = temp_queue.pop(0)
-                        self.websocket.send(json.dumps(llm_response))
-                        self.llm_queue[self.client_uid] = temp_queue
-            except queue.Empty:
-                pass
-            
             if self.exit:
                 logging.info("[Whisper INFO:] Exiting speech to text thread")
                 break
             
-            if self.frames_np is None:
-                time.sleep(0.02)    # wait for any audio to arrive
+            # sleeps until enough new audio arrived or EOS changed, LLM outputs are forwarded
+            # by forward_llm_responses
+            if not self.wait_for_audio(0.4):
                 continue
 
-            # clip audio if the current chunk exceeds 30 seconds, this basically implies that
-            # no valid segment for the last 30 seconds from whisper
-            if self.frames_np[int((self.timestamp_offset - self.frames_offset)*self.RATE):].shape[0] > 25 * self.RATE:
-                duration = self.frames_np.shape[0] / self.RATE
-                self.timestamp_offset = self.frames_offset + duration - 5
-    
-            samples_take = max(0, (self.timestamp_offset - self.frames_offset)*self.RATE)
-            input_bytes = self.frames_np[int(samples_take):].copy()
-            duration = input_bytes.shape[0] / self.RATE
-            if duration<0.4:
-                time.sleep(0.01)    # 5ms sleep to wait for some voice active audio to arrive
-                continue
+            with self.audio_available:
+                # clip audio if the current chunk exceeds 25 seconds, this basically implies that
+                # no valid segment for the last 25 seconds from whisper
+                self.audio_buffer.clip(25, keep=5)
+
+                # zero-copy view of the pending window, only the mel frames of new samples are computed
+                offset = self.audio_buffer.cursor_sample
+                input_sample = self.audio_buffer.pending()
+            duration = input_sample.shape[0] / self.RATE
 
             try:
-                input_sample = input_bytes.copy()
                 start = time.time()
-                mel, duration = self.transcriber.log_mel_spectrogram(input_sample)
-                last_segment = self.transcriber.transcribe(mel, text_prefix=f"<|startoftranscript|><|{self.input_language}|><|transcribe|><|notimestamps|>")
+                last_segment = self.decode_scheduler.transcribe(
+                    input_sample, self.input_language, self.task, mel_cache=self.mel_cache, offset=offset)
                 infer_time = time.time() - start
                 self.segment_inference_time.append(infer_time)
 
@@ -423,9 +604,15 @@ class ServeClient:
                                 })
                             )
                             
-                        self.transcription_queue.put({"uid": self.client_uid, "prompt": self.prompt, "eos": self.eos, "language": self.output_language})
+                        # a partial replaces the previous one still waiting for the LLM client
+                        self.transcription_queue.put(
+                            self.client_uid,
+                            {"uid": self.client_uid, "prompt": self.prompt, "eos": self.eos, "language": self.output_language},
+                            final=self.eos,
+                        )
                         if self.eos:
-                            self.timestamp_offset += duration
+                            with self.audio_available:
+                                self.audio_buffer.advance(duration)
                             logging.info(f"[Whisper INFO]: {self.prompt}, eos: {self.eos}")
                             logging.info(
                                 f"[Whisper INFO]: Average inference time {sum(self.segment_inference_time) / len(self.segment_inference_time)}\n\n")
@@ -439,6 +626,25 @@ class ServeClient:
             except Exception as e:
                 logging.exception(f"[ERROR]: {e}")
     
+    def forward_llm_responses(self):
+        """
+        Send the LLM outputs of this client as they arrive, until `cleanup` discards its queue.
+        """
+        while not self.exit:
+            try:
+                # woken by each output and by cleanup, the timeout only covers a cleanup that
+                # discarded the queue between the exit check and get
+                llm_response = self.llm_queue.get(self.client_uid, timeout=1.0)
+            except queue.Empty:
+                continue
+            try:
+                self.websocket.send(json.dumps(llm_response))
+            except Exception as e:
+                logging.info(f"[Whisper INFO:] Could not send LLM output to {self.client_uid}: {e}")
+        # a get that started after cleanup reopened the queue
+        self.llm_queue.discard(self.client_uid)
+        logging.info("[Whisper INFO:] Exiting LLM output thread")
+
     def disconnect(self):
         """
         Notify the client of disconnection and send a disconnect message.
@@ -467,9 +673,10 @@ class ServeClient:
         """
         logging.info("Cleaning up.")
         
-        while not self.transcription_queue.empty():
-            self.transcription_queue.get()
-        if self.client_uid in self.llm_queue:
-            del self.llm_queue[self.client_uid]
-        self.exit = True
+        with self.audio_available:
+            self.exit = True
+            self.audio_available.notify()
+        # after the exit flag, so that forward_llm_responses stops once get is woken
+        self.transcription_queue.discard(self.client_uid)
+        self.llm_queue.discard(self.client_uid)
         # self.transcriber.destroy()
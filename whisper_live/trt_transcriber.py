@@ -9,6 +9,7 @@ from typing import Dict, Iterable, List, Optional, TextIO, Tuple, Union
 import torch
 import numpy as np
 from whisper.tokenizer import get_tokenizer
+from whisper_live.mel_frontend import IncrementalLogMel
 from whisper_live.whisper_utils import (mel_filters, store_transcripts,
                            write_error_stats, load_audio_wav_format,
                            pad_or_trim)
@@ -209,7 +210,9 @@ class WhisperTRTLLM(object):
         self,
         audio: Union[str, np.ndarray, torch.Tensor],
         padding: int = 0,
-        return_duration = True
+        return_duration = True,
+        mel_cache: Optional[IncrementalLogMel] = None,
+        offset: int = 0,
     ):
         """
         Compute the log-Mel spectrogram of
@@ -228,6 +231,13 @@ class WhisperTRTLLM(object):
         device: Optional[Union[str, torch.device]]
             If given, the audio tensor is moved to this device before STFT
 
+        mel_cache: Optional[IncrementalLogMel]
+            If given, frames already computed for this stream are reused and only the
+            frames touched by newly appended samples are computed
+
+        offset: int
+            Stream index of the first sample of `audio`, identifies the window in `mel_cache`
+
         Returns
         -------
         torch.Tensor, shape = (80 or 128, n_frames)
@@ -242,6 +252,9 @@ class WhisperTRTLLM(object):
             assert isinstance(audio,
                             np.ndarray), f"Unsupported audio type: {type(audio)}"
             duration = audio.shape[-1] / SAMPLE_RATE
+            if mel_cache is not None and padding == 0:
+                log_spec = mel_cache(audio, self.filters, offset)
+                return (log_spec, duration) if return_duration else log_spec
             audio = pad_or_trim(audio, N_SAMPLES)
             audio = audio.astype(np.float32)
             audio = torch.from_numpy(audio)
@@ -270,17 +283,63 @@ class WhisperTRTLLM(object):
             return log_spec
 
 
+    def features(self, audio, mel_cache=None, offset=0):
+        """
+        Compute the log-Mel features of an audio window of at most 30 seconds.
+
+        Args:
+            audio (numpy.ndarray): float32 audio window sampled at 16 kHz.
+            mel_cache (IncrementalLogMel, optional): Incremental mel front end of the stream.
+            offset (int, optional): Stream index of the first sample of the window. Defaults to 0.
+
+        Returns:
+            torch.Tensor: The features padded to 30 seconds, shape (n_mels, 3000).
+        """
+        return self.log_mel_spectrogram(audio, return_duration=False, mel_cache=mel_cache, offset=offset)
+
+    def detect_language(self, audio, mel_cache=None, offset=0, dtype='float16'):
+        """
+        Detect the language spoken in an audio window from the first token the decoder emits.
+
+        Args:
+            audio (numpy.ndarray): float32 audio window sampled at 16 kHz.
+            mel_cache (IncrementalLogMel, optional): Incremental mel front end of the stream.
+            offset (int, optional): Stream index of the first sample of the window. Defaults to 0.
+
+        Returns:
+            Tuple[str, float]: The language code and its probability. The engine only returns token
+                ids, so the probability is 1.0 for the greedy pick, or ("en", 0.0) if no language
+                token was produced.
+        """
+        mel = self.features(audio, mel_cache, offset).type(str_dtype_to_torch(dtype)).unsqueeze(0)
+        encoder_output = self.encoder.get_audio_features(mel)
+        prompt_id = torch.tensor([[self.tokenizer.sot]])
+        output_ids = self.decoder.generate(prompt_id,
+                                           encoder_output,
+                                           self.tokenizer.eot,
+                                           max_new_tokens=1)
+        token = output_ids[0][0][prompt_id.shape[-1]]
+        if token in self.tokenizer.all_language_tokens:
+            return self.tokenizer.decode([token])[2:-2], 1.0
+        return "en", 0.0
+
     def process_batch(
             self,
             mel,
             text_prefix="<|startoftranscript|><|en|><|transcribe|><|notimestamps|>",
             num_beams=1):
-        prompt_id = self.tokenizer.encode(
-            text_prefix, allowed_special=set(self.tokenizer.special_tokens.keys()))
-
-        prompt_id = torch.tensor(prompt_id)
         batch_size = mel.shape[0]
-        decoder_input_ids = prompt_id.repeat(batch_size, 1)
+        allowed_special = set(self.tokenizer.special_tokens.keys())
+        if isinstance(text_prefix, str):
+            prompt_id = self.tokenizer.encode(text_prefix, allowed_special=allowed_special)
+            prompt_id = torch.tensor(prompt_id)
+            decoder_input_ids = prompt_id.repeat(batch_size, 1)
+        else:
+            # one prefix per batch item, the special token prefixes all have the same length
+            decoder_input_ids = torch.tensor([
+                self.tokenizer.encode(prefix, allowed_special=allowed_special)
+                for prefix in text_prefix
+            ])
 
         encoder_output = self.encoder.get_audio_features(mel)
         output_ids = self.decoder.generate(decoder_input_ids,
@@ -311,6 +370,50 @@ class WhisperTRTLLM(object):
         prediction = re.sub(r'<\|.*?\|>', '', prediction)
         return prediction.strip()
 
+    def transcribe_batch(
+            self,
+            audios,
+            languages,
+            tasks=None,
+            mel_caches=None,
+            offsets=None,
+            dtype='float16',
+            num_beams=1,
+            ):
+        """
+        Transcribe several audio windows of at most 30 seconds with one encoder and one decoder call.
+
+        Args:
+            audios (List[numpy.ndarray]): float32 audio windows sampled at 16 kHz.
+            languages (List[str]): Language code of each window, None to detect it.
+            tasks (List[str], optional): Task of each window. Defaults to "transcribe" for all.
+            mel_caches (List[IncrementalLogMel], optional): Per-stream mel cache of each window.
+            offsets (List[int], optional): Stream index of the first sample of each window.
+
+        Returns:
+            List[str]: The transcription of each window.
+        """
+        if tasks is None:
+            tasks = ["transcribe"] * len(audios)
+        if mel_caches is None:
+            mel_caches = [None] * len(audios)
+        if offsets is None:
+            offsets = [0] * len(audios)
+        languages = [
+            language if language is not None else self.detect_language(audio, mel_cache, offset)[0]
+            for language, audio, mel_cache, offset in zip(languages, audios, mel_caches, offsets)
+        ]
+        mel = torch.stack([
+            self.features(audio, mel_cache, offset)
+            for audio, mel_cache, offset in zip(audios, mel_caches, offsets)
+        ]).type(str_dtype_to_torch(dtype))
+        text_prefixes = [
+            f"<|startoftranscript|><|{language}|><|{task}|><|notimestamps|>"
+            for language, task in zip(languages, tasks)
+        ]
+        predictions = self.process_batch(mel, text_prefixes, num_beams)
+        return [re.sub(r'<\|.*?\|>', '', prediction).strip() for prediction in predictions]
+
 
 def decode_wav_file(
         model,
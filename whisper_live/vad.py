@@ -4,34 +4,71 @@ import logging
 logging.basicConfig(level = logging.INFO)
 
 import os
+import queue
 import subprocess
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache
 import torch
 import numpy as np
 import onnxruntime
 
 
-class VoiceActivityDetection():
+@lru_cache(maxsize=None)
+def load_session(force_onnx_cpu=True):
+    """
+    Load the Silero VAD ONNX Runtime session, once per process.
 
-    def __init__(self, force_onnx_cpu=True):
-        print("downloading ONNX model...")
-        path = self.download()
-        logging.info(path)
-        print("loading session")
+    `InferenceSession.run` is thread-safe, so a single session is shared by every client;
+    the recurrent state of each stream lives in a separate `VadState`.
 
-        opts = onnxruntime.SessionOptions()
-        opts.log_severity_level = 3
+    Args:
+        force_onnx_cpu (bool, optional): Run on the CPU execution provider if available. Defaults to True.
 
-        opts.inter_op_num_threads = 1
-        opts.intra_op_num_threads = 1
+    Returns:
+        onnxruntime.InferenceSession: The shared VAD session.
+    """
+    path = VoiceActivityDetection.download()
+    logging.info(f"[VAD INFO:] Loading ONNX model from {path}")
 
-        print("loading onnx model")
-        if force_onnx_cpu and 'CPUExecutionProvider' in onnxruntime.get_available_providers():
-            self.session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'], sess_options=opts)
-        else:
-            self.session = onnxruntime.InferenceSession(path, providers=['CUDAExecutionProvider'], sess_options=opts)
+    opts = onnxruntime.SessionOptions()
+    opts.log_severity_level = 3
+
+    opts.inter_op_num_threads = 1
+    opts.intra_op_num_threads = 1
+
+    if force_onnx_cpu and 'CPUExecutionProvider' in onnxruntime.get_available_providers():
+        return onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'], sess_options=opts)
+    return onnxruntime.InferenceSession(path, providers=['CUDAExecutionProvider'], sess_options=opts)
+
+
+class VadState():
+    """
+    Recurrent LSTM state of the Silero VAD for one audio stream.
+
+    Attributes:
+        h (numpy.ndarray): LSTM hidden state of shape (2, batch_size, 64).
+        c (numpy.ndarray): LSTM cell state of shape (2, batch_size, 64).
+        last_sr (int): Sampling rate of the previous chunk, 0 before the first one.
+        last_batch_size (int): Batch size of the previous chunk, 0 before the first one.
+    """
+
+    def __init__(self, batch_size=1):
+        self.reset(batch_size)
+
+    def reset(self, batch_size=1):
+        self.h = np.zeros((2, batch_size, 64)).astype('float32')
+        self.c = np.zeros((2, batch_size, 64)).astype('float32')
+        self.last_sr = 0
+        self.last_batch_size = 0
 
-        print("reset states")
-        self.reset_states()
+
+class VoiceActivityDetection():
+
+    def __init__(self, force_onnx_cpu=True):
+        self.session = load_session(force_onnx_cpu)
+        self.state = VadState()
         self.sample_rates = [8000, 16000]
 
     def _validate_input(self, x, sr: int):
@@ -54,32 +91,43 @@ class VoiceActivityDetection():
         return x, sr
 
     def reset_states(self, batch_size=1):
-        self._h = np.zeros((2, batch_size, 64)).astype('float32')
-        self._c = np.zeros((2, batch_size, 64)).astype('float32')
-        self._last_sr = 0
-        self._last_batch_size = 0
+        self.state.reset(batch_size)
+
+    def __call__(self, x, sr: int, state=None):
+        """
+        Run the VAD on one chunk of audio.
 
-    def __call__(self, x, sr: int):
+        Args:
+            x (torch.Tensor): Audio chunk of shape (num_samples,) or (batch_size, num_samples).
+            sr (int): Sampling rate of the chunk.
+            state (VadState, optional): Recurrent state of the stream, updated in place.
+                Defaults to the state owned by this instance.
+
+        Returns:
+            torch.Tensor: Speech probability of shape (batch_size, 1).
+        """
+        if state is None:
+            state = self.state
 
         x, sr = self._validate_input(x, sr)
         batch_size = x.shape[0]
 
-        if not self._last_batch_size:
-            self.reset_states(batch_size)
-        if (self._last_sr) and (self._last_sr != sr):
-            self.reset_states(batch_size)
-        if (self._last_batch_size) and (self._last_batch_size != batch_size):
-            self.reset_states(batch_size)
+        if not state.last_batch_size:
+            state.reset(batch_size)
+        if (state.last_sr) and (state.last_sr != sr):
+            state.reset(batch_size)
+        if (state.last_batch_size) and (state.last_batch_size != batch_size):
+            state.reset(batch_size)
 
         if sr in [8000, 16000]:
-            ort_inputs = {'input': x.numpy(), 'h': self._h, 'c': self._c, 'sr': np.array(sr, dtype='int64')}
+            ort_inputs = {'input': x.numpy(), 'h': state.h, 'c': state.c, 'sr': np.array(sr, dtype='int64')}
             ort_outs = self.session.run(None, ort_inputs)
-            out, self._h, self._c = ort_outs
+            out, state.h, state.c = ort_outs
         else:
             raise ValueError()
 
-        self._last_sr = sr
-        self._last_batch_size = batch_size
+        state.last_sr = sr
+        state.last_batch_size = batch_size
 
         out = torch.tensor(out)
         return out
@@ -112,7 +160,6 @@ class VoiceActivityDetection():
         model_filename = os.path.join(target_dir, "silero_vad.onnx")
 
         # Check if the model file already exists
-        os.remove(model_filename)
         if not os.path.exists(model_filename):
             # If it doesn't exist, download the model using wget
             logging.info("Downloading VAD ONNX model...")
@@ -120,4 +167,146 @@ class VoiceActivityDetection():
                 subprocess.run(["wget", "-O", model_filename, model_url], check=True)
             except subprocess.CalledProcessError:
                 print("Failed to download the model using wget.")
-        return model_filename
\ No newline at end of file
+                # do not leave a truncated model behind for the next start
+                if os.path.exists(model_filename):
+                    os.remove(model_filename)
+        return model_filename
+
+
+class VadBatcher():
+    """
+    Runs the VAD for all connected clients in shared batches.
+
+    Every connection thread submits its latest frame together with its `VadState`; a single
+    worker collects frames for at most `max_wait` seconds (or `max_batch_size` frames), stacks
+    the frames and the LSTM states of all clients along the batch dimension, runs one
+    `session.run` and scatters the probabilities and updated states back. Calling a VadBatcher
+    looks exactly like calling a `VoiceActivityDetection` with an explicit state.
+
+    Attributes:
+        vad_model (VoiceActivityDetection): Model whose shared session runs the batches.
+        max_batch_size (int): Maximum number of frames per session call.
+        max_wait (float): Seconds to collect frames after the first one arrives.
+    """
+
+    def __init__(self, vad_model, max_batch_size=64, max_wait=0.002):
+        self.vad_model = vad_model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.exit = False
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def __call__(self, x, sr: int, state):
+        """
+        Run the VAD on one chunk of a client's audio as part of the next batch.
+
+        Args:
+            x (torch.Tensor): Audio chunk of shape (num_samples,).
+            sr (int): Sampling rate of the chunk.
+            state (VadState): Recurrent state of the client's stream, updated in place.
+
+        Returns:
+            torch.Tensor: Speech probability of shape (1, 1).
+        """
+        x, sr = self.vad_model._validate_input(x, sr)
+        future = Future()
+        self.requests.put((x.numpy()[0], sr, state, future))
+        return future.result()
+
+    def collect_batch(self):
+        try:
+            batch = [self.requests.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    batch.append(self.requests.get(timeout=remaining))
+                else:
+                    batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run_group(self, group):
+        """Run one session call for requests sharing frame length and sampling rate."""
+        sr = group[0][1]
+        for _, _, state, _ in group:
+            if not state.last_batch_size or state.last_sr != sr or state.last_batch_size != 1:
+                state.reset(1)
+
+        ort_inputs = {
+            'input': np.stack([frame for frame, _, _, _ in group]),
+            'h': np.concatenate([state.h for _, _, state, _ in group], axis=1),
+            'c': np.concatenate([state.c for _, _, state, _ in group], axis=1),
+            'sr': np.array(sr, dtype='int64'),
+        }
+        out, h, c = self.vad_model.session.run(None, ort_inputs)
+
+        for i, (_, _, state, future) in enumerate(group):
+            state.h = h[:, i:i + 1].copy()
+            state.c = c[:, i:i + 1].copy()
+            state.last_sr = sr
+            state.last_batch_size = 1
+            future.set_result(torch.tensor(out[i:i + 1]))
+
+    def run(self):
+        """Worker loop running VAD batches until `stop` is called."""
+        while not self.exit:
+            groups = {}
+            for request in self.collect_batch():
+                groups.setdefault((request[0].shape[0], request[1]), []).append(request)
+            for group in groups.values():
+                try:
+                    self.run_group(group)
+                except Exception as e:
+                    logging.exception(f"[VAD ERROR:] Batched VAD failed: {e}")
+                    for _, _, _, future in group:
+                        if not future.done():
+                            future.set_exception(e)
+
+    def stop(self):
+        """Stop the worker thread once its current batch is done."""
+        self.exit = True
+        self.worker.join()
+
+
+if __name__ == "__main__":
+    # benchmark: VAD frames/s against the number of concurrent clients, one session call per
+    # client frame vs. one batched session call per round of client frames
+    FRAME = 4096
+    RATE = 16000
+    ROUNDS = 50
+    vad_model = VoiceActivityDetection()
+    batcher = VadBatcher(vad_model, max_batch_size=256)
+
+    for n_clients in (1, 4, 16, 64):
+        frames = [torch.from_numpy(np.random.uniform(-0.1, 0.1, FRAME).astype(np.float32)) for _ in range(n_clients)]
+
+        states = [VadState() for _ in range(n_clients)]
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            for frame, state in zip(frames, states):
+                vad_model(frame, RATE, state=state)
+        unbatched = n_clients * ROUNDS / (time.perf_counter() - start)
+
+        states = [VadState() for _ in range(n_clients)]
+
+        def client(frame, state):
+            for _ in range(ROUNDS):
+                batcher(frame, RATE, state)
+
+        threads = [threading.Thread(target=client, args=(frame, state)) for frame, state in zip(frames, states)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        batched = n_clients * ROUNDS / (time.perf_counter() - start)
+
+        print(f"{n_clients:3d} clients | unbatched: {unbatched:8.0f} frames/s | batched: {batched:8.0f} frames/s")
+    batcher.stop()
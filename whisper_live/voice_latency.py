@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import json
+import shlex
+import subprocess
+import sys
+import time
+import uuid
+import wave
+
+import numpy as np
+import websockets
+
+from whisper_live.audio_format import encode_frame
+
+RATE = 16000
+
+
+def load_wav(path):
+    """
+    Read a 16 kHz mono 16-bit WAV file.
+
+    Returns:
+        numpy.ndarray: The int16 samples.
+
+    Raises:
+        ValueError: If the file has another format.
+    """
+    with wave.open(path, "rb") as wav:
+        if wav.getframerate() != RATE or wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+            raise ValueError(f"{path} must be 16 kHz mono 16-bit PCM")
+        return np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+
+
+class VoiceSession:
+    """
+    One user talking to a running pipeline, connected like the web client in examples/chatbot.
+
+    The STT, LLM and TTS sockets are opened with the same uid. Audio is sent in real time and
+    silence is sent between utterances, as a microphone would, so the server-side VAD detects
+    the end of speech exactly as in production.
+
+    Attributes:
+        first_llm_output (float): Time the first LLM output of the current turn arrived.
+        first_audio (float): Time the first TTS audio of the current turn arrived.
+    """
+
+    def __init__(self, host, stt_port, llm_port, tts_port, chunk=1024, audio_format="int16"):
+        self.uris = [f"ws://{host}:{port}" for port in (stt_port, llm_port, tts_port)]
+        self.chunk = chunk
+        self.audio_format = audio_format
+        self.uid = str(uuid.uuid4())
+        self.last_message_id = -1
+        self.turn_started = False
+        self.first_llm_output = None
+        self.first_audio = None
+        self.turn_done = asyncio.Event()
+        self.readers = []
+
+    async def open(self, timeout):
+        """Connect the three sockets and wait until the transcription server admitted the user."""
+        self.stt, self.llm, self.tts = [
+            await websockets.connect(uri, open_timeout=timeout, max_size=None) for uri in self.uris
+        ]
+        await self.stt.send(json.dumps({
+            "uid": self.uid, "multilingual": False, "input_language": "en",
+            "output_language": "en", "task": "transcribe", "audio_format": self.audio_format,
+        }))
+        await self.llm.send(json.dumps({"uid": self.uid}))
+        await self.tts.send(json.dumps({"id": self.uid}))
+        while json.loads(await self.stt.recv()).get("message") != "SERVER_READY":
+            pass
+        self.readers = [asyncio.create_task(self.read_stt()), asyncio.create_task(self.read_tts())]
+
+    async def read_stt(self):
+        async for message in self.stt:
+            if "llm_output" in json.loads(message) and self.turn_started and self.first_llm_output is None:
+                self.first_llm_output = time.time()
+
+    async def read_tts(self):
+        async for message in self.tts:
+            # 4-byte message id followed by the audio, audio of an earlier turn is ignored
+            message_id = int.from_bytes(message[:4], "big")
+            if self.turn_started and message_id > self.last_message_id:
+                self.last_message_id = message_id
+                self.first_audio = time.time()
+                self.turn_done.set()
+
+    async def send_audio(self, audio):
+        for start in range(0, audio.shape[0], self.chunk):
+            await self.stt.send(encode_frame(audio[start:start + self.chunk], self.audio_format))
+            await asyncio.sleep(self.chunk / RATE)
+
+    async def send_silence_until(self, done, timeout):
+        silence = np.zeros(self.chunk, dtype=np.int16)
+        deadline = time.time() + timeout
+        while not done() and time.time() < deadline:
+            await self.send_audio(silence)
+
+    async def turn(self, audio, timeout):
+        """
+        Speak one utterance and wait for the start of the spoken answer.
+
+        Returns:
+            Tuple[Optional[float], Optional[float]]: Seconds from the end of speech to the first
+                LLM output and to the first TTS audio, None if it did not arrive within `timeout`.
+        """
+        self.first_llm_output = self.first_audio = None
+        self.turn_done.clear()
+        self.turn_started = False
+        await self.send_audio(audio)
+        end_of_speech = time.time()
+        self.turn_started = True
+        await self.send_silence_until(self.turn_done.is_set, timeout)
+        self.turn_started = False
+        return tuple(
+            None if arrived is None else arrived - end_of_speech
+            for arrived in (self.first_llm_output, self.first_audio)
+        )
+
+    async def close(self):
+        for reader in self.readers:
+            reader.cancel()
+        for websocket in (self.stt, self.llm, self.tts):
+            await websocket.close()
+
+
+def summarize(name, latencies):
+    received = [latency for latency in latencies if latency is not None]
+    if not received:
+        return f"{name}: no answer in {len(latencies)} turns"
+    received.sort()
+    return (f"{name}: {len(received)}/{len(latencies)} turns, mean {1000 * np.mean(received):.0f}ms, "
+            f"p50 {1000 * received[len(received) // 2]:.0f}ms, max {1000 * received[-1]:.0f}ms")
+
+
+async def measure(args, audio):
+    session = VoiceSession(args.host, args.stt_port, args.llm_port, args.tts_port, args.chunk, args.audio_format)
+    await session.open(args.startup_timeout)
+    llm_latencies, audio_latencies = [], []
+    try:
+        for _ in range(args.turns):
+            llm_latency, audio_latency = await session.turn(audio, args.timeout)
+            llm_latencies.append(llm_latency)
+            audio_latencies.append(audio_latency)
+            # let the rest of the answer play out before the next utterance
+            await session.send_silence_until(lambda: False, args.pause)
+    finally:
+        await session.close()
+    return llm_latencies, audio_latencies
+
+
+async def wait_for_pipeline(args, process):
+    """Retry connecting until the launched pipeline serves clients, its warmup takes minutes."""
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"api_main.py exited with code {process.returncode}")
+        try:
+            websocket = await websockets.connect(f"ws://{args.host}:{args.tts_port}", open_timeout=5)
+            await websocket.close()
+            return
+        except (OSError, asyncio.TimeoutError, websockets.InvalidHandshake):
+            await asyncio.sleep(2.0)
+    raise TimeoutError("The pipeline did not start in time")
+
+
+def run(args):
+    audio = load_wav(args.audio)
+    if args.launch is None:
+        results = {"running pipeline": asyncio.run(measure(args, audio))}
+    else:
+        results = {}
+        for mode, flags in (("processes", []), ("single process", ["--single_process"])):
+            command = [sys.executable, "api_main.py"] + shlex.split(args.launch) + flags
+            process = subprocess.Popen(command)
+            try:
+                asyncio.run(wait_for_pipeline(args, process))
+                results[mode] = asyncio.run(measure(args, audio))
+            finally:
+                process.terminate()
+                process.wait()
+
+    print(f"end of speech to first output, {args.turns} turns of {audio.shape[0] / RATE:.1f}s:")
+    for mode, (llm_latencies, audio_latencies) in results.items():
+        print(f"  {mode}")
+        print(f"    {summarize('LLM text ', llm_latencies)}")
+        print(f"    {summarize('TTS audio', audio_latencies)}")
+
+
+if __name__ == "__main__":
+    # voice-to-voice latency: from the last spoken sample sent to the first TTS audio received
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--audio', type=str, required=True, help='16 kHz mono 16-bit WAV file of one utterance')
+    parser.add_argument('--turns', type=int, default=10, help='Number of utterances spoken')
+    parser.add_argument('--launch', type=str, default=None,
+                        help='Arguments of api_main.py, e.g. "--api_url ... --whisper_backend ctranslate2 '
+                             '--whisper_model small.en". Starts the pipeline once as processes and once '
+                             'with --single_process and compares both, otherwise measures a running pipeline')
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--stt_port', type=int, default=6006)
+    parser.add_argument('--llm_port', type=int, default=7123)
+    parser.add_argument('--tts_port', type=int, default=8888)
+    parser.add_argument('--chunk', type=int, default=1024, help='Samples per audio frame')
+    parser.add_argument('--audio_format', type=str, default="int16")
+    parser.add_argument('--timeout', type=float, default=30.0, help='Seconds to wait for the answer of a turn')
+    parser.add_argument('--pause', type=float, default=5.0, help='Seconds of silence between turns')
+    parser.add_argument('--startup_timeout', type=float, default=900.0, help='Seconds to wait for the pipeline')
+    run(parser.parse_args())
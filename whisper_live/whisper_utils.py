@@ -26,6 +26,8 @@ import soundfile
 import torch
 import torch.nn.functional as F
 
+from whisper_live.mel_frontend import IncrementalLogMel
+
 Pathlike = Union[str, Path]
 
 SAMPLE_RATE = 16000
@@ -135,6 +137,8 @@ def log_mel_spectrogram(
     device: Optional[Union[str, torch.device]] = None,
     return_duration: bool = False,
     mel_filters_dir: str = None,
+    mel_cache: Optional[IncrementalLogMel] = None,
+    offset: int = 0,
 ):
     """
     Compute the log-Mel spectrogram of
@@ -153,6 +157,13 @@ def log_mel_spectrogram(
     device: Optional[Union[str, torch.device]]
         If given, the audio tensor is moved to this device before STFT
 
+    mel_cache: Optional[IncrementalLogMel]
+        If given, frames already computed for this stream are reused and only the
+        frames touched by newly appended samples are computed
+
+    offset: int
+        Stream index of the first sample of `audio`, identifies the window in `mel_cache`
+
     Returns
     -------
     torch.Tensor, shape = (80 or 128, n_frames)
@@ -167,6 +178,10 @@ def log_mel_spectrogram(
         assert isinstance(audio,
                           np.ndarray), f"Unsupported audio type: {type(audio)}"
         duration = audio.shape[-1] / SAMPLE_RATE
+        if mel_cache is not None and padding == 0:
+            filters = mel_filters(device if device is not None else "cpu", n_mels, mel_filters_dir)
+            log_spec = mel_cache(audio, filters, offset)
+            return (log_spec, duration) if return_duration else log_spec
         audio = pad_or_trim(audio, N_SAMPLES)
         audio = audio.astype(np.float32)
         audio = torch.from_numpy(audio)